@@ -7,18 +7,80 @@
 # Addrlib
 # A Python/Cython Address Library for Wii U textures.
 
+from importlib import import_module
+import os
+
+from .cache import addrMapCache, macroTileTemplateCache, surfaceInfoCache
+
 try:
     import pyximport
     pyximport.install()
 
     from . import addrlib_cy as addrlib
 
+    swizzler = addrlib
+
 except:
     from . import addrlib
 
+    # The NumPy backend only replaces the (un)swizzling functions,
+    # the rest is still taken from the pure Python Addrlib
+    try:
+        from . import addrlib_np as swizzler
+
+    except ImportError:
+        from . import addrlib_mv as swizzler
+
+# Modules the (un)swizzling functions can be taken from
+backends = {
+    'cython': 'addrlib_cy',
+    'numpy': 'addrlib_np',
+    'memoryview': 'addrlib_mv',  # Standard library only
+    'python': 'addrlib',
+}
+
 # Define the functions that can be used
 getDefaultGX2TileMode = addrlib.getDefaultGX2TileMode
-deswizzle = addrlib.deswizzle
-swizzle = addrlib.swizzle
+deswizzle = swizzler.deswizzle
+swizzle = swizzler.swizzle
+deswizzleInto = swizzler.deswizzleInto
+swizzleInto = swizzler.swizzleInto
+retile = swizzler.retile
+retileInto = swizzler.retileInto
+deswizzleRegion = swizzler.deswizzleRegion
+SurfaceDesc = addrlib.SurfaceDesc
+elementTransforms = addrlib.elementTransforms
 surfaceGetBitsPerPixel = addrlib.surfaceGetBitsPerPixel
 getSurfaceInfo = addrlib.getSurfaceInfo
+getMipChainLayout = addrlib.getMipChainLayout
+
+
+def setBackend(name):
+    """
+    Takes the (un)swizzling functions from the given backend (one of backends).
+    Can also be selected with the ADDRLIB_BACKEND environment variable.
+    Raises ImportError if the backend isn't available.
+    """
+
+    global swizzler, deswizzle, swizzle, deswizzleInto, swizzleInto, retile, retileInto, deswizzleRegion
+
+    if name not in backends:
+        raise ValueError("Unknown backend: %s" % name)
+
+    if name == 'cython':
+        import pyximport
+        pyximport.install()
+
+    swizzler = import_module('.' + backends[name], __name__)
+
+    deswizzle = swizzler.deswizzle
+    swizzle = swizzler.swizzle
+    deswizzleInto = swizzler.deswizzleInto
+    swizzleInto = swizzler.swizzleInto
+    retile = swizzler.retile
+    retileInto = swizzler.retileInto
+    deswizzleRegion = swizzler.deswizzleRegion
+
+
+if os.environ.get('ADDRLIB_BACKEND'):
+    setBackend(os.environ['ADDRLIB_BACKEND'])
@@ -8,6 +8,19 @@
 ################################################################
 ################################################################
 
+from array import array
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import os
+
+from .cache import addrMapCache, macroTileTemplateCache, surfaceInfoCache
+from .tables import (
+    numTileModes, surfaceThickness, surfaceRotation, thickMacroTiled, bankSwappedTileMode, macroTileAspectRatio,
+    pipeTable, bankTable, getPixelIndexTable,
+)
+
+
 BCn_formats = [
     0x31, 0x431, 0x32, 0x432,
     0x33, 0x433, 0x34, 0x234,
@@ -58,8 +71,345 @@ def GX2TileModeToAddrTileMode(tileMode):
     return tileMode
 
 
+def getAddrMapKey(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                  pitch, bitsPerPixel, slice, sample):
+
+    # Only the parameters that affect the addresses are part of the key
+    return (width, height, depth, format_ in BCn_formats, aa, use & 4, tileMode,
+            swizzle_ & 0x700, pitch, bitsPerPixel, slice, sample)
+
+
+def computeSurfaceAddrMap(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                          pitch, bitsPerPixel, slice, sample):
+
+    """
+    Returns the swizzled byte address of every element of the surface,
+    as an array('I') in linear (row-major) element order.
+    """
+
+    bytesPerPixel = bitsPerPixel // 8
+
+    if format_ in BCn_formats:
+        width = (width + 3) // 4
+        height = (height + 3) // 4
+
+    addrMap = array('I', [0]) * (width * height)
+
+    pipeSwizzle = (swizzle_ >> 8) & 1
+    bankSwizzle = (swizzle_ >> 9) & 3
+
+    tileMode = GX2TileModeToAddrTileMode(tileMode)
+    isDepth = bool(use & 4)
+    numSamples = 1 << aa
+
+    if tileMode in [0, 1]:
+        def computeAddr(x, y):
+            return computeSurfaceAddrFromCoordLinear(x, y, slice, sample, bytesPerPixel, pitch, height, depth)
+
+    elif tileMode in [2, 3]:
+        def computeAddr(x, y):
+            return computeSurfaceAddrFromCoordMicroTiled(x, y, slice, bitsPerPixel, pitch, height, tileMode, isDepth)
+
+    else:
+        def computeAddr(x, y):
+            return computeSurfaceAddrFromCoordMacroTiled(x, y, slice, sample, bitsPerPixel, pitch, height, numSamples,
+                                                         tileMode, isDepth, pipeSwizzle, bankSwizzle)
+
+        microTileBytes = (numSamples * bitsPerPixel * computeSurfaceThickness(tileMode) * 64 + 7) // 8
+        if numSamples > 1 and microTileBytes > 2048:
+            # The samples are split across tile slices,
+            # so the elements of a micro tile don't share the same pipe and bank
+            for y in range(height):
+                for x in range(width):
+                    addrMap[y * width + x] = computeAddr(x, y)
+
+            return addrMap
+
+        fillMacroTiledAddrMap(addrMap, width, height, computeAddr, bitsPerPixel, tileMode, numSamples, isDepth,
+                              slice, sample)
+
+        return addrMap
+
+    # Every micro tile follows the same pattern (relative to its first element)
+    tileBase = computeAddr(0, 0)
+    tileOffsets = [[computeAddr(x, y) - tileBase for x in range(8)] for y in range(8)]
+
+    for tileY in range(0, height, 8):
+        tileHeight = min(8, height - tileY)
+
+        for tileX in range(0, width, 8):
+            tileWidth = min(8, width - tileX)
+            tileAddr = computeAddr(tileX, tileY)
+
+            for y in range(tileHeight):
+                i = (tileY + y) * width + tileX
+                addrMap[i:i + tileWidth] = array('I', [tileAddr + offset for offset in tileOffsets[y][:tileWidth]])
+
+    return addrMap
+
+
+def fillMacroTiledAddrMap(addrMap, width, height, computeAddr, bpp, tileMode, numSamples, isDepth, slice, sample):
+    """
+    Fills the address map of a macro-tiled surface by moving the template of its first macro tile
+    (see getMacroTileTemplate()) to every macro tile, so the full address is only computed once per macro tile.
+    Can't be used if the samples are split across tile slices.
+    """
+
+    macroTilePitch, macroTileHeight = getMacroTileSize(tileMode)
+
+    templateBase = getMacroTileTemplate(bpp, tileMode, numSamples, isDepth, slice, sample, 0)[0][0]
+    templateOffset = templateBase & 255 | (templateBase >> 11) << 8
+
+    for tileY in range(0, height, macroTileHeight):
+        tiles = []
+
+        for tileX in range(0, width, macroTilePitch):
+            tileAddr = computeAddr(tileX, tileY)
+
+            # The offset of the macro tile (without the pipe and bank bits) is added to the template,
+            # and its pipe and bank are XORed with those of the template
+            tileOffset = (tileAddr & 255 | (tileAddr >> 11) << 8) - templateOffset
+            template = getMacroTileTemplate(bpp, tileMode, numSamples, isDepth, slice, sample, tileOffset & 255)
+
+            tiles.append((template, (tileOffset >> 8) << 11, (tileAddr ^ templateBase) & 0x700,
+                          min(macroTilePitch, width - tileX)))
+
+        for y in range(min(macroTileHeight, height - tileY)):
+            row = []
+            for template, tileOffset, bankPipe, tileWidth in tiles:
+                row += [addr + tileOffset ^ bankPipe for addr in template[y][:tileWidth]]
+
+            i = (tileY + y) * width
+            addrMap[i:i + width] = array('I', row)
+
+
+def getAddrMapRunLength(addrMap, width, height, bytesPerPixel):
+    """
+    Returns the number of elements of a row (starting at a multiple of that number)
+    which are guaranteed to be contiguous in the swizzled data as well.
+    All the micro tiles of a surface share the same pattern, so only the first one is checked.
+    """
+
+    runLength = 8
+    while runLength > 1:
+        contiguous = True
+
+        for y in range(min(8, height)):
+            for x in range(min(8, width)):
+                i = y * width + x
+                if x % runLength and addrMap[i] != addrMap[i - 1] + bytesPerPixel:
+                    contiguous = False
+
+        if contiguous:
+            break
+
+        runLength //= 2
+
+    return runLength
+
+
+def getSurfaceAddrMap(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                      pitch, bitsPerPixel, slice, sample, computeAddrMap=computeSurfaceAddrMap):
+
+    """
+    Same as computeSurfaceAddrMap(), but the map is looked up in addrMapCache first.
+    computeAddrMap: function used to build the map if it's not cached yet
+    """
+
+    key = getAddrMapKey(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                        pitch, bitsPerPixel, slice, sample)
+
+    addrMap = addrMapCache.get(key)
+    if addrMap is None:
+        addrMap = addrMapCache.put(key, computeAddrMap(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                                                       pitch, bitsPerPixel, slice, sample))
+
+    return addrMap
+
+
+def getRowBands(height, tileMode, threads):
+    """
+    Splits the rows of the surface into (at most) one band per thread,
+    every band covering whole macro tile rows (or micro tile rows for the non-macro-tiled modes).
+    threads: number of threads, 0 to use one per CPU
+    """
+
+    if threads <= 0:
+        threads = os.cpu_count() or 1
+
+    tileMode = GX2TileModeToAddrTileMode(tileMode)
+
+    if tileMode in [5, 9]:
+        bandHeight = 32
+
+    elif tileMode in [6, 10]:
+        bandHeight = 64
+
+    elif tileMode > 3:
+        bandHeight = 16
+
+    else:
+        bandHeight = 8
+
+    numBands = (height + bandHeight - 1) // bandHeight
+    threads = max(1, min(threads, numBands))
+
+    return [(numBands * i // threads * bandHeight, min(height, numBands * (i + 1) // threads * bandHeight))
+            for i in range(threads)]
+
+
+def runBands(func, bands):
+    """
+    Calls func(yStart, yEnd) for every band, on a thread pool if there is more than one.
+    """
+
+    if len(bands) == 1:
+        func(*bands[0])
+        return
+
+    with ThreadPoolExecutor(len(bands)) as executor:
+        for future in [executor.submit(func, *band) for band in bands]:
+            future.result()
+
+
+def getResultView(out, offset, dataSize):
+    if out is None:
+        return memoryview(bytearray(dataSize))
+
+    result = memoryview(out).cast('B')
+    if offset + dataSize > len(result):
+        raise ValueError("Output buffer is too small.")
+
+    return result[offset:offset + dataSize]
+
+
+def copyLinearRows(result, src, width, pitch, bytesPerPixel, sliceOffset, linearSize, swizzledSize, swizzle,
+                   yStart, yEnd):
+
+    """
+    Copies rows yStart to yEnd of a linear surface, where the address of an element is
+    (y * pitch + x + sliceOffset) * bytesPerPixel.
+    Every row is copied at once (all of them if pitch == width), up to its first element that is out of bounds.
+    """
+
+    if pitch == width:
+        rows = [(yStart, (yEnd - yStart) * width)]
+
+    else:
+        rows = [(y, width) for y in range(yStart, yEnd)]
+
+    for y, numElements in rows:
+        pos = (y * pitch + sliceOffset) * bytesPerPixel
+        pos_ = y * width * bytesPerPixel
+
+        numElements = min(numElements, (linearSize - pos_) // bytesPerPixel,
+                          (swizzledSize - pos) // bytesPerPixel)
+
+        if numElements <= 0:
+            continue
+
+        size = numElements * bytesPerPixel
+        if swizzle == 0:
+            result[pos_:pos_ + size] = src[pos:pos + size]
+
+        else:
+            result[pos:pos + size] = src[pos_:pos_ + size]
+
+
+def swizzleLinearSurf(width, height, depth, format_, tileMode, pitch, bytesPerPixel, slice, sample,
+                      src, result, linearSize, swizzledSize, swizzle, threads=1):
+
+    if format_ in BCn_formats:
+        width = (width + 3) // 4
+        height = (height + 3) // 4
+
+    if not bytesPerPixel:
+        return
+
+    sliceOffset = pitch * height * (slice + sample * depth)
+    runBands(partial(copyLinearRows, result, src, width, pitch, bytesPerPixel, sliceOffset,
+                     linearSize, swizzledSize, swizzle),
+             getRowBands(height, tileMode, threads))
+
+
+# Conversions swizzleSurf() can apply to every element of a linear surface while swizzling it:
+# name: (size of the source elements, position and width of the field swapped with the lowest one)
+# The 3-byte (RGB8) elements are expanded to 4 bytes, the last one being 0xFF.
+elementTransforms = {
+    'rgb565': (2, 11, 5),
+    'rgb5a1': (2, 10, 5),
+    'rgba4': (2, 8, 4),
+    'bgr10a2': (4, 20, 10),
+    'rgba8': (4, 16, 8),
+    'rgb8': (3, 0, 0),
+    'bgr8': (3, 16, 8),
+}
+
+
+def getElementTransform(transform, bitsPerPixel):
+    """
+    Returns the size of the source elements of the given transform (see elementTransforms),
+    and the position and width of the fields it swaps.
+    """
+
+    if transform not in elementTransforms:
+        raise ValueError("Unknown transform: %s" % transform)
+
+    srcBytesPerPixel, shift, bits = elementTransforms[transform]
+    if bitsPerPixel // 8 != (4 if srcBytesPerPixel == 3 else srcBytesPerPixel):
+        raise ValueError("The %s transform can't be used with %d-bit elements." % (transform, bitsPerPixel))
+
+    return srcBytesPerPixel, shift, bits
+
+
+def getTransformedSize(size, bitsPerPixel, transform):
+    # Size of the given linear data once transformed
+    if transform is None:
+        return size
+
+    return size // getElementTransform(transform, bitsPerPixel)[0] * (bitsPerPixel // 8)
+
+
+def swizzleTransformedSurf(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                           pitch, bitsPerPixel, slice, sample, src, result, transform, threads=1):
+
+    """
+    Swizzles src into result like swizzleSurf(), converting every element with the given transform
+    (see elementTransforms) as it's moved, instead of in a separate pass.
+    """
+
+    bytesPerPixel = bitsPerPixel // 8
+    srcBytesPerPixel, shift, bits = getElementTransform(transform, bitsPerPixel)
+
+    mask = (1 << bits) - 1
+    fill = 0xFF000000 if srcBytesPerPixel == 3 else 0
+
+    # Linear surfaces go through their address map as well
+    addrMap = getSurfaceAddrMap(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                                pitch, bitsPerPixel, slice, sample)
+
+    if format_ in BCn_formats:
+        width = (width + 3) // 4
+        height = (height + 3) // 4
+
+    linearSize, swizzledSize = len(src), len(result)
+
+    def copyRows(yStart, yEnd):
+        for i in range(yStart * width, yEnd * width):
+            pos = addrMap[i]
+            pos_ = i * srcBytesPerPixel
+
+            if pos_ + srcBytesPerPixel <= linearSize and pos + bytesPerPixel <= swizzledSize:
+                value = int.from_bytes(src[pos_:pos_ + srcBytesPerPixel], 'little') | fill
+                value = value & ~(mask | mask << shift) | (value & mask) << shift | (value >> shift) & mask
+                result[pos:pos + bytesPerPixel] = value.to_bytes(bytesPerPixel, 'little')
+
+    runBands(copyRows, getRowBands(height, tileMode, threads))
+
+
 def swizzleSurf(width, height, depth, format_, aa, use, tileMode, swizzle_,
-                pitch, bitsPerPixel, slice, sample, data, dataSize, swizzle):
+                pitch, bitsPerPixel, slice, sample, data, dataSize, swizzle, out=None, offset=0, threads=1,
+                transform=None):
 
     """
     width: width of the surface
@@ -72,58 +422,312 @@ def swizzleSurf(width, height, depth, format_, aa, use, tileMode, swizzle_,
     swizzle_: swizzle of the surface (GX2Surface.swizzle)
     pitch: aligned width of the surface (can be calculated using getSurfaceInfo())
     bitsPerPixel: bits per element for the given format (use surfaceGetBitsPerPixel())
-    data: data to be (un)swizzled
+    data: data to be (un)swizzled (any object supporting the buffer protocol)
+    dataSize: size of the result
     swizzle: boolen where the data will be swizzled if true, otherwise unswizzled
+    out: writable buffer the result will be written to, starting at offset (a new bytearray if None)
+    threads: number of threads the surface is split across (in bands of macro tile rows), 0 to use one per CPU
+    transform: conversion applied to every element while swizzling (see elementTransforms), None for a plain copy
+
+    Returns a memoryview of the result.
     """
 
     bytesPerPixel = bitsPerPixel // 8
-    result = bytearray(len(data))
+    src = memoryview(data).cast('B')
+    result = getResultView(out, offset, dataSize)
+
+    srcSize = len(src)
+
+    if transform is not None:
+        if not swizzle:
+            raise ValueError("Elements can only be transformed while swizzling.")
+
+        swizzleTransformedSurf(width, height, depth, format_, aa, use, tileMode, swizzle_, pitch, bitsPerPixel,
+                               slice, sample, src, result, transform, threads)
+
+        return result
+
+    # Bounds of the linear and swizzled data
+    if swizzle:
+        linearSize, swizzledSize = srcSize, dataSize
+
+    else:
+        linearSize, swizzledSize = dataSize, srcSize
+
+    if GX2TileModeToAddrTileMode(tileMode) in [0, 1]:
+        # Linear surfaces are copied row by row, without any address map
+        swizzleLinearSurf(width, height, depth, format_, tileMode, pitch, bytesPerPixel, slice, sample,
+                          src, result, linearSize, swizzledSize, swizzle, threads)
+
+        return result
+
+    addrMap = getSurfaceAddrMap(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                                pitch, bitsPerPixel, slice, sample)
 
     if format_ in BCn_formats:
         width = (width + 3) // 4
         height = (height + 3) // 4
 
-    pipeSwizzle = (swizzle_ >> 8) & 1
-    bankSwizzle = (swizzle_ >> 9) & 3
+    if not bytesPerPixel:
+        return result
 
-    tileMode = GX2TileModeToAddrTileMode(tileMode)
+    # Copy whole runs of contiguous elements instead of single elements
+    runLength = getAddrMapRunLength(addrMap, width, height, bytesPerPixel)
 
-    for y in range(height):
-        for x in range(width):
-            if tileMode in [0, 1]:
-                pos = computeSurfaceAddrFromCoordLinear(x, y, slice, sample, bytesPerPixel, pitch, height, depth)
+    def copyRows(yStart, yEnd):
+        for y in range(yStart, yEnd):
+            for x in range(0, width, runLength):
+                i = y * width + x
+                runSize = min(runLength, width - x) * bytesPerPixel
 
-            elif tileMode in [2, 3]:
-                pos = computeSurfaceAddrFromCoordMicroTiled(x, y, slice, bitsPerPixel, pitch, height, tileMode, bool(use & 4))
+                pos = addrMap[i]
+                pos_ = i * bytesPerPixel
 
-            else:
-                pos = computeSurfaceAddrFromCoordMacroTiled(x, y, slice, sample, bitsPerPixel, pitch, height, 1 << aa,
-                                                            tileMode, bool(use & 4), pipeSwizzle, bankSwizzle)
+                if pos_ + runSize <= linearSize and pos + runSize <= swizzledSize:
+                    if swizzle == 0:
+                        result[pos_:pos_ + runSize] = src[pos:pos + runSize]
 
-            pos_ = (y * width + x) * bytesPerPixel
+                    else:
+                        result[pos:pos + runSize] = src[pos_:pos_ + runSize]
 
-            if pos_ + bytesPerPixel <= len(data) and pos + bytesPerPixel <= len(data):
-                if swizzle == 0:
-                    result[pos_:pos_ + bytesPerPixel] = data[pos:pos + bytesPerPixel]
+                    continue
 
-                else:
-                    result[pos:pos + bytesPerPixel] = data[pos_:pos_ + bytesPerPixel]
+                for j in range(i, i + runSize // bytesPerPixel):
+                    pos = addrMap[j]
+                    pos_ = j * bytesPerPixel
 
-    return bytes(result)
+                    if pos_ + bytesPerPixel <= linearSize and pos + bytesPerPixel <= swizzledSize:
+                        if swizzle == 0:
+                            result[pos_:pos_ + bytesPerPixel] = src[pos:pos + bytesPerPixel]
+
+                        else:
+                            result[pos:pos + bytesPerPixel] = src[pos_:pos_ + bytesPerPixel]
+
+    runBands(copyRows, getRowBands(height, tileMode, threads))
+
+    return result
+
+
+def getLinearSize(width, height, format_, bpp):
+    if format_ in BCn_formats:
+        width = (width + 3) // 4
+        height = (height + 3) // 4
+
+    return width * height * (bpp // 8)
 
 
 def deswizzle(width, height, depth, format_, aa, use, tileMode, swizzle_,
-              pitch, bpp, slice, sample, data):
+              pitch, bpp, slice, sample, data, threads=1):
 
-    return swizzleSurf(width, height, depth, format_, aa, use, tileMode, swizzle_, pitch, bpp,
-                       slice, sample, data, len(data), False)
+    return bytes(swizzleSurf(width, height, depth, format_, aa, use, tileMode, swizzle_, pitch, bpp,
+                             slice, sample, data, len(data), False, threads=threads))
 
 
 def swizzle(width, height, depth, format_, aa, use, tileMode, swizzle_,
-            pitch, bpp, slice, sample, data):
+            pitch, bpp, slice, sample, data, threads=1, transform=None):
+
+    return bytes(swizzleSurf(width, height, depth, format_, aa, use, tileMode, swizzle_, pitch, bpp,
+                             slice, sample, data, getTransformedSize(len(data), bpp, transform), True,
+                             threads=threads, transform=transform))
+
+
+def deswizzleInto(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                  pitch, bpp, slice, sample, data, out=None, offset=0, size=None, threads=1):
+
+    """
+    Same as deswizzle(), but the result is written to out (starting at offset) without any
+    intermediate copy and a memoryview of it is returned.
+    size: size of the result, the size of the linear image by default
+    """
+
+    if size is None:
+        size = getLinearSize(width, height, format_, bpp)
+
+    return swizzleSurf(width, height, depth, format_, aa, use, tileMode, swizzle_, pitch, bpp,
+                       slice, sample, data, size, False, out, offset, threads)
+
+
+def swizzleInto(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                pitch, bpp, slice, sample, data, out=None, offset=0, size=None, threads=1, transform=None):
+
+    """
+    Same as swizzle(), but the result is written to out (starting at offset) without any
+    intermediate copy and a memoryview of it is returned.
+    size: size of the result (should be surfSize), the size of data (once transformed) by default
+    """
+
+    if size is None:
+        size = getTransformedSize(len(memoryview(data).cast('B')), bpp, transform)
 
     return swizzleSurf(width, height, depth, format_, aa, use, tileMode, swizzle_, pitch, bpp,
-                       slice, sample, data, len(data), True)
+                       slice, sample, data, size, True, out, offset, threads, transform)
+
+
+# Parameters of a surface (or a slice of it), in the same order as taken by deswizzle() and swizzle()
+SurfaceDesc = namedtuple('SurfaceDesc', [
+    'width', 'height', 'depth', 'format_', 'aa', 'use', 'tileMode', 'swizzle_', 'pitch', 'bpp', 'slice', 'sample',
+])
+
+
+def getRetileSize(srcDesc, dstDesc):
+    """
+    Returns the width and height (in elements) of the rows moved by retileSurf().
+    """
+
+    if (srcDesc.width != dstDesc.width or srcDesc.bpp != dstDesc.bpp
+            or (srcDesc.format_ in BCn_formats) != (dstDesc.format_ in BCn_formats)):
+
+        raise ValueError("Both surfaces must have the same width and format.")
+
+    width, height = srcDesc.width, min(srcDesc.height, dstDesc.height)
+
+    if srcDesc.format_ in BCn_formats:
+        width = (width + 3) // 4
+        height = (height + 3) // 4
+
+    return width, height
+
+
+def retileSurf(srcDesc, dstDesc, data, dataSize, out=None, offset=0, threads=1):
+    """
+    srcDesc: SurfaceDesc (or tuple of the same fields) of the layout of data
+    dstDesc: SurfaceDesc of the layout of the result
+    data: swizzled data to be moved (any object supporting the buffer protocol, can't overlap out)
+    dataSize: size of the result
+    out: writable buffer the result will be written to, starting at offset (a new bytearray if None)
+    threads: number of threads the surface is split across, 0 to use one per CPU
+
+    Moves every element from its address in the source layout to its address in the destination layout,
+    without going through a linear intermediate.
+    Both surfaces must have the same width and format, only the rows both of them have are moved.
+
+    Returns a memoryview of the result.
+    """
+
+    srcDesc, dstDesc = SurfaceDesc(*srcDesc), SurfaceDesc(*dstDesc)
+    width, height = getRetileSize(srcDesc, dstDesc)
+
+    bytesPerPixel = srcDesc.bpp // 8
+    src = memoryview(data).cast('B')
+    result = getResultView(out, offset, dataSize)
+
+    srcSize = len(src)
+
+    if not bytesPerPixel:
+        return result
+
+    srcMap = getSurfaceAddrMap(*srcDesc)
+    dstMap = getSurfaceAddrMap(*dstDesc)
+
+    def copyRows(yStart, yEnd):
+        for i in range(yStart * width, yEnd * width):
+            pos = srcMap[i]
+            pos_ = dstMap[i]
+
+            if pos + bytesPerPixel <= srcSize and pos_ + bytesPerPixel <= dataSize:
+                result[pos_:pos_ + bytesPerPixel] = src[pos:pos + bytesPerPixel]
+
+    runBands(copyRows, getRowBands(height, dstDesc.tileMode, threads))
+
+    return result
+
+
+def retile(srcDesc, dstDesc, data, threads=1):
+    return bytes(retileSurf(srcDesc, dstDesc, data, len(data), threads=threads))
+
+
+def retileInto(srcDesc, dstDesc, data, out=None, offset=0, size=None, threads=1):
+    """
+    Same as retile(), but the result is written to out (starting at offset) without any
+    intermediate copy and a memoryview of it is returned.
+    size: size of the result (should be the surfSize of the destination), the size of data by default
+    """
+
+    if size is None:
+        size = len(memoryview(data).cast('B'))
+
+    return retileSurf(srcDesc, dstDesc, data, size, out, offset, threads)
+
+
+def getRegionElements(x, y, w, h, width, height, format_):
+    """
+    Returns the region of w x h pixels starting at pixel (x, y) in elements,
+    extended to the 4x4 blocks covering it for BCn.
+    """
+
+    if w <= 0 or h <= 0 or x < 0 or y < 0 or x + w > width or y + h > height:
+        raise ValueError("Region is outside of the surface.")
+
+    if format_ in BCn_formats:
+        return x // 4, y // 4, (x + w + 3) // 4 - x // 4, (y + h + 3) // 4 - y // 4
+
+    return x, y, w, h
+
+
+def computeSurfaceRegionAddrMap(x, y, w, h, width, height, depth, format_, aa, use, tileMode, swizzle_,
+                                pitch, bitsPerPixel, slice, sample):
+
+    """
+    Same as computeSurfaceAddrMap(), but only for the w x h elements starting at element (x, y),
+    in linear (row-major) order of the region.
+    Every address is computed from its own coordinates, so the cost only depends on the size of the region.
+    """
+
+    bytesPerPixel = bitsPerPixel // 8
+
+    if format_ in BCn_formats:
+        height = (height + 3) // 4
+
+    pipeSwizzle = (swizzle_ >> 8) & 1
+    bankSwizzle = (swizzle_ >> 9) & 3
+
+    tileMode = GX2TileModeToAddrTileMode(tileMode)
+    isDepth = bool(use & 4)
+    numSamples = 1 << aa
+
+    if tileMode in [0, 1]:
+        def computeAddr(x, y):
+            return computeSurfaceAddrFromCoordLinear(x, y, slice, sample, bytesPerPixel, pitch, height, depth)
+
+    elif tileMode in [2, 3]:
+        def computeAddr(x, y):
+            return computeSurfaceAddrFromCoordMicroTiled(x, y, slice, bitsPerPixel, pitch, height, tileMode, isDepth)
+
+    else:
+        def computeAddr(x, y):
+            return computeSurfaceAddrFromCoordMacroTiled(x, y, slice, sample, bitsPerPixel, pitch, height, numSamples,
+                                                         tileMode, isDepth, pipeSwizzle, bankSwizzle)
+
+    return array('I', [computeAddr(x_, y_) for y_ in range(y, y + h) for x_ in range(x, x + w)])
+
+
+def deswizzleRegion(x, y, w, h, width, height, depth, format_, aa, use, tileMode, swizzle_,
+                    pitch, bpp, slice, sample, data):
+
+    """
+    Same as deswizzle(), but only the w x h pixels starting at pixel (x, y) are deswizzled
+    (the 4x4 blocks covering them for BCn), without building the address map of the whole surface.
+    Returns the linear data of the region.
+    """
+
+    x, y, w, h = getRegionElements(x, y, w, h, width, height, format_)
+
+    bytesPerPixel = bpp // 8
+    src = memoryview(data).cast('B')
+    result = bytearray(w * h * bytesPerPixel)
+
+    if not bytesPerPixel:
+        return bytes(result)
+
+    addrMap = computeSurfaceRegionAddrMap(x, y, w, h, width, height, depth, format_, aa, use, tileMode, swizzle_,
+                                          pitch, bpp, slice, sample)
+
+    for i, pos in enumerate(addrMap):
+        if pos + bytesPerPixel <= len(src):
+            pos_ = i * bytesPerPixel
+            result[pos_:pos_ + bytesPerPixel] = src[pos:pos + bytesPerPixel]
+
+    return bytes(result)
 
 
 formatHwInfo = [
@@ -170,127 +774,51 @@ def surfaceGetBitsPerPixel(surfaceFormat):
 
 
 def computeSurfaceThickness(tileMode):
-    if tileMode in [3, 7, 11, 13, 15]:
-        return 4
-
-    elif tileMode in [16, 17]:
-        return 8
+    if tileMode < numTileModes:
+        return surfaceThickness[tileMode]
 
     return 1
 
 
 def computePixelIndexWithinMicroTile(x, y, z, bpp, tileMode, isDepth):
-    pixelBit6 = 0
-    pixelBit7 = 0
-    pixelBit8 = 0
-
     thickness = computeSurfaceThickness(tileMode)
+    pixelIndexTable = getPixelIndexTable(bpp, thickness, isDepth)
 
-    if isDepth:
-        pixelBit0 = x & 1
-        pixelBit1 = y & 1
-        pixelBit2 = (x & 2) >> 1
-        pixelBit3 = (y & 2) >> 1
-        pixelBit4 = (x & 4) >> 2
-        pixelBit5 = (y & 4) >> 2
-
-    else:
-        if bpp == 8:
-            pixelBit0 = x & 1
-            pixelBit1 = (x & 2) >> 1
-            pixelBit2 = (x & 4) >> 2
-            pixelBit3 = (y & 2) >> 1
-            pixelBit4 = y & 1
-            pixelBit5 = (y & 4) >> 2
-
-        elif bpp == 0x10:
-            pixelBit0 = x & 1
-            pixelBit1 = (x & 2) >> 1
-            pixelBit2 = (x & 4) >> 2
-            pixelBit3 = y & 1
-            pixelBit4 = (y & 2) >> 1
-            pixelBit5 = (y & 4) >> 2
-
-        elif bpp in [0x20, 0x60]:
-            pixelBit0 = x & 1
-            pixelBit1 = (x & 2) >> 1
-            pixelBit2 = y & 1
-            pixelBit3 = (x & 4) >> 2
-            pixelBit4 = (y & 2) >> 1
-            pixelBit5 = (y & 4) >> 2
-
-        elif bpp == 0x40:
-            pixelBit0 = x & 1
-            pixelBit1 = y & 1
-            pixelBit2 = (x & 2) >> 1
-            pixelBit3 = (x & 4) >> 2
-            pixelBit4 = (y & 2) >> 1
-            pixelBit5 = (y & 4) >> 2
-
-        elif bpp == 0x80:
-            pixelBit0 = y & 1
-            pixelBit1 = x & 1
-            pixelBit2 = (x & 2) >> 1
-            pixelBit3 = (x & 4) >> 2
-            pixelBit4 = (y & 2) >> 1
-            pixelBit5 = (y & 4) >> 2
-
-        else:
-            pixelBit0 = x & 1
-            pixelBit1 = (x & 2) >> 1
-            pixelBit2 = y & 1
-            pixelBit3 = (x & 4) >> 2
-            pixelBit4 = (y & 2) >> 1
-            pixelBit5 = (y & 4) >> 2
-
-    if thickness > 1:
-        pixelBit6 = z & 1
-        pixelBit7 = (z & 2) >> 1
-
-    if thickness == 8:
-        pixelBit8 = (z & 4) >> 2
-
-    return (pixelBit8 << 8) | (pixelBit7 << 7) | (pixelBit6 << 6) | 32 * pixelBit5 | 16 * pixelBit4 | 8 * pixelBit3 | 4 * pixelBit2 | pixelBit0 | 2 * pixelBit1
+    return pixelIndexTable[(z & (thickness - 1)) << 6 | (y & 7) << 3 | x & 7]
 
 
 def computePipeFromCoordWoRotation(x, y):
-    return ((y >> 3) ^ (x >> 3)) & 1
+    return pipeTable[(x >> 3) & 1 | ((y >> 3) & 1) << 1]
 
 
 def computeBankFromCoordWoRotation(x, y):
-    return ((y >> 5) ^ (x >> 3)) & 1 | 2 * (((y >> 4) ^ (x >> 4)) & 1)
+    return bankTable[(x >> 3) & 3 | ((y >> 4) & 3) << 2]
 
 
 def computeSurfaceRotationFromTileMode(tileMode):
-    if tileMode in [4, 5, 6, 7, 8, 9, 10, 11]:
-        return 2
-
-    elif tileMode in [12, 13, 14, 15]:
-        return 1
+    if tileMode < numTileModes:
+        return surfaceRotation[tileMode]
 
     return 0
 
 
 def isThickMacroTiled(tileMode):
-    if tileMode in [7, 11, 13, 15]:
-        return 1
+    if tileMode < numTileModes:
+        return thickMacroTiled[tileMode]
 
     return 0
 
 
 def isBankSwappedTileMode(tileMode):
-    if tileMode in [8, 9, 10, 11, 14, 15]:
-        return 1
+    if tileMode < numTileModes:
+        return bankSwappedTileMode[tileMode]
 
     return 0
 
 
 def computeMacroTileAspectRatio(tileMode):
-    if tileMode in [5, 9]:
-        return 2
-
-    elif tileMode in [6, 10]:
-        return 4
+    if tileMode < numTileModes:
+        return macroTileAspectRatio[tileMode]
 
     return 1
 
@@ -445,17 +973,63 @@ def computeSurfaceAddrFromCoordMacroTiled(x, y, slice, sample, bpp, pitch, heigh
     return bank << 9 | pipe << 8 | totalOffset & 255 | (totalOffset & -256) << 3
 
 
-expPitch = 0
-expHeight = 0
-expNumSlices = 0
+def getMacroTileSize(tileMode):
+    """
+    Returns the width and height of a macro tile, in elements.
+    """
+
+    if tileMode in [5, 9]:
+        return 16, 32
+
+    elif tileMode in [6, 10]:
+        return 8, 64
+
+    return 32, 16
+
+
+def getMacroTileTemplate(bpp, tileMode, numSamples, isDepth, slice, sample, offset):
+    """
+    Returns the addresses of the elements of the first macro tile of a slice, as a list of rows,
+    without any slice offset, pipe swizzle or bank swizzle and with offset added to their offset within a pipe and bank.
+    Within a slice, the address of an element is the one of the same element of the template
+    with a multiple of 256 added to that offset, and its pipe and bank XORed with a constant (both per macro tile).
+    The templates are memoized in macroTileTemplateCache.
+    """
+
+    thickness = computeSurfaceThickness(tileMode)
+    key = (bpp, tileMode, numSamples, bool(isDepth), slice & (thickness - 1), sample, offset)
+
+    template = macroTileTemplateCache.get(key)
+    if template is None:
+        macroTilePitch, macroTileHeight = getMacroTileSize(tileMode)
+        template = []
+
+        for y in range(macroTileHeight):
+            row = []
+            for x in range(macroTilePitch):
+                addr = computeSurfaceAddrFromCoordMacroTiled(x, y, key[4], sample, bpp, macroTilePitch,
+                                                             macroTileHeight, numSamples, tileMode, isDepth, 0, 0)
+
+                elemOffset = (addr & 255 | (addr >> 11) << 8) + offset
+                row.append(addr & 0x700 | elemOffset & 255 | (elemOffset >> 8) << 11)
+
+            template.append(row)
+
+        template = macroTileTemplateCache.put(key, template)
+
+    return template
 
 
 class Flags:
+    __slots__ = ('value',)
+
     def __init__(self):
         self.value = 0
 
 
 class tileInfo:
+    __slots__ = ('banks', 'bankWidth', 'bankHeight', 'macroAspectRatio', 'tileSplitBytes', 'pipeConfig')
+
     def __init__(self):
         self.banks = 0
         self.bankWidth = 0
@@ -466,6 +1040,11 @@ class tileInfo:
 
 
 class surfaceIn:
+    __slots__ = (
+        'size', 'tileMode', 'format', 'bpp', 'numSamples', 'width', 'height', 'numSlices', 'slice',
+        'mipLevel', 'flags', 'numFrags', 'pTileInfo', 'tileIndex',
+    )
+
     def __init__(self):
         self.size = 0
         self.tileMode = 0
@@ -484,6 +1063,12 @@ class surfaceIn:
 
 
 class surfaceOut:
+    __slots__ = (
+        'size', 'pitch', 'height', 'depth', 'surfSize', 'tileMode', 'baseAlign', 'pitchAlign', 'heightAlign',
+        'depthAlign', 'bpp', 'pixelPitch', 'pixelHeight', 'pixelBits', 'sliceSize', 'pitchTileMax',
+        'heightTileMax', 'sliceTileMax', 'pTileInfo', 'tileType', 'tileIndex',
+    )
+
     def __init__(self):
         self.size = 0
         self.pitch = 0
@@ -508,8 +1093,22 @@ class surfaceOut:
         self.tileIndex = 0
 
 
-pIn = surfaceIn()
-pOut = surfaceOut()
+TileInfo = namedtuple('TileInfo', [
+    'banks', 'bankWidth', 'bankHeight', 'macroAspectRatio', 'tileSplitBytes', 'pipeConfig',
+])
+
+
+SurfaceInfo = namedtuple('SurfaceInfo', [
+    'size', 'pitch', 'height', 'depth', 'surfSize', 'tileMode', 'baseAlign', 'pitchAlign', 'heightAlign',
+    'depthAlign', 'bpp', 'pixelPitch', 'pixelHeight', 'pixelBits', 'sliceSize', 'pitchTileMax',
+    'heightTileMax', 'sliceTileMax', 'pTileInfo', 'tileType', 'tileIndex',
+])
+
+
+def surfaceOutToSurfaceInfo(pSurfOut):
+    # Return an immutable copy, so that the result can be shared freely
+    return SurfaceInfo._make(getattr(pSurfOut, name) for name in SurfaceInfo._fields)._replace(
+        pTileInfo=TileInfo._make(getattr(pSurfOut.pTileInfo, name) for name in TileInfo._fields))
 
 
 def powTwoAlign(x, align):
@@ -534,7 +1133,7 @@ def getBitsPerPixel(format_):
             formatExInfo[fmtIdx + 2], formatExInfo[fmtIdx + 3])
 
 
-def adjustSurfaceInfo(elemMode, expandX, expandY, bpp, width, height):
+def adjustSurfaceInfo(pIn, elemMode, expandX, expandY, bpp, width, height):
     bBCnFormat = 0
     if bpp and elemMode in [9, 10, 11, 12, 13]:
         bBCnFormat = 1
@@ -583,7 +1182,7 @@ def adjustSurfaceInfo(elemMode, expandX, expandY, bpp, width, height):
     return 0
 
 
-def hwlComputeMipLevel():
+def hwlComputeMipLevel(pIn):
     handled = 0
 
     if 49 <= pIn.format <= 55:
@@ -612,7 +1211,7 @@ def hwlComputeMipLevel():
     return handled
 
 
-def computeMipLevel():
+def computeMipLevel(pIn):
     slices = 0
     height = 0
     width = 0
@@ -622,7 +1221,7 @@ def computeMipLevel():
         pIn.width = powTwoAlign(pIn.width, 4)
         pIn.height = powTwoAlign(pIn.height, 4)
 
-    hwlHandled = hwlComputeMipLevel()
+    hwlHandled = hwlComputeMipLevel(pIn)
     if not hwlHandled and pIn.mipLevel and (pIn.flags.value >> 12) & 1:
         width = max(1, pIn.width >> pIn.mipLevel)
         height = max(1, pIn.height >> pIn.mipLevel)
@@ -769,11 +1368,7 @@ def computeSurfaceMipLevelTileMode(baseTileMode, bpp, level, width, height, numS
         1)
 
 
-def padDimensions(tileMode, padDims, isCube, pitchAlign, heightAlign, sliceAlign):
-    global expPitch
-    global expHeight
-    global expNumSlices
-
+def padDimensions(expPitch, expHeight, expNumSlices, tileMode, padDims, isCube, pitchAlign, heightAlign, sliceAlign):
     thickness = computeSurfaceThickness(tileMode)
     if not padDims:
         padDims = 3
@@ -828,11 +1423,7 @@ def computeSurfaceAlignmentsLinear(tileMode, bpp, flags):
     return baseAlign, pitchAlign, heightAlign
 
 
-def computeSurfaceInfoLinear(tileMode, bpp, numSamples, pitch, height, numSlices, mipLevel, padDims, flags):
-    global expPitch
-    global expHeight
-    global expNumSlices
-
+def computeSurfaceInfoLinear(pOut, tileMode, bpp, numSamples, pitch, height, numSlices, mipLevel, padDims, flags):
     expPitch = pitch
     expHeight = height
     expNumSlices = numSlices
@@ -863,6 +1454,9 @@ def computeSurfaceInfoLinear(tileMode, bpp, numSamples, pitch, height, numSlices
             expNumSlices = nextPow2(numSlices)
 
     expPitch, expHeight, expNumSlices = padDimensions(
+        expPitch,
+        expHeight,
+        expNumSlices,
         tileMode,
         padDims,
         (flags.value >> 4) & 1,
@@ -900,11 +1494,7 @@ def computeSurfaceAlignmentsMicroTiled(tileMode, bpp, flags, numSamples):
     return baseAlign, pitchAlign, heightAlign
 
 
-def computeSurfaceInfoMicroTiled(tileMode, bpp, numSamples, pitch, height, numSlices, mipLevel, padDims, flags):
-    global expPitch
-    global expHeight
-    global expNumSlices
-
+def computeSurfaceInfoMicroTiled(pOut, tileMode, bpp, numSamples, pitch, height, numSlices, mipLevel, padDims, flags):
     expTileMode = tileMode
     expPitch = pitch
     expHeight = height
@@ -939,6 +1529,9 @@ def computeSurfaceInfoMicroTiled(tileMode, bpp, numSamples, pitch, height, numSl
         numSamples)
 
     expPitch, expHeight, expNumSlices = padDimensions(
+        expPitch,
+        expHeight,
+        expNumSlices,
         expTileMode,
         padDims,
         (flags.value >> 4) & 1,
@@ -991,11 +1584,7 @@ def computeSurfaceAlignmentsMacroTiled(tileMode, bpp, flags, numSamples):
     return baseAlign, pitchAlign, heightAlign, macroTileWidth, macroTileHeight
 
 
-def computeSurfaceInfoMacroTiled(tileMode, baseTileMode, bpp, numSamples, pitch, height, numSlices, mipLevel, padDims, flags):
-    global expPitch
-    global expHeight
-    global expNumSlices
-
+def computeSurfaceInfoMacroTiled(pOut, tileMode, baseTileMode, bpp, numSamples, pitch, height, numSlices, mipLevel, padDims, flags):
     expPitch = pitch
     expHeight = height
     expNumSlices = numSlices
@@ -1035,6 +1624,9 @@ def computeSurfaceInfoMacroTiled(tileMode, baseTileMode, bpp, numSamples, pitch,
             pitchAlign = bankSwappedWidth
 
         expPitch, expHeight, expNumSlices = padDimensions(
+            expPitch,
+            expHeight,
+            expNumSlices,
             tileMode,
             padDims,
             (flags.value >> 4) & 1,
@@ -1066,6 +1658,7 @@ def computeSurfaceInfoMacroTiled(tileMode, baseTileMode, bpp, numSamples, pitch,
             expTileMode = 2
 
             result = computeSurfaceInfoMicroTiled(
+                pOut,
                 2,
                 bpp,
                 numSamples,
@@ -1088,6 +1681,9 @@ def computeSurfaceInfoMacroTiled(tileMode, baseTileMode, bpp, numSamples, pitch,
                 pitchAlign = bankSwappedWidth
 
             expPitch, expHeight, expNumSlices = padDimensions(
+                expPitch,
+                expHeight,
+                expNumSlices,
                 tileMode,
                 padDims,
                 (flags.value >> 4) & 1,
@@ -1109,7 +1705,7 @@ def computeSurfaceInfoMacroTiled(tileMode, baseTileMode, bpp, numSamples, pitch,
     return result
 
 
-def ComputeSurfaceInfoEx():
+def ComputeSurfaceInfoEx(pIn, pOut):
     tileMode = pIn.tileMode
     bpp = pIn.bpp
     numSamples = max(1, pIn.numSamples)
@@ -1143,6 +1739,7 @@ def ComputeSurfaceInfoEx():
 
     if tileMode in [0, 1]:
         valid = computeSurfaceInfoLinear(
+            pOut,
             tileMode,
             bpp,
             numSamples,
@@ -1157,6 +1754,7 @@ def ComputeSurfaceInfoEx():
 
     elif tileMode in [2, 3]:
         valid = computeSurfaceInfoMicroTiled(
+            pOut,
             tileMode,
             bpp,
             numSamples,
@@ -1169,6 +1767,7 @@ def ComputeSurfaceInfoEx():
 
     elif tileMode in [4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15]:
         valid = computeSurfaceInfoMacroTiled(
+            pOut,
             tileMode,
             baseTileMode,
             bpp,
@@ -1186,7 +1785,7 @@ def ComputeSurfaceInfoEx():
     return 0
 
 
-def restoreSurfaceInfo(elemMode, expandX, expandY, bpp):
+def restoreSurfaceInfo(pOut, elemMode, expandX, expandY, bpp):
     if pOut.pixelPitch and pOut.pixelHeight:
         width = pOut.pixelPitch
         height = pOut.pixelHeight
@@ -1221,13 +1820,7 @@ def restoreSurfaceInfo(elemMode, expandX, expandY, bpp):
     return 0
 
 
-def computeSurfaceInfo(aSurfIn, pSurfOut):
-    global pIn
-    global pOut
-
-    pIn = aSurfIn
-    pOut = pSurfOut
-
+def computeSurfaceInfo(pIn, pOut):
     returnCode = 0
     elemMode = 0
 
@@ -1235,7 +1828,7 @@ def computeSurfaceInfo(aSurfIn, pSurfOut):
         returnCode = 3
 
     if returnCode == 0:
-        computeMipLevel()
+        computeMipLevel(pIn)
 
         width = pIn.width
         height = pIn.height
@@ -1251,7 +1844,7 @@ def computeSurfaceInfo(aSurfIn, pSurfOut):
             if elemMode == 4 and expandX == 3 and pIn.tileMode == 1:
                 pIn.flags.value |= 0x200
 
-            bpp = adjustSurfaceInfo(elemMode, expandX, expandY, bpp, width, height)
+            bpp = adjustSurfaceInfo(pIn, elemMode, expandX, expandY, bpp, width, height)
 
         elif pIn.bpp:
             pIn.width = max(1, pIn.width)
@@ -1261,7 +1854,7 @@ def computeSurfaceInfo(aSurfIn, pSurfOut):
             returnCode = 3
 
         if returnCode == 0:
-            returnCode = ComputeSurfaceInfoEx()
+            returnCode = ComputeSurfaceInfoEx(pIn, pOut)
 
         if returnCode == 0:
             pOut.bpp = pIn.bpp
@@ -1269,7 +1862,7 @@ def computeSurfaceInfo(aSurfIn, pSurfOut):
             pOut.pixelHeight = pOut.height
 
             if pIn.format and (not (pIn.flags.value >> 9) & 1 or not pIn.mipLevel):
-                bpp = restoreSurfaceInfo(elemMode, expandX, expandY, bpp)
+                bpp = restoreSurfaceInfo(pOut, elemMode, expandX, expandY, bpp)
 
             if (pIn.flags.value >> 5) & 1:
                 pOut.sliceSize = pOut.surfSize
@@ -1285,16 +1878,9 @@ def computeSurfaceInfo(aSurfIn, pSurfOut):
             pOut.sliceTileMax = (pOut.height * pOut.pitch >> 6) - 1
 
 
-def getSurfaceInfo(surfaceFormat, surfaceWidth, surfaceHeight, surfaceDepth, surfaceDim, surfaceTileMode, surfaceAA, level):
+def computeGX2SurfaceInfo(surfaceFormat, surfaceWidth, surfaceHeight, surfaceDepth, surfaceDim, surfaceTileMode, surfaceAA, level):
     """
-    surfaceFormat: format of the surface (GX2SurfaceFormat)
-    surfaceWidth: width of the surface
-    surfaceHeight: height of the surface
-    surfaceDepth: depth of the surface
-    surfaceDim: dim of the surface (GX2SurfaceDim)
-    surfaceTileMode: GX2TileMode (note: NOT AddrTileMode)
-    surfaceAA: AA mode of the surface (GX2AAMode)
-    level: mip level of which the info will be calculated for (first mipmap corresponds to value 1)
+    Same as getSurfaceInfo(), but always computed.
     """
 
     dim = 0
@@ -1417,9 +2003,101 @@ def getSurfaceInfo(surfaceFormat, surfaceWidth, surfaceHeight, surfaceDepth, sur
         pSurfOut.size = 96
         computeSurfaceInfo(aSurfIn, pSurfOut)
 
-        pSurfOut = pOut
-
     if not pSurfOut.tileMode:
         pSurfOut.tileMode = 16
 
+    return surfaceOutToSurfaceInfo(pSurfOut)
+
+
+def getSurfaceInfo(surfaceFormat, surfaceWidth, surfaceHeight, surfaceDepth, surfaceDim, surfaceTileMode, surfaceAA, level):
+    """
+    surfaceFormat: format of the surface (GX2SurfaceFormat)
+    surfaceWidth: width of the surface
+    surfaceHeight: height of the surface
+    surfaceDepth: depth of the surface
+    surfaceDim: dim of the surface (GX2SurfaceDim)
+    surfaceTileMode: GX2TileMode (note: NOT AddrTileMode)
+    surfaceAA: AA mode of the surface (GX2AAMode)
+    level: mip level of which the info will be calculated for (first mipmap corresponds to value 1)
+
+    The results are memoized in surfaceInfoCache.
+    """
+
+    key = (surfaceFormat, surfaceWidth, surfaceHeight, surfaceDepth, surfaceDim, surfaceTileMode, surfaceAA, level)
+
+    pSurfOut = surfaceInfoCache.get(key)
+    if pSurfOut is None:
+        pSurfOut = surfaceInfoCache.put(key, computeGX2SurfaceInfo(*key))
+
     return pSurfOut
+
+
+MipLevelInfo = namedtuple('MipLevelInfo', [
+    'level', 'width', 'height', 'numSlices', 'pitch', 'pixelHeight', 'surfSize', 'baseAlign', 'tileMode',
+    'bpp', 'offset', 'linearOffset', 'linearSize',
+])
+
+
+def getMipChainLayout(format_, width, height, depth, dim, tileMode, aa, numMips):
+    """
+    format_: format of the surface (GX2SurfaceFormat)
+    width: width of the surface
+    height: height of the surface
+    depth: depth of the surface
+    dim: dim of the surface (GX2SurfaceDim)
+    tileMode: GX2TileMode (note: NOT AddrTileMode)
+    aa: AA mode of the surface (GX2AAMode)
+    numMips: number of levels, including the base level
+
+    Returns a MipLevelInfo for every level, where:
+    pixelHeight: padded height of the level, the height its slices have to be (un)swizzled with
+    offset: offset of the swizzled level, in the image data for level 0 and in the mip data for the rest
+    linearOffset: offset of the level in the linear (deswizzled) mip chain
+    linearSize: size of the linear level
+    """
+
+    if format_ in BCn_formats:
+        blkWidth, blkHeight = 4, 4
+
+    else:
+        blkWidth, blkHeight = 1, 1
+
+    levels = []
+    offset = 0
+    mipSize = 0
+    linearOffset = 0
+
+    for level in range(max(1, numMips)):
+        surfOut = getSurfaceInfo(format_, width, height, depth, dim, tileMode, aa, level)
+
+        width_ = max(1, width >> level)
+        height_ = 1 if dim in [0, 4] else max(1, height >> level)
+
+        if dim == 2:
+            numSlices = max(1, depth >> level)
+
+        elif dim == 3:
+            numSlices = max(6, depth)
+
+        elif dim in [4, 5, 7]:
+            numSlices = depth
+
+        else:
+            numSlices = 1
+
+        if level:
+            # The mip levels are stored one after the other in the mip data, each one aligned to its baseAlign
+            offset = (mipSize + surfOut.baseAlign - 1) // surfOut.baseAlign * surfOut.baseAlign
+            mipSize = offset + surfOut.surfSize
+
+        linearSize = (((width_ + blkWidth - 1) // blkWidth) * ((height_ + blkHeight - 1) // blkHeight)
+                      * ((surfOut.bpp + 7) // 8) * numSlices)
+
+        levels.append(MipLevelInfo(
+            level, width_, height_, numSlices, surfOut.pitch, surfOut.pixelHeight, surfOut.surfSize,
+            surfOut.baseAlign, surfOut.tileMode, surfOut.bpp, offset, linearOffset, linearSize,
+        ))
+
+        linearOffset += linearSize
+
+    return levels
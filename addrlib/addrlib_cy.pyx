@@ -8,10 +8,20 @@
 ################################################################
 ################################################################
 
+cimport cython
 from cpython cimport array
+from libc.string cimport memcpy
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+from .cache import addrMapCache, surfaceInfoCache
+from . import tables
 
 
 ctypedef unsigned char u8
+ctypedef unsigned short u16
 ctypedef unsigned int u32
 ctypedef long long int64
 ctypedef unsigned long long u64
@@ -68,8 +78,471 @@ cdef u32 GX2TileModeToAddrTileMode(u32 tileMode):
     return tileMode
 
 
-cdef bytes swizzleSurf(u32 width, u32 height, u32 depth, u32 format_, u32 aa, u32 use, u32 tileMode, u32 swizzle_,
-                       u32 pitch, u32 bitsPerPixel, u32 slice, u32 sample, u8 *data, u32 dataSize, int swizzle):
+cdef tuple getAddrMapKey(u32 width, u32 height, u32 depth, u32 format_, u32 aa, u32 use, u32 tileMode, u32 swizzle_,
+                         u32 pitch, u32 bitsPerPixel, u32 slice, u32 sample):
+
+    # Only the parameters that affect the addresses are part of the key
+    return (width, height, depth, format_ in BCn_formats, aa, use & 4, tileMode,
+            swizzle_ & 0x700, pitch, bitsPerPixel, slice, sample)
+
+
+def getRowBands(u32 height, u32 tileMode, int threads):
+    """
+    Splits the rows of the surface into (at most) one band per thread,
+    every band covering whole macro tile rows (or micro tile rows for the non-macro-tiled modes).
+    threads: number of threads, 0 to use one per CPU
+    """
+
+    cdef u32 bandHeight, numBands
+
+    if threads <= 0:
+        threads = os.cpu_count() or 1
+
+    tileMode = GX2TileModeToAddrTileMode(tileMode)
+
+    if tileMode in [5, 9]:
+        bandHeight = 32
+
+    elif tileMode in [6, 10]:
+        bandHeight = 64
+
+    elif tileMode > 3:
+        bandHeight = 16
+
+    else:
+        bandHeight = 8
+
+    numBands = (height + bandHeight - 1) // bandHeight
+    threads = max(1, min(threads, numBands))
+
+    return [(numBands * i // threads * bandHeight, min(height, numBands * (i + 1) // threads * bandHeight))
+            for i in range(threads)]
+
+
+def runBands(func, list bands):
+    """
+    Calls func(yStart, yEnd) for every band, on a thread pool if there is more than one.
+    """
+
+    if len(bands) == 1:
+        func(*bands[0])
+        return
+
+    with ThreadPoolExecutor(len(bands)) as executor:
+        for future in [executor.submit(func, *band) for band in bands]:
+            future.result()
+
+
+cdef u32 unpackAddr(u32 addr) noexcept nogil:
+    # Removes the pipe and bank bits of an address
+    return addr & 255 | (addr >> 11) << 8
+
+
+cdef class AddrMapRows:
+    """
+    Fills the rows of an address map, without holding the GIL.
+    """
+
+    cdef:
+        array.array addrMap
+        u32 *addrs
+        u32 width, height, depth, tileMode, bitsPerPixel, pitch, slice, sample
+        u32 numSamples, pipeSwizzle, bankSwizzle
+        int isDepth
+
+        # Addresses of the first macro tile of the slice, without any swizzle
+        int useTemplate
+        u32 macroTilePitch, macroTileHeight
+        u32 template[512]
+
+    def __cinit__(self, array.array addrMap, u32 width, u32 height, u32 depth, u32 tileMode, u32 bitsPerPixel,
+                  u32 pitch, u32 slice, u32 sample, u32 numSamples, int isDepth, u32 pipeSwizzle, u32 bankSwizzle):
+
+        cdef u32 microTileBytes, x, y
+
+        self.addrMap = addrMap
+        self.addrs = addrMap.data.as_uints
+        self.width = width
+        self.height = height
+        self.depth = depth
+        self.tileMode = tileMode
+        self.bitsPerPixel = bitsPerPixel
+        self.pitch = pitch
+        self.slice = slice
+        self.sample = sample
+        self.numSamples = numSamples
+        self.isDepth = isDepth
+        self.pipeSwizzle = pipeSwizzle
+        self.bankSwizzle = bankSwizzle
+
+        # Can't be used if the samples are split across tile slices
+        microTileBytes = (numSamples * bitsPerPixel * computeSurfaceThickness(tileMode) * 64 + 7) // 8
+        self.useTemplate = tileMode > 3 and not (numSamples > 1 and microTileBytes > 2048)
+
+        if self.useTemplate:
+            self.macroTilePitch, self.macroTileHeight = getMacroTileSize(tileMode)
+
+            for y in range(self.macroTileHeight):
+                for x in range(self.macroTilePitch):
+                    self.template[y * self.macroTilePitch + x] = <u32>computeSurfaceAddrFromCoordMacroTiled(
+                        x, y, slice & (computeSurfaceThickness(tileMode) - 1), sample, bitsPerPixel,
+                        self.macroTilePitch, self.macroTileHeight, numSamples, tileMode, isDepth, 0, 0)
+
+    def __call__(self, u32 yStart, u32 yEnd):
+        with nogil:
+            if self.useTemplate:
+                self.fillMacroTiled(yStart, yEnd)
+
+            else:
+                self.fill(yStart, yEnd)
+
+    cdef void fillMacroTiled(self, u32 yStart, u32 yEnd) noexcept nogil:
+        """
+        Only computes the first element of every macro tile in full,
+        the others are moved from the template of the first macro tile.
+        """
+
+        cdef:
+            u32 *addrs = self.addrs
+            u32 templateBase = self.template[0]
+            u32 tileAddr, tileOffset, bankPipe, addr, elemOffset
+            u32 y, i, tileX, x
+            const u32 *templateRow
+
+        for y in range(yStart, yEnd):
+            templateRow = &self.template[(y % self.macroTileHeight) * self.macroTilePitch]
+
+            for i in range((self.width + self.macroTilePitch - 1) // self.macroTilePitch):
+                tileX = i * self.macroTilePitch
+                tileAddr = <u32>computeSurfaceAddrFromCoordMacroTiled(
+                    tileX, y - y % self.macroTileHeight, self.slice, self.sample, self.bitsPerPixel, self.pitch,
+                    self.height, self.numSamples, self.tileMode, self.isDepth, self.pipeSwizzle, self.bankSwizzle)
+
+                tileOffset = unpackAddr(tileAddr) - unpackAddr(templateBase)
+                bankPipe = (tileAddr ^ templateBase) & 0x700
+
+                for x in range(tileX, min(tileX + self.macroTilePitch, self.width)):
+                    addr = templateRow[x - tileX]
+                    elemOffset = unpackAddr(addr) + tileOffset
+                    addrs[y * self.width + x] = (addr ^ bankPipe) & 0x700 | elemOffset & 255 | (elemOffset >> 8) << 11
+
+    cdef void fill(self, u32 yStart, u32 yEnd) noexcept nogil:
+        cdef:
+            u32 *addrs = self.addrs
+            u32 bytesPerPixel = self.bitsPerPixel // 8
+            u32 y, x
+
+        for y in range(yStart, yEnd):
+            for x in range(self.width):
+                if self.tileMode in [0, 1]:
+                    addrs[y * self.width + x] = <u32>computeSurfaceAddrFromCoordLinear(
+                        x, y, self.slice, self.sample, bytesPerPixel, self.pitch, self.height, self.depth)
+
+                elif self.tileMode in [2, 3]:
+                    addrs[y * self.width + x] = <u32>computeSurfaceAddrFromCoordMicroTiled(
+                        x, y, self.slice, self.bitsPerPixel, self.pitch, self.height, self.tileMode, self.isDepth)
+
+                else:
+                    addrs[y * self.width + x] = <u32>computeSurfaceAddrFromCoordMacroTiled(
+                        x, y, self.slice, self.sample, self.bitsPerPixel, self.pitch, self.height, self.numSamples,
+                        self.tileMode, self.isDepth, self.pipeSwizzle, self.bankSwizzle)
+
+
+cpdef array.array computeSurfaceAddrMap(u32 width, u32 height, u32 depth, u32 format_, u32 aa, u32 use, u32 tileMode,
+                                        u32 swizzle_, u32 pitch, u32 bitsPerPixel, u32 slice, u32 sample,
+                                        int threads=1):
+
+    """
+    Returns the swizzled byte address of every element of the surface,
+    as an array('I') in linear (row-major) element order.
+    threads: number of threads the rows are split across, 0 to use one per CPU
+    """
+
+    cdef:
+        u32 numSamples = 1 << aa
+        array.array addrMap = array.array('I')
+        u32 gx2TileMode = tileMode
+
+        u32 pipeSwizzle, bankSwizzle, microTileBytes
+
+    if format_ in BCn_formats:
+        width = (width + 3) // 4
+        height = (height + 3) // 4
+
+    pipeSwizzle = (swizzle_ >> 8) & 1
+    bankSwizzle = (swizzle_ >> 9) & 3
+
+    tileMode = GX2TileModeToAddrTileMode(tileMode)
+
+    if tileMode > 3 and numSamples > 1:
+        # Same error as the pure Python Addrlib,
+        # the address functions below don't check for it
+        microTileBytes = (numSamples * bitsPerPixel * computeSurfaceThickness(tileMode) * 64 + 7) // 8
+        if microTileBytes > 2048 and microTileBytes // numSamples > 2048:
+            raise ZeroDivisionError("integer division or modulo by zero")
+
+    array.resize(addrMap, width * height)
+
+    runBands(AddrMapRows(addrMap, width, height, depth, tileMode, bitsPerPixel, pitch, slice, sample,
+                         numSamples, use & 4, pipeSwizzle, bankSwizzle),
+             getRowBands(height, gx2TileMode, threads))
+
+    return addrMap
+
+
+cpdef getSurfaceAddrMap(u32 width, u32 height, u32 depth, u32 format_, u32 aa, u32 use, u32 tileMode,
+                        u32 swizzle_, u32 pitch, u32 bitsPerPixel, u32 slice, u32 sample, int threads=1):
+
+    """
+    Same as computeSurfaceAddrMap(), but the map is looked up in addrMapCache first.
+    Can return a (read-only) memoryview instead of an array('I') if the map comes from the disk cache.
+    """
+
+    cdef:
+        tuple key = getAddrMapKey(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                                  pitch, bitsPerPixel, slice, sample)
+
+        object addrMap = addrMapCache.get(key)
+
+    if addrMap is None:
+        addrMap = addrMapCache.put(key, computeSurfaceAddrMap(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                                                              pitch, bitsPerPixel, slice, sample, threads))
+
+    return addrMap
+
+
+cdef void copyElements(const u8 *src, u8 *dst, const u32 *addrs, u32 start, u32 end, u32 bytesPerPixel,
+                       u64 linearSize, u64 swizzledSize, int swizzle) noexcept nogil:
+
+    cdef:
+        u32 i
+        u64 pos, pos_
+
+    for i in range(start, end):
+        pos = addrs[i]
+        pos_ = <u64>i * bytesPerPixel
+
+        if pos_ + bytesPerPixel <= linearSize and pos + bytesPerPixel <= swizzledSize:
+            if swizzle == 0:
+                memcpy(dst + pos_, src + pos, bytesPerPixel)
+
+            else:
+                memcpy(dst + pos, src + pos_, bytesPerPixel)
+
+
+cdef class ElementRows:
+    """
+    Copies the elements of whole rows between the linear and swizzled data, without holding the GIL.
+    """
+
+    cdef:
+        const u8[::1] srcView
+        u8[::1] dstView
+        const u32[::1] addrMap
+        const u8 *src
+        u8 *dst
+        const u32 *addrs
+        u32 width, bytesPerPixel
+        u64 linearSize, swizzledSize
+        int swizzle
+
+    def __cinit__(self, const u8[::1] src, u8[::1] dst, const u32[::1] addrMap, u32 width, u32 bytesPerPixel,
+                  u64 linearSize, u64 swizzledSize, int swizzle):
+
+        # Keep the buffers (and the map) alive as long as the pointers are used
+        self.srcView = src
+        self.dstView = dst
+        self.addrMap = addrMap
+
+        self.src = &src[0]
+        self.dst = &dst[0]
+        self.addrs = &addrMap[0] if addrMap.shape[0] else NULL
+        self.width = width
+        self.bytesPerPixel = bytesPerPixel
+        self.linearSize = linearSize
+        self.swizzledSize = swizzledSize
+        self.swizzle = swizzle
+
+    def __call__(self, u32 yStart, u32 yEnd):
+        with nogil:
+            copyElements(self.src, self.dst, self.addrs, yStart * self.width, yEnd * self.width, self.bytesPerPixel,
+                         self.linearSize, self.swizzledSize, self.swizzle)
+
+
+cdef void copyLinearRows(const u8 *src, u8 *dst, u32 width, u32 pitch, u32 bytesPerPixel, u64 sliceOffset,
+                         u32 yStart, u32 yEnd, u64 linearSize, u64 swizzledSize, int swizzle) noexcept nogil:
+
+    cdef:
+        u32 y, rowEnd
+        u64 numElements, pos, pos_, size
+
+    # All the rows are contiguous if there is no padding, so copy them at once
+    if pitch == width:
+        rowEnd = yStart + 1
+        numElements = <u64>(yEnd - yStart) * width
+
+    else:
+        rowEnd = yEnd
+        numElements = width
+
+    for y in range(yStart, rowEnd):
+        pos = (<u64>y * pitch + sliceOffset) * bytesPerPixel
+        pos_ = <u64>y * width * bytesPerPixel
+
+        if pos_ >= linearSize or pos >= swizzledSize:
+            continue
+
+        numElements = min(numElements, (linearSize - pos_) // bytesPerPixel, (swizzledSize - pos) // bytesPerPixel)
+        size = numElements * bytesPerPixel
+
+        if swizzle == 0:
+            memcpy(dst + pos_, src + pos, size)
+
+        else:
+            memcpy(dst + pos, src + pos_, size)
+
+
+cdef class LinearRows:
+    """
+    Copies whole rows of a linear surface between the linear and swizzled data, without holding the GIL.
+    """
+
+    cdef:
+        const u8[::1] srcView
+        u8[::1] dstView
+        const u8 *src
+        u8 *dst
+        u32 width, pitch, bytesPerPixel
+        u64 sliceOffset, linearSize, swizzledSize
+        int swizzle
+
+    def __cinit__(self, const u8[::1] src, u8[::1] dst, u32 width, u32 pitch, u32 bytesPerPixel, u64 sliceOffset,
+                  u64 linearSize, u64 swizzledSize, int swizzle):
+
+        self.srcView = src
+        self.dstView = dst
+
+        self.src = &src[0]
+        self.dst = &dst[0]
+        self.width = width
+        self.pitch = pitch
+        self.bytesPerPixel = bytesPerPixel
+        self.sliceOffset = sliceOffset
+        self.linearSize = linearSize
+        self.swizzledSize = swizzledSize
+        self.swizzle = swizzle
+
+    def __call__(self, u32 yStart, u32 yEnd):
+        with nogil:
+            copyLinearRows(self.src, self.dst, self.width, self.pitch, self.bytesPerPixel, self.sliceOffset,
+                           yStart, yEnd, self.linearSize, self.swizzledSize, self.swizzle)
+
+
+# Conversions swizzleSurf() can apply to every element of a linear surface while swizzling it:
+# name: (size of the source elements, position and width of the field swapped with the lowest one)
+# The 3-byte (RGB8) elements are expanded to 4 bytes, the last one being 0xFF.
+elementTransforms = {
+    'rgb565': (2, 11, 5),
+    'rgb5a1': (2, 10, 5),
+    'rgba4': (2, 8, 4),
+    'bgr10a2': (4, 20, 10),
+    'rgba8': (4, 16, 8),
+    'rgb8': (3, 0, 0),
+    'bgr8': (3, 16, 8),
+}
+
+
+def getElementTransform(transform, u32 bitsPerPixel):
+    """
+    Returns the size of the source elements of the given transform (see elementTransforms),
+    and the position and width of the fields it swaps.
+    """
+
+    if transform not in elementTransforms:
+        raise ValueError("Unknown transform: %s" % transform)
+
+    srcBytesPerPixel, shift, bits = elementTransforms[transform]
+    if bitsPerPixel // 8 != (4 if srcBytesPerPixel == 3 else srcBytesPerPixel):
+        raise ValueError("The %s transform can't be used with %d-bit elements." % (transform, bitsPerPixel))
+
+    return srcBytesPerPixel, shift, bits
+
+
+cpdef u64 getTransformedSize(u64 size, u32 bitsPerPixel, transform):
+    # Size of the given linear data once transformed
+    if transform is None:
+        return size
+
+    return size // getElementTransform(transform, bitsPerPixel)[0] * (bitsPerPixel // 8)
+
+
+cdef class TransformedElementRows:
+    """
+    Swizzles the elements of whole rows, converting each of them as it's moved, without holding the GIL.
+    """
+
+    cdef:
+        const u8[::1] srcView
+        u8[::1] dstView
+        const u32[::1] addrMap
+        u32 width, bytesPerPixel, srcBytesPerPixel, shift, mask, fill
+
+    def __cinit__(self, const u8[::1] src, u8[::1] dst, const u32[::1] addrMap, u32 width, u32 bytesPerPixel,
+                  transform):
+
+        cdef u32 bits
+
+        self.srcView = src
+        self.dstView = dst
+        self.addrMap = addrMap
+        self.width = width
+        self.bytesPerPixel = bytesPerPixel
+
+        self.srcBytesPerPixel, self.shift, bits = getElementTransform(transform, bytesPerPixel * 8)
+        self.mask = (1 << bits) - 1
+        self.fill = 0xFF000000 if self.srcBytesPerPixel == 3 else 0
+
+    def __call__(self, u32 yStart, u32 yEnd):
+        cdef:
+            const u8 *src = &self.srcView[0]
+            u8 *dst = &self.dstView[0]
+            const u32 *addrs = &self.addrMap[0]
+            u64 linearSize = self.srcView.shape[0]
+            u64 swizzledSize = self.dstView.shape[0]
+            u32 i, j, value
+            u64 pos, pos_
+
+        with nogil:
+            for i in range(yStart * self.width, yEnd * self.width):
+                pos = addrs[i]
+                pos_ = <u64>i * self.srcBytesPerPixel
+
+                if pos_ + self.srcBytesPerPixel <= linearSize and pos + self.bytesPerPixel <= swizzledSize:
+                    value = self.fill
+                    for j in range(self.srcBytesPerPixel):
+                        value |= <u32>src[pos_ + j] << (8 * j)
+
+                    value = (value & ~(self.mask | self.mask << self.shift) | (value & self.mask) << self.shift
+                             | (value >> self.shift) & self.mask)
+
+                    for j in range(self.bytesPerPixel):
+                        dst[pos + j] = (value >> (8 * j)) & 0xFF
+
+
+def getResultView(out, u64 offset, u64 dataSize):
+    if out is None:
+        return memoryview(bytearray(dataSize))
+
+    result = memoryview(out).cast('B')
+    if offset + dataSize > len(result):
+        raise ValueError("Output buffer is too small.")
+
+    return result[offset:offset + dataSize]
+
+
+cdef swizzleSurf(u32 width, u32 height, u32 depth, u32 format_, u32 aa, u32 use, u32 tileMode, u32 swizzle_,
+                 u32 pitch, u32 bitsPerPixel, u32 slice, u32 sample, const u8[::1] data, u64 dataSize, int swizzle,
+                 out=None, u64 offset=0, int threads=1, transform=None):
 
     """
     width: width of the surface
@@ -82,67 +555,340 @@ cdef bytes swizzleSurf(u32 width, u32 height, u32 depth, u32 format_, u32 aa, u3
     swizzle_: swizzle of the surface (GX2Surface.swizzle)
     pitch: aligned width of the surface (can be calculated using getSurfaceInfo())
     bitsPerPixel: bits per element for the given format (use surfaceGetBitsPerPixel())
-    data: data to be (un)swizzled
+    data: data to be (un)swizzled (any object supporting the buffer protocol)
+    dataSize: size of the result
     swizzle: boolen where the data will be swizzled if true, otherwise unswizzled
+    out: writable buffer the result will be written to, starting at offset (a new bytearray if None)
+    threads: number of threads the surface is split across (in bands of macro tile rows), 0 to use one per CPU
+    transform: conversion applied to every element while swizzling (see elementTransforms), None for a plain copy
+
+    Returns a memoryview of the result.
     """
 
     cdef:
         u32 bytesPerPixel = bitsPerPixel // 8
-        bytearray result = bytearray(dataSize)
+        u64 srcSize = data.shape[0]
+        u64 linearSize, swizzledSize
+        int useLinearRows = GX2TileModeToAddrTileMode(tileMode) in [0, 1] and transform is None
+
+        object addrMap
+
+    if transform is not None and not swizzle:
+        raise ValueError("Elements can only be transformed while swizzling.")
 
-        u32 pipeSwizzle, bankSwizzle, y, x, pos, pos_, n
+    if not useLinearRows:
+        addrMap = getSurfaceAddrMap(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                                    pitch, bitsPerPixel, slice, sample, threads)
+
+    resultView = getResultView(out, offset, dataSize)
+
+    if not (srcSize and dataSize):
+        return resultView
 
     if format_ in BCn_formats:
         width = (width + 3) // 4
         height = (height + 3) // 4
 
-    pipeSwizzle = (swizzle_ >> 8) & 1
-    bankSwizzle = (swizzle_ >> 9) & 3
+    if swizzle:
+        linearSize, swizzledSize = srcSize, dataSize
 
-    tileMode = GX2TileModeToAddrTileMode(tileMode)
+    else:
+        linearSize, swizzledSize = dataSize, srcSize
 
-    for y in range(height):
-        for x in range(width):
-            if tileMode in [0, 1]:
-                pos = <u32>computeSurfaceAddrFromCoordLinear(x, y, slice, sample, bytesPerPixel, pitch, height, depth)
+    if transform is not None:
+        # Linear surfaces go through their address map as well
+        runBands(TransformedElementRows(data, resultView, addrMap, width, bytesPerPixel, transform),
+                 getRowBands(height, tileMode, threads))
 
-            elif tileMode in [2, 3]:
-                pos = <u32>computeSurfaceAddrFromCoordMicroTiled(x, y, slice, bitsPerPixel, pitch, height, tileMode, use & 4)
+    elif useLinearRows:
+        # Linear surfaces are copied row by row, without any address map
+        if bytesPerPixel:
+            runBands(LinearRows(data, resultView, width, pitch, bytesPerPixel,
+                                <u64>pitch * height * (slice + <u64>sample * depth),
+                                linearSize, swizzledSize, swizzle),
+                     getRowBands(height, tileMode, threads))
 
-            else:
-                pos = <u32>computeSurfaceAddrFromCoordMacroTiled(x, y, slice, sample, bitsPerPixel, pitch, height, 1 << aa,
-                                                                 tileMode, use & 4, pipeSwizzle, bankSwizzle)
+    else:
+        runBands(ElementRows(data, resultView, addrMap, width, bytesPerPixel, linearSize, swizzledSize, swizzle),
+                 getRowBands(height, tileMode, threads))
 
-            pos_ = (y * width + x) * bytesPerPixel
+    return resultView
 
-            if pos_ + bytesPerPixel <= dataSize and pos + bytesPerPixel <= dataSize:
-                if swizzle == 0:
-                    for n in range(bytesPerPixel):
-                        result[pos_ + n] = <u8>data[pos + n]
 
-                else:
-                    for n in range(bytesPerPixel):
-                        result[pos + n] = <u8>data[pos_ + n]
+cpdef u64 getLinearSize(u32 width, u32 height, u32 format_, u32 bpp):
+    if format_ in BCn_formats:
+        width = (width + 3) // 4
+        height = (height + 3) // 4
 
-    return bytes(result)
+    return <u64>width * height * (bpp // 8)
 
 
 cpdef bytes deswizzle(u32 width, u32 height, u32 depth, u32 format_, u32 aa, u32 use, u32 tileMode, u32 swizzle_,
-                      u32 pitch, u32 bpp, u32 slice, u32 sample, bytes data):
+                      u32 pitch, u32 bpp, u32 slice, u32 sample, const u8[::1] data, int threads=1):
+
+    return bytes(swizzleSurf(width, height, depth, format_, aa, use, tileMode, swizzle_, pitch, bpp,
+                             slice, sample, data, data.shape[0], 0, None, 0, threads))
 
-    cdef array.array dataArr = array.array('B', data)
+
+cpdef bytes swizzle(u32 width, u32 height, u32 depth, u32 format_, u32 aa, u32 use, u32 tileMode, u32 swizzle_,
+                    u32 pitch, u32 bpp, u32 slice, u32 sample, const u8[::1] data, int threads=1, transform=None):
+
+    return bytes(swizzleSurf(width, height, depth, format_, aa, use, tileMode, swizzle_, pitch, bpp,
+                             slice, sample, data, getTransformedSize(data.shape[0], bpp, transform), 1, None, 0,
+                             threads, transform))
+
+
+def deswizzleInto(u32 width, u32 height, u32 depth, u32 format_, u32 aa, u32 use, u32 tileMode, u32 swizzle_,
+                  u32 pitch, u32 bpp, u32 slice, u32 sample, const u8[::1] data, out=None, u64 offset=0, size=None,
+                  int threads=1):
+
+    """
+    Same as deswizzle(), but the result is written to out (starting at offset) without any
+    intermediate copy and a memoryview of it is returned.
+    size: size of the result, the size of the linear image by default
+    """
+
+    if size is None:
+        size = getLinearSize(width, height, format_, bpp)
 
     return swizzleSurf(width, height, depth, format_, aa, use, tileMode, swizzle_, pitch, bpp,
-                       slice, sample, dataArr.data.as_uchars, len(data), 0)
+                       slice, sample, data, size, 0, out, offset, threads)
 
 
-cpdef bytes swizzle(u32 width, u32 height, u32 depth, u32 format_, u32 aa, u32 use, u32 tileMode, u32 swizzle_,
-                    u32 pitch, u32 bpp, u32 slice, u32 sample, bytes data):
+def swizzleInto(u32 width, u32 height, u32 depth, u32 format_, u32 aa, u32 use, u32 tileMode, u32 swizzle_,
+                u32 pitch, u32 bpp, u32 slice, u32 sample, const u8[::1] data, out=None, u64 offset=0, size=None,
+                int threads=1, transform=None):
+
+    """
+    Same as swizzle(), but the result is written to out (starting at offset) without any
+    intermediate copy and a memoryview of it is returned.
+    size: size of the result (should be surfSize), the size of data (once transformed) by default
+    """
 
-    cdef array.array dataArr = array.array('B', data)
+    if size is None:
+        size = getTransformedSize(data.shape[0], bpp, transform)
 
     return swizzleSurf(width, height, depth, format_, aa, use, tileMode, swizzle_, pitch, bpp,
-                       slice, sample, dataArr.data.as_uchars, len(data), 1)
+                       slice, sample, data, size, 1, out, offset, threads, transform)
+
+
+# Parameters of a surface (or a slice of it), in the same order as taken by deswizzle() and swizzle()
+SurfaceDesc = namedtuple('SurfaceDesc', [
+    'width', 'height', 'depth', 'format_', 'aa', 'use', 'tileMode', 'swizzle_', 'pitch', 'bpp', 'slice', 'sample',
+])
+
+
+cdef (u32, u32) getRetileSize(srcDesc, dstDesc) except *:
+    """
+    Returns the width and height (in elements) of the rows moved by retileSurf().
+    """
+
+    cdef u32 width, height
+
+    if (srcDesc.width != dstDesc.width or srcDesc.bpp != dstDesc.bpp
+            or (srcDesc.format_ in BCn_formats) != (dstDesc.format_ in BCn_formats)):
+
+        raise ValueError("Both surfaces must have the same width and format.")
+
+    width, height = srcDesc.width, min(srcDesc.height, dstDesc.height)
+
+    if srcDesc.format_ in BCn_formats:
+        width = (width + 3) // 4
+        height = (height + 3) // 4
+
+    return width, height
+
+
+cdef class RetileRows:
+    """
+    Moves the elements of whole rows between the two swizzled layouts, without holding the GIL.
+    """
+
+    cdef:
+        const u8[::1] srcView
+        u8[::1] dstView
+        const u32[::1] srcMap
+        const u32[::1] dstMap
+        u32 width, bytesPerPixel
+        u64 srcSize, dstSize
+
+    def __cinit__(self, const u8[::1] src, u8[::1] dst, const u32[::1] srcMap, const u32[::1] dstMap,
+                  u32 width, u32 bytesPerPixel):
+
+        self.srcView = src
+        self.dstView = dst
+        self.srcMap = srcMap
+        self.dstMap = dstMap
+        self.width = width
+        self.bytesPerPixel = bytesPerPixel
+        self.srcSize = src.shape[0]
+        self.dstSize = dst.shape[0]
+
+    def __call__(self, u32 yStart, u32 yEnd):
+        cdef:
+            const u8 *src = &self.srcView[0]
+            u8 *dst = &self.dstView[0]
+            const u32 *srcAddrs = &self.srcMap[0]
+            const u32 *dstAddrs = &self.dstMap[0]
+            u32 i
+            u64 pos, pos_
+
+        with nogil:
+            for i in range(yStart * self.width, yEnd * self.width):
+                pos = srcAddrs[i]
+                pos_ = dstAddrs[i]
+
+                if pos + self.bytesPerPixel <= self.srcSize and pos_ + self.bytesPerPixel <= self.dstSize:
+                    memcpy(dst + pos_, src + pos, self.bytesPerPixel)
+
+
+cdef retileSurf(srcDesc, dstDesc, const u8[::1] data, u64 dataSize, out=None, u64 offset=0, int threads=1):
+    """
+    srcDesc: SurfaceDesc (or tuple of the same fields) of the layout of data
+    dstDesc: SurfaceDesc of the layout of the result
+    data: swizzled data to be moved (any object supporting the buffer protocol, can't overlap out)
+    dataSize: size of the result
+    out: writable buffer the result will be written to, starting at offset (a new bytearray if None)
+    threads: number of threads the surface is split across, 0 to use one per CPU
+
+    Moves every element from its address in the source layout to its address in the destination layout,
+    without going through a linear intermediate.
+    Both surfaces must have the same width and format, only the rows both of them have are moved.
+
+    Returns a memoryview of the result.
+    """
+
+    cdef u32 width, height, bytesPerPixel
+
+    srcDesc, dstDesc = SurfaceDesc(*srcDesc), SurfaceDesc(*dstDesc)
+    width, height = getRetileSize(srcDesc, dstDesc)
+
+    bytesPerPixel = srcDesc.bpp // 8
+    resultView = getResultView(out, offset, dataSize)
+
+    if not (bytesPerPixel and width and height and data.shape[0] and dataSize):
+        return resultView
+
+    srcMap = getSurfaceAddrMap(*srcDesc, threads=threads)
+    dstMap = getSurfaceAddrMap(*dstDesc, threads=threads)
+
+    runBands(RetileRows(data, resultView, srcMap, dstMap, width, bytesPerPixel),
+             getRowBands(height, dstDesc.tileMode, threads))
+
+    return resultView
+
+
+cpdef bytes retile(srcDesc, dstDesc, const u8[::1] data, int threads=1):
+    return bytes(retileSurf(srcDesc, dstDesc, data, data.shape[0], None, 0, threads))
+
+
+def retileInto(srcDesc, dstDesc, const u8[::1] data, out=None, u64 offset=0, size=None, int threads=1):
+    """
+    Same as retile(), but the result is written to out (starting at offset) without any
+    intermediate copy and a memoryview of it is returned.
+    size: size of the result (should be the surfSize of the destination), the size of data by default
+    """
+
+    if size is None:
+        size = data.shape[0]
+
+    return retileSurf(srcDesc, dstDesc, data, size, out, offset, threads)
+
+
+def getRegionElements(x, y, w, h, width, height, format_):
+    """
+    Returns the region of w x h pixels starting at pixel (x, y) in elements,
+    extended to the 4x4 blocks covering it for BCn.
+    """
+
+    if w <= 0 or h <= 0 or x < 0 or y < 0 or x + w > width or y + h > height:
+        raise ValueError("Region is outside of the surface.")
+
+    if format_ in BCn_formats:
+        return x // 4, y // 4, (x + w + 3) // 4 - x // 4, (y + h + 3) // 4 - y // 4
+
+    return x, y, w, h
+
+
+cpdef array.array computeSurfaceRegionAddrMap(u32 x, u32 y, u32 w, u32 h, u32 width, u32 height, u32 depth,
+                                              u32 format_, u32 aa, u32 use, u32 tileMode, u32 swizzle_,
+                                              u32 pitch, u32 bitsPerPixel, u32 slice, u32 sample):
+
+    """
+    Same as computeSurfaceAddrMap(), but only for the w x h elements starting at element (x, y),
+    in linear (row-major) order of the region.
+    Every address is computed from its own coordinates, so the cost only depends on the size of the region.
+    """
+
+    cdef:
+        u32 numSamples = 1 << aa
+        u32 bytesPerPixel = bitsPerPixel // 8
+        int isDepth = use & 4
+        array.array addrMap = array.array('I')
+
+        u32 *addrs
+        u32 pipeSwizzle, bankSwizzle, microTileBytes, i, j
+
+    if format_ in BCn_formats:
+        height = (height + 3) // 4
+
+    pipeSwizzle = (swizzle_ >> 8) & 1
+    bankSwizzle = (swizzle_ >> 9) & 3
+
+    tileMode = GX2TileModeToAddrTileMode(tileMode)
+
+    if tileMode > 3 and numSamples > 1:
+        # Same error as the pure Python Addrlib,
+        # the address functions below don't check for it
+        microTileBytes = (numSamples * bitsPerPixel * computeSurfaceThickness(tileMode) * 64 + 7) // 8
+        if microTileBytes > 2048 and microTileBytes // numSamples > 2048:
+            raise ZeroDivisionError("integer division or modulo by zero")
+
+    array.resize(addrMap, w * h)
+    addrs = addrMap.data.as_uints
+
+    with nogil:
+        for j in range(h):
+            for i in range(w):
+                if tileMode in [0, 1]:
+                    addrs[j * w + i] = <u32>computeSurfaceAddrFromCoordLinear(
+                        x + i, y + j, slice, sample, bytesPerPixel, pitch, height, depth)
+
+                elif tileMode in [2, 3]:
+                    addrs[j * w + i] = <u32>computeSurfaceAddrFromCoordMicroTiled(
+                        x + i, y + j, slice, bitsPerPixel, pitch, height, tileMode, isDepth)
+
+                else:
+                    addrs[j * w + i] = <u32>computeSurfaceAddrFromCoordMacroTiled(
+                        x + i, y + j, slice, sample, bitsPerPixel, pitch, height, numSamples,
+                        tileMode, isDepth, pipeSwizzle, bankSwizzle)
+
+    return addrMap
+
+
+def deswizzleRegion(x, y, w, h, u32 width, u32 height, u32 depth, u32 format_, u32 aa, u32 use, u32 tileMode,
+                    u32 swizzle_, u32 pitch, u32 bpp, u32 slice, u32 sample, const u8[::1] data):
+
+    """
+    Same as deswizzle(), but only the w x h pixels starting at pixel (x, y) are deswizzled
+    (the 4x4 blocks covering them for BCn), without building the address map of the whole surface.
+    Returns the linear data of the region.
+    """
+
+    cdef u32 bytesPerPixel = bpp // 8
+
+    x, y, w, h = getRegionElements(x, y, w, h, width, height, format_)
+    resultView = memoryview(bytearray(w * h * bytesPerPixel))
+
+    if not (bytesPerPixel and data.shape[0]):
+        return bytes(resultView)
+
+    addrMap = computeSurfaceRegionAddrMap(x, y, w, h, width, height, depth, format_, aa, use, tileMode, swizzle_,
+                                          pitch, bpp, slice, sample)
+
+    ElementRows(data, resultView, addrMap, w, bytesPerPixel, w * h * bytesPerPixel, data.shape[0], 0)(0, h)
+
+    return bytes(resultView)
 
 
 cdef u8 formatHwInfo[0x100]
@@ -190,137 +936,101 @@ cpdef u32 surfaceGetBitsPerPixel(u32 surfaceFormat):
     return formatHwInfo[(surfaceFormat & 0x3F) * 4]
 
 
-cdef u32 computeSurfaceThickness(u32 tileMode):
-    if tileMode in [3, 7, 11, 13, 15]:
-        return 4
+# C copies of the lookup tables
+cdef enum:
+    numTileModes = 18
 
-    elif tileMode in [16, 17]:
-        return 8
+cdef u8 surfaceThickness[numTileModes]
+cdef u8 surfaceRotation[numTileModes]
+cdef u8 thickMacroTiled[numTileModes]
+cdef u8 bankSwappedTileMode[numTileModes]
+cdef u8 macroTileAspectRatio[numTileModes]
 
-    return 1
+surfaceThickness[:] = tables.surfaceThickness
+surfaceRotation[:] = tables.surfaceRotation
+thickMacroTiled[:] = tables.thickMacroTiled
+bankSwappedTileMode[:] = tables.bankSwappedTileMode
+macroTileAspectRatio[:] = tables.macroTileAspectRatio
 
+cdef u8 pipeTable[4]
+cdef u8 bankTable[16]
 
-cdef u32 computePixelIndexWithinMicroTile(u32 x, u32 y, u32 z, u32 bpp, u32 tileMode, int isDepth):
-    cdef:
-        u32 pixelBit0, pixelBit1, pixelBit2
-        u32 pixelBit3, pixelBit4, pixelBit5
-        u32 pixelBit6 = 0
-        u32 pixelBit7 = 0
-        u32 pixelBit8 = 0
+pipeTable[:] = list(tables.pipeTable)
+bankTable[:] = list(tables.bankTable)
 
-        u32 thickness = computeSurfaceThickness(tileMode)
+# The pixel index tables of every multiple of 8 up to 128 bits per pixel, indexed by isDepth and bpp // 8.
+# The index of an element doesn't depend on the thickness of its micro tile,
+# so the tables of thickness 8 are used for all of them.
+cdef u16 pixelIndexTables[2][17][512]
 
-    if isDepth:
-        pixelBit0 = x & 1
-        pixelBit1 = y & 1
-        pixelBit2 = (x & 2) >> 1
-        pixelBit3 = (y & 2) >> 1
-        pixelBit4 = (x & 4) >> 2
-        pixelBit5 = (y & 4) >> 2
 
-    else:
-        if bpp == 8:
-            pixelBit0 = x & 1
-            pixelBit1 = (x & 2) >> 1
-            pixelBit2 = (x & 4) >> 2
-            pixelBit3 = (y & 2) >> 1
-            pixelBit4 = y & 1
-            pixelBit5 = (y & 4) >> 2
-
-        elif bpp == 0x10:
-            pixelBit0 = x & 1
-            pixelBit1 = (x & 2) >> 1
-            pixelBit2 = (x & 4) >> 2
-            pixelBit3 = y & 1
-            pixelBit4 = (y & 2) >> 1
-            pixelBit5 = (y & 4) >> 2
-
-        elif bpp in [0x20, 0x60]:
-            pixelBit0 = x & 1
-            pixelBit1 = (x & 2) >> 1
-            pixelBit2 = y & 1
-            pixelBit3 = (x & 4) >> 2
-            pixelBit4 = (y & 2) >> 1
-            pixelBit5 = (y & 4) >> 2
-
-        elif bpp == 0x40:
-            pixelBit0 = x & 1
-            pixelBit1 = y & 1
-            pixelBit2 = (x & 2) >> 1
-            pixelBit3 = (x & 4) >> 2
-            pixelBit4 = (y & 2) >> 1
-            pixelBit5 = (y & 4) >> 2
-
-        elif bpp == 0x80:
-            pixelBit0 = y & 1
-            pixelBit1 = x & 1
-            pixelBit2 = (x & 2) >> 1
-            pixelBit3 = (x & 4) >> 2
-            pixelBit4 = (y & 2) >> 1
-            pixelBit5 = (y & 4) >> 2
+cdef fillPixelIndexTables():
+    cdef u32 isDepth, bpp, i
 
-        else:
-            pixelBit0 = x & 1
-            pixelBit1 = (x & 2) >> 1
-            pixelBit2 = y & 1
-            pixelBit3 = (x & 4) >> 2
-            pixelBit4 = (y & 2) >> 1
-            pixelBit5 = (y & 4) >> 2
+    for isDepth in range(2):
+        for bpp in range(0, 136, 8):
+            table = tables.getPixelIndexTable(bpp, 8, isDepth)
+            for i in range(512):
+                pixelIndexTables[isDepth][bpp >> 3][i] = table[i]
 
-    if thickness > 1:
-        pixelBit6 = z & 1
-        pixelBit7 = (z & 2) >> 1
 
-    if thickness == 8:
-        pixelBit8 = (z & 4) >> 2
+fillPixelIndexTables()
 
-    return (pixelBit8 << 8) | (pixelBit7 << 7) | (pixelBit6 << 6) | 32 * pixelBit5 | 16 * pixelBit4 | 8 * pixelBit3 | 4 * pixelBit2 | pixelBit0 | 2 * pixelBit1
 
+cdef u32 computeSurfaceThickness(u32 tileMode) noexcept nogil:
+    if tileMode < numTileModes:
+        return surfaceThickness[tileMode]
 
+    return 1
 
-cdef u32 computePipeFromCoordWoRotation(u32 x, u32 y):
-    return ((y >> 3) ^ (x >> 3)) & 1
 
+cdef u32 computePixelIndexWithinMicroTile(u32 x, u32 y, u32 z, u32 bpp, u32 tileMode, int isDepth) noexcept nogil:
+    cdef u32 thickness = computeSurfaceThickness(tileMode)
 
-cdef u32 computeBankFromCoordWoRotation(u32 x, u32 y):
-    return ((y >> 5) ^ (x >> 3)) & 1 | 2 * (((y >> 4) ^ (x >> 4)) & 1)
+    if bpp > 128 or bpp & 7:
+        bpp = 0  # Same table as any other unlisted bpp
 
+    return pixelIndexTables[isDepth != 0][bpp >> 3][(z & (thickness - 1)) << 6 | (y & 7) << 3 | x & 7]
 
-cdef u32 computeSurfaceRotationFromTileMode(u32 tileMode):
-    if tileMode in [4, 5, 6, 7, 8, 9, 10, 11]:
-        return 2
 
-    elif tileMode in [12, 13, 14, 15]:
-        return 1
+cdef u32 computePipeFromCoordWoRotation(u32 x, u32 y) noexcept nogil:
+    return pipeTable[(x >> 3) & 1 | ((y >> 3) & 1) << 1]
 
-    return 0
+
+cdef u32 computeBankFromCoordWoRotation(u32 x, u32 y) noexcept nogil:
+    return bankTable[(x >> 3) & 3 | ((y >> 4) & 3) << 2]
 
 
-cdef u32 isThickMacroTiled(u32 tileMode):
-    if tileMode in [7, 11, 13, 15]:
-        return 1
+cdef u32 computeSurfaceRotationFromTileMode(u32 tileMode) noexcept nogil:
+    if tileMode < numTileModes:
+        return surfaceRotation[tileMode]
 
     return 0
 
 
-cdef u32 isBankSwappedTileMode(u32 tileMode):
-    if tileMode in [8, 9, 10, 11, 14, 15]:
-        return 1
+cdef u32 isThickMacroTiled(u32 tileMode) noexcept nogil:
+    if tileMode < numTileModes:
+        return thickMacroTiled[tileMode]
 
     return 0
 
 
-cdef u32 computeMacroTileAspectRatio(u32 tileMode):
-    if tileMode in [5, 9]:
-        return 2
+cdef u32 isBankSwappedTileMode(u32 tileMode) noexcept nogil:
+    if tileMode < numTileModes:
+        return bankSwappedTileMode[tileMode]
 
-    elif tileMode in [6, 10]:
-        return 4
+    return 0
+
+
+cdef u32 computeMacroTileAspectRatio(u32 tileMode) noexcept nogil:
+    if tileMode < numTileModes:
+        return macroTileAspectRatio[tileMode]
 
     return 1
 
 
-cdef u32 computeSurfaceBankSwappedWidth(u32 tileMode, u32 bpp, u32 numSamples, u32 pitch):
+@cython.cdivision(True)
+cdef u32 computeSurfaceBankSwappedWidth(u32 tileMode, u32 bpp, u32 numSamples, u32 pitch) noexcept nogil:
     if isBankSwappedTileMode(tileMode) == 0:
         return 0
 
@@ -357,7 +1067,8 @@ cdef u32 computeSurfaceBankSwappedWidth(u32 tileMode, u32 bpp, u32 numSamples, u
     return bankSwapWidth
 
 
-cdef u64 computeSurfaceAddrFromCoordLinear(u32 x, u32 y, u32 slice, u32 sample, u32 bpp, u32 pitch, u32 height, u32 numSlices):
+@cython.cdivision(True)
+cpdef u64 computeSurfaceAddrFromCoordLinear(u32 x, u32 y, u32 slice, u32 sample, u32 bpp, u32 pitch, u32 height, u32 numSlices) noexcept nogil:
     cdef:
         u64 sliceOffset = pitch * height * (slice + sample * numSlices)
         u64 addr = (y * pitch + x + sliceOffset) * bpp
@@ -365,8 +1076,9 @@ cdef u64 computeSurfaceAddrFromCoordLinear(u32 x, u32 y, u32 slice, u32 sample,
     return addr
 
 
-cdef u64 computeSurfaceAddrFromCoordMicroTiled(u32 x, u32 y, u32 slice, u32 bpp, u32 pitch, u32 height,
-                                               u32 tileMode, int isDepth):
+@cython.cdivision(True)
+cpdef u64 computeSurfaceAddrFromCoordMicroTiled(u32 x, u32 y, u32 slice, u32 bpp, u32 pitch, u32 height,
+                                               u32 tileMode, int isDepth) noexcept nogil:
 
     cdef u64 microTileThickness = 1
     if tileMode == 3:
@@ -394,9 +1106,10 @@ cdef u8 bankSwapOrder[10]
 bankSwapOrder[:] = [0, 1, 3, 2, 6, 7, 5, 4, 0, 0]
 
 
-cdef u64 computeSurfaceAddrFromCoordMacroTiled(u32 x, u32 y, u32 slice, u32 sample, u32 bpp, u32 pitch, u32 height,
+@cython.cdivision(True)
+cpdef u64 computeSurfaceAddrFromCoordMacroTiled(u32 x, u32 y, u32 slice, u32 sample, u32 bpp, u32 pitch, u32 height,
                                                u32 numSamples, u32 tileMode, int isDepth,
-                                               u32 pipeSwizzle, u32 bankSwizzle):
+                                               u32 pipeSwizzle, u32 bankSwizzle) noexcept nogil:
 
     cdef:
         u64 sampleSlice, samplesPerSlice, tileSliceBits
@@ -486,10 +1199,18 @@ cdef u64 computeSurfaceAddrFromCoordMacroTiled(u32 x, u32 y, u32 slice, u32 samp
     return bank << 9 | pipe << 8 | totalOffset & 255 | (totalOffset & -256) << 3
 
 
-cdef:
-    u32 expPitch = 0
-    u32 expHeight = 0
-    u32 expNumSlices = 0
+cdef (u32, u32) getMacroTileSize(u32 tileMode):
+    """
+    Returns the width and height of a macro tile, in elements.
+    """
+
+    if tileMode in [5, 9]:
+        return 16, 32
+
+    elif tileMode in [6, 10]:
+        return 8, 64
+
+    return 32, 16
 
 
 cdef class Flags:
@@ -596,52 +1317,33 @@ cdef class surfaceOut:
         self.tileIndex = 0
 
 
-class pyClass:
-    pass
+TileInfo = namedtuple('TileInfo', [
+    'banks', 'bankWidth', 'bankHeight', 'macroAspectRatio', 'tileSplitBytes', 'pipeConfig',
+])
+
 
+SurfaceInfo = namedtuple('SurfaceInfo', [
+    'size', 'pitch', 'height', 'depth', 'surfSize', 'tileMode', 'baseAlign', 'pitchAlign', 'heightAlign',
+    'depthAlign', 'bpp', 'pixelPitch', 'pixelHeight', 'pixelBits', 'sliceSize', 'pitchTileMax',
+    'heightTileMax', 'sliceTileMax', 'pTileInfo', 'tileType', 'tileIndex',
+])
 
-def surfaceOutToPyClass(surfaceOut pSurfOut):
+
+def surfaceOutToSurfaceInfo(surfaceOut pSurfOut):
     # We can't return a Cython class
-    # Copy the attributes from our Cython class to a Python class
+    # Copy the attributes from our Cython class to an immutable Python record
     # and return it instead
-    pypOut = pyClass()
-    pypTileInfo = pyClass() 
-
-    pypTileInfo.banks = pSurfOut.pTileInfo.banks
-    pypTileInfo.bankWidth = pSurfOut.pTileInfo.bankWidth
-    pypTileInfo.bankHeight = pSurfOut.pTileInfo.bankHeight
-    pypTileInfo.macroAspectRatio = pSurfOut.pTileInfo.macroAspectRatio
-    pypTileInfo.tileSplitBytes = pSurfOut.pTileInfo.tileSplitBytes
-    pypTileInfo.pipeConfig = pSurfOut.pTileInfo.pipeConfig
-
-    pypOut.size = pSurfOut.size
-    pypOut.pitch = pSurfOut.pitch
-    pypOut.height = pSurfOut.height
-    pypOut.depth = pSurfOut.depth
-    pypOut.surfSize = pSurfOut.surfSize
-    pypOut.tileMode = pSurfOut.tileMode
-    pypOut.baseAlign = pSurfOut.baseAlign
-    pypOut.pitchAlign = pSurfOut.pitchAlign
-    pypOut.heightAlign = pSurfOut.heightAlign
-    pypOut.depthAlign = pSurfOut.depthAlign
-    pypOut.bpp = pSurfOut.bpp
-    pypOut.pixelPitch = pSurfOut.pixelPitch
-    pypOut.pixelHeight = pSurfOut.pixelHeight
-    pypOut.pixelBits = pSurfOut.pixelBits
-    pypOut.sliceSize = pSurfOut.sliceSize
-    pypOut.pitchTileMax = pSurfOut.pitchTileMax
-    pypOut.heightTileMax = pSurfOut.heightTileMax
-    pypOut.sliceTileMax = pSurfOut.sliceTileMax
-    pypOut.pTileInfo = pypTileInfo
-    pypOut.tileType = pSurfOut.tileType
-    pypOut.tileIndex = pSurfOut.tileIndex
-
-    return pypOut
-
-
-cdef:
-    surfaceIn pIn = surfaceIn()
-    surfaceOut pOut = surfaceOut()
+    cdef tileInfo pTileInfo = pSurfOut.pTileInfo
+
+    return SurfaceInfo(
+        pSurfOut.size, pSurfOut.pitch, pSurfOut.height, pSurfOut.depth, pSurfOut.surfSize, pSurfOut.tileMode,
+        pSurfOut.baseAlign, pSurfOut.pitchAlign, pSurfOut.heightAlign, pSurfOut.depthAlign, pSurfOut.bpp,
+        pSurfOut.pixelPitch, pSurfOut.pixelHeight, pSurfOut.pixelBits, pSurfOut.sliceSize, pSurfOut.pitchTileMax,
+        pSurfOut.heightTileMax, pSurfOut.sliceTileMax,
+        TileInfo(pTileInfo.banks, pTileInfo.bankWidth, pTileInfo.bankHeight, pTileInfo.macroAspectRatio,
+                 pTileInfo.tileSplitBytes, pTileInfo.pipeConfig),
+        pSurfOut.tileType, pSurfOut.tileIndex,
+    )
 
 
 cdef u32 powTwoAlign(u32 x, u32 align):
@@ -666,7 +1368,7 @@ cdef (u32, u32, u32, u32) getBitsPerPixel(u32 format_):
             formatExInfo[fmtIdx + 2], formatExInfo[fmtIdx + 3])
 
 
-cdef u32 adjustSurfaceInfo(u32 elemMode, u32 expandX, u32 expandY, u32 bpp, u32 width, u32 height):
+cdef u32 adjustSurfaceInfo(surfaceIn pIn, u32 elemMode, u32 expandX, u32 expandY, u32 bpp, u32 width, u32 height):
     cdef:
         u32 bBCnFormat = 0
         u32 widtha, heighta
@@ -712,7 +1414,7 @@ cdef u32 adjustSurfaceInfo(u32 elemMode, u32 expandX, u32 expandY, u32 bpp, u32
     return 0
 
 
-cdef u32 hwlComputeMipLevel():
+cdef u32 hwlComputeMipLevel(surfaceIn pIn):
     cdef:
         u32 width, widtha
         u32 height, heighta
@@ -746,7 +1448,7 @@ cdef u32 hwlComputeMipLevel():
     return handled
 
 
-cdef void computeMipLevel():
+cdef void computeMipLevel(surfaceIn pIn):
     cdef:
         u32 slices = 0
         u32 height = 0
@@ -757,7 +1459,7 @@ cdef void computeMipLevel():
         pIn.width = powTwoAlign(pIn.width, 4)
         pIn.height = powTwoAlign(pIn.height, 4)
 
-    hwlHandled = hwlComputeMipLevel()
+    hwlHandled = hwlComputeMipLevel(pIn)
     if not hwlHandled and pIn.mipLevel and (pIn.flags.value >> 12) & 1:
         width = max(1, pIn.width >> pIn.mipLevel)
         height = max(1, pIn.height >> pIn.mipLevel)
@@ -910,11 +1612,7 @@ cdef u32 computeSurfaceMipLevelTileMode(u32 baseTileMode, u32 bpp, u32 level, u3
         1)
 
 
-cdef (u32, u32, u32) padDimensions(u32 tileMode, u32 padDims, u32 isCube, u32 pitchAlign, u32 heightAlign, u32 sliceAlign):
-    global expPitch
-    global expHeight
-    global expNumSlices
-
+cdef (u32, u32, u32) padDimensions(u32 expPitch, u32 expHeight, u32 expNumSlices, u32 tileMode, u32 padDims, u32 isCube, u32 pitchAlign, u32 heightAlign, u32 sliceAlign):
     cdef u32 thickness = computeSurfaceThickness(tileMode)
     if not padDims:
         padDims = 3
@@ -973,14 +1671,11 @@ cdef (u32, u32, u32) computeSurfaceAlignmentsLinear(u32 tileMode, u32 bpp, Flags
     return baseAlign, pitchAlign, heightAlign
 
 
-cdef u32 computeSurfaceInfoLinear(u32 tileMode, u32 bpp, u32 numSamples, u32 pitch, u32 height, u32 numSlices, u32 mipLevel, u32 padDims, Flags flags):
-    global expPitch
-    global expHeight
-    global expNumSlices
-
-    expPitch = pitch
-    expHeight = height
-    expNumSlices = numSlices
+cdef u32 computeSurfaceInfoLinear(surfaceOut pOut, u32 tileMode, u32 bpp, u32 numSamples, u32 pitch, u32 height, u32 numSlices, u32 mipLevel, u32 padDims, Flags flags):
+    cdef:
+        u32 expPitch = pitch
+        u32 expHeight = height
+        u32 expNumSlices = numSlices
 
     cdef:
         u32 valid = 1
@@ -1011,6 +1706,9 @@ cdef u32 computeSurfaceInfoLinear(u32 tileMode, u32 bpp, u32 numSamples, u32 pit
             expNumSlices = nextPow2(numSlices)
 
     expPitch, expHeight, expNumSlices = padDimensions(
+        expPitch,
+        expHeight,
+        expNumSlices,
         tileMode,
         padDims,
         (flags.value >> 4) & 1,
@@ -1049,14 +1747,11 @@ cdef (u32, u32, u32) computeSurfaceAlignmentsMicroTiled(u32 tileMode, u32 bpp, F
     return baseAlign, pitchAlign, heightAlign
 
 
-cdef u32 computeSurfaceInfoMicroTiled(u32 tileMode, u32 bpp, u32 numSamples, u32 pitch, u32 height, u32 numSlices, u32 mipLevel, u32 padDims, Flags flags):
-    global expPitch
-    global expHeight
-    global expNumSlices
-
-    expPitch = pitch
-    expHeight = height
-    expNumSlices = numSlices
+cdef u32 computeSurfaceInfoMicroTiled(surfaceOut pOut, u32 tileMode, u32 bpp, u32 numSamples, u32 pitch, u32 height, u32 numSlices, u32 mipLevel, u32 padDims, Flags flags):
+    cdef:
+        u32 expPitch = pitch
+        u32 expHeight = height
+        u32 expNumSlices = numSlices
 
     cdef:
         u32 valid = 1
@@ -1089,6 +1784,9 @@ cdef u32 computeSurfaceInfoMicroTiled(u32 tileMode, u32 bpp, u32 numSamples, u32
         numSamples)
 
     expPitch, expHeight, expNumSlices = padDimensions(
+        expPitch,
+        expHeight,
+        expNumSlices,
         expTileMode,
         padDims,
         (flags.value >> 4) & 1,
@@ -1148,14 +1846,11 @@ cdef (u32, u32, u32, u32, u32) computeSurfaceAlignmentsMacroTiled(u32 tileMode,
     return baseAlign, pitchAlign, heightAlign, macroTileWidth, macroTileHeight
 
 
-cdef u32 computeSurfaceInfoMacroTiled(u32 tileMode, u32 baseTileMode, u32 bpp, u32 numSamples, u32 pitch, u32 height, u32 numSlices, u32 mipLevel, u32 padDims, Flags flags):
-    global expPitch
-    global expHeight
-    global expNumSlices
-
-    expPitch = pitch
-    expHeight = height
-    expNumSlices = numSlices
+cdef u32 computeSurfaceInfoMacroTiled(surfaceOut pOut, u32 tileMode, u32 baseTileMode, u32 bpp, u32 numSamples, u32 pitch, u32 height, u32 numSlices, u32 mipLevel, u32 padDims, Flags flags):
+    cdef:
+        u32 expPitch = pitch
+        u32 expHeight = height
+        u32 expNumSlices = numSlices
 
     cdef:
         u32 valid = 1
@@ -1197,6 +1892,9 @@ cdef u32 computeSurfaceInfoMacroTiled(u32 tileMode, u32 baseTileMode, u32 bpp, u
             pitchAlign = bankSwappedWidth
 
         expPitch, expHeight, expNumSlices = padDimensions(
+            expPitch,
+            expHeight,
+            expNumSlices,
             tileMode,
             padDims,
             (flags.value >> 4) & 1,
@@ -1228,6 +1926,7 @@ cdef u32 computeSurfaceInfoMacroTiled(u32 tileMode, u32 baseTileMode, u32 bpp, u
             expTileMode = 2
 
             result = computeSurfaceInfoMicroTiled(
+                pOut,
                 2,
                 bpp,
                 numSamples,
@@ -1250,6 +1949,9 @@ cdef u32 computeSurfaceInfoMacroTiled(u32 tileMode, u32 baseTileMode, u32 bpp, u
                 pitchAlign = bankSwappedWidth
 
             expPitch, expHeight, expNumSlices = padDimensions(
+                expPitch,
+                expHeight,
+                expNumSlices,
                 tileMode,
                 padDims,
                 (flags.value >> 4) & 1,
@@ -1271,7 +1973,7 @@ cdef u32 computeSurfaceInfoMacroTiled(u32 tileMode, u32 baseTileMode, u32 bpp, u
     return result
 
 
-cdef u32 ComputeSurfaceInfoEx():
+cdef u32 ComputeSurfaceInfoEx(surfaceIn pIn, surfaceOut pOut):
     cdef:
         u32 tileMode = pIn.tileMode
         u32 bpp = pIn.bpp
@@ -1307,6 +2009,7 @@ cdef u32 ComputeSurfaceInfoEx():
 
     if tileMode in [0, 1]:
         valid = computeSurfaceInfoLinear(
+            pOut,
             tileMode,
             bpp,
             numSamples,
@@ -1321,6 +2024,7 @@ cdef u32 ComputeSurfaceInfoEx():
 
     elif tileMode in [2, 3]:
         valid = computeSurfaceInfoMicroTiled(
+            pOut,
             tileMode,
             bpp,
             numSamples,
@@ -1333,6 +2037,7 @@ cdef u32 ComputeSurfaceInfoEx():
 
     elif tileMode in [4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15]:
         valid = computeSurfaceInfoMacroTiled(
+            pOut,
             tileMode,
             baseTileMode,
             bpp,
@@ -1350,7 +2055,7 @@ cdef u32 ComputeSurfaceInfoEx():
     return 0
 
 
-cdef u32 restoreSurfaceInfo(u32 elemMode, u32 expandX, u32 expandY, u32 bpp):
+cdef u32 restoreSurfaceInfo(surfaceOut pOut, u32 elemMode, u32 expandX, u32 expandY, u32 bpp):
     cdef u32 width, height
 
     if pOut.pixelPitch and pOut.pixelHeight:
@@ -1387,13 +2092,7 @@ cdef u32 restoreSurfaceInfo(u32 elemMode, u32 expandX, u32 expandY, u32 bpp):
     return 0
 
 
-cdef void computeSurfaceInfo(surfaceIn aSurfIn, surfaceOut pSurfOut):
-    global pIn
-    global pOut
-
-    pIn = aSurfIn
-    pOut = pSurfOut
-
+cdef void computeSurfaceInfo(surfaceIn pIn, surfaceOut pOut):
     cdef:
         u32 returnCode = 0
         u32 elemMode = 0
@@ -1405,7 +2104,7 @@ cdef void computeSurfaceInfo(surfaceIn aSurfIn, surfaceOut pSurfOut):
         returnCode = 3
 
     if returnCode == 0:
-        computeMipLevel()
+        computeMipLevel(pIn)
 
         width = pIn.width
         height = pIn.height
@@ -1421,7 +2120,7 @@ cdef void computeSurfaceInfo(surfaceIn aSurfIn, surfaceOut pSurfOut):
             if elemMode == 4 and expandX == 3 and pIn.tileMode == 1:
                 pIn.flags.value |= 0x200
 
-            bpp = adjustSurfaceInfo(elemMode, expandX, expandY, bpp, width, height)
+            bpp = adjustSurfaceInfo(pIn, elemMode, expandX, expandY, bpp, width, height)
 
         elif pIn.bpp:
             pIn.width = max(1, pIn.width)
@@ -1431,7 +2130,7 @@ cdef void computeSurfaceInfo(surfaceIn aSurfIn, surfaceOut pSurfOut):
             returnCode = 3
 
         if returnCode == 0:
-            returnCode = ComputeSurfaceInfoEx()
+            returnCode = ComputeSurfaceInfoEx(pIn, pOut)
 
         if returnCode == 0:
             pOut.bpp = pIn.bpp
@@ -1439,7 +2138,7 @@ cdef void computeSurfaceInfo(surfaceIn aSurfIn, surfaceOut pSurfOut):
             pOut.pixelHeight = pOut.height
 
             if pIn.format and (not (pIn.flags.value >> 9) & 1 or not pIn.mipLevel):
-                bpp = restoreSurfaceInfo(elemMode, expandX, expandY, bpp)
+                bpp = restoreSurfaceInfo(pOut, elemMode, expandX, expandY, bpp)
 
             if (pIn.flags.value >> 5) & 1:
                 pOut.sliceSize = pOut.surfSize
@@ -1455,16 +2154,9 @@ cdef void computeSurfaceInfo(surfaceIn aSurfIn, surfaceOut pSurfOut):
             pOut.sliceTileMax = (pOut.height * pOut.pitch >> 6) - 1
 
 
-def getSurfaceInfo(u32 surfaceFormat, u32 surfaceWidth, u32 surfaceHeight, u32 surfaceDepth, u32 surfaceDim, u32 surfaceTileMode, u32 surfaceAA, u32 level):
+cpdef computeGX2SurfaceInfo(u32 surfaceFormat, u32 surfaceWidth, u32 surfaceHeight, u32 surfaceDepth, u32 surfaceDim, u32 surfaceTileMode, u32 surfaceAA, u32 level):
     """
-    surfaceFormat: format of the surface (GX2SurfaceFormat)
-    surfaceWidth: width of the surface
-    surfaceHeight: height of the surface
-    surfaceDepth: depth of the surface
-    surfaceDim: dim of the surface (GX2SurfaceDim)
-    surfaceTileMode: GX2TileMode (note: NOT AddrTileMode)
-    surfaceAA: AA mode of the surface (GX2AAMode)
-    level: mip level of which the info will be calculated for (first mipmap corresponds to value 1)
+    Same as getSurfaceInfo(), but always computed.
     """
 
     cdef:
@@ -1588,9 +2280,101 @@ def getSurfaceInfo(u32 surfaceFormat, u32 surfaceWidth, u32 surfaceHeight, u32 s
         pSurfOut.size = 96
         computeSurfaceInfo(aSurfIn, pSurfOut)
 
-        pSurfOut = pOut
-
     if not pSurfOut.tileMode:
         pSurfOut.tileMode = 16
 
-    return surfaceOutToPyClass(pSurfOut)
+    return surfaceOutToSurfaceInfo(pSurfOut)
+
+
+def getSurfaceInfo(u32 surfaceFormat, u32 surfaceWidth, u32 surfaceHeight, u32 surfaceDepth, u32 surfaceDim, u32 surfaceTileMode, u32 surfaceAA, u32 level):
+    """
+    surfaceFormat: format of the surface (GX2SurfaceFormat)
+    surfaceWidth: width of the surface
+    surfaceHeight: height of the surface
+    surfaceDepth: depth of the surface
+    surfaceDim: dim of the surface (GX2SurfaceDim)
+    surfaceTileMode: GX2TileMode (note: NOT AddrTileMode)
+    surfaceAA: AA mode of the surface (GX2AAMode)
+    level: mip level of which the info will be calculated for (first mipmap corresponds to value 1)
+
+    The results are memoized in surfaceInfoCache.
+    """
+
+    cdef tuple key = (surfaceFormat, surfaceWidth, surfaceHeight, surfaceDepth, surfaceDim, surfaceTileMode, surfaceAA, level)
+
+    pSurfOut = surfaceInfoCache.get(key)
+    if pSurfOut is None:
+        pSurfOut = surfaceInfoCache.put(key, computeGX2SurfaceInfo(*key))
+
+    return pSurfOut
+
+
+MipLevelInfo = namedtuple('MipLevelInfo', [
+    'level', 'width', 'height', 'numSlices', 'pitch', 'pixelHeight', 'surfSize', 'baseAlign', 'tileMode',
+    'bpp', 'offset', 'linearOffset', 'linearSize',
+])
+
+
+def getMipChainLayout(format_, width, height, depth, dim, tileMode, aa, numMips):
+    """
+    format_: format of the surface (GX2SurfaceFormat)
+    width: width of the surface
+    height: height of the surface
+    depth: depth of the surface
+    dim: dim of the surface (GX2SurfaceDim)
+    tileMode: GX2TileMode (note: NOT AddrTileMode)
+    aa: AA mode of the surface (GX2AAMode)
+    numMips: number of levels, including the base level
+
+    Returns a MipLevelInfo for every level, where:
+    pixelHeight: padded height of the level, the height its slices have to be (un)swizzled with
+    offset: offset of the swizzled level, in the image data for level 0 and in the mip data for the rest
+    linearOffset: offset of the level in the linear (deswizzled) mip chain
+    linearSize: size of the linear level
+    """
+
+    if format_ in BCn_formats:
+        blkWidth, blkHeight = 4, 4
+
+    else:
+        blkWidth, blkHeight = 1, 1
+
+    levels = []
+    offset = 0
+    mipSize = 0
+    linearOffset = 0
+
+    for level in range(max(1, numMips)):
+        surfOut = getSurfaceInfo(format_, width, height, depth, dim, tileMode, aa, level)
+
+        width_ = max(1, width >> level)
+        height_ = 1 if dim in [0, 4] else max(1, height >> level)
+
+        if dim == 2:
+            numSlices = max(1, depth >> level)
+
+        elif dim == 3:
+            numSlices = max(6, depth)
+
+        elif dim in [4, 5, 7]:
+            numSlices = depth
+
+        else:
+            numSlices = 1
+
+        if level:
+            # The mip levels are stored one after the other in the mip data, each one aligned to its baseAlign
+            offset = (mipSize + surfOut.baseAlign - 1) // surfOut.baseAlign * surfOut.baseAlign
+            mipSize = offset + surfOut.surfSize
+
+        linearSize = (((width_ + blkWidth - 1) // blkWidth) * ((height_ + blkHeight - 1) // blkHeight)
+                      * ((surfOut.bpp + 7) // 8) * numSlices)
+
+        levels.append(MipLevelInfo(
+            level, width_, height_, numSlices, surfOut.pitch, surfOut.pixelHeight, surfOut.surfSize,
+            surfOut.baseAlign, surfOut.tileMode, surfOut.bpp, offset, linearOffset, linearSize,
+        ))
+
+        linearOffset += linearSize
+
+    return levels
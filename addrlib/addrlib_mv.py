@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# addrlib_mv.py
+# A standard library only swizzling backend for the Address Library,
+# moving whole elements through typed memoryviews.
+
+
+################################################################
+################################################################
+
+from array import array
+from collections import deque
+
+from .addrlib import (
+    BCn_formats, GX2TileModeToAddrTileMode, getAddrMapKey, getSurfaceAddrMap, getAddrMapRunLength,
+    getResultView, getLinearSize, getRowBands, runBands, swizzleLinearSurf, SurfaceDesc, getRetileSize,
+    getTransformedSize,
+)
+from .addrlib import swizzleSurf as swizzleSurfByRuns, retileSurf as retileSurfByElements
+from .addrlib import deswizzleRegion  # Regions are small enough to be copied element by element
+from .cache import addrMapCache
+
+
+# Typecode of the items elements are moved as, by item size
+itemTypecodes = {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}
+
+
+def getItemSize(width, bytesPerPixel, runLength):
+    """
+    Returns the size of the largest item (up to 8 bytes) the rows can be split into,
+    every item being either a part of an element or a run of contiguous elements.
+    16-byte (BC2, BC3, BC5...) elements are moved as two 8-byte items, for example,
+    and runs of eight 1-byte elements as one 8-byte item.
+    """
+
+    itemSize = 8
+    while (runLength * bytesPerPixel) % itemSize or (width * bytesPerPixel) % itemSize:
+        itemSize //= 2
+
+    return itemSize
+
+
+def getSurfaceItemMap(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                      pitch, bitsPerPixel, slice, sample, itemSize=None):
+
+    """
+    Returns the size of the items the surface is moved as (see getItemSize(), unless given), and the index of every item
+    in the swizzled data (as an array of items), as an array('I') in linear (row-major) item order.
+    The index map is None if the elements aren't aligned to the item size.
+    The maps are cached in addrMapCache alongside the address maps.
+    """
+
+    addrMap = getSurfaceAddrMap(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                                pitch, bitsPerPixel, slice, sample)
+
+    bytesPerPixel = bitsPerPixel // 8
+
+    elemWidth, elemHeight = width, height
+    if format_ in BCn_formats:
+        elemWidth = (width + 3) // 4
+        elemHeight = (height + 3) // 4
+
+    if itemSize is None:
+        itemSize = getItemSize(elemWidth, bytesPerPixel,
+                               getAddrMapRunLength(addrMap, elemWidth, elemHeight, bytesPerPixel))
+
+    key = ('items', itemSize) + getAddrMapKey(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                                              pitch, bitsPerPixel, slice, sample)
+
+    itemMap = addrMapCache.get(key)
+    if itemMap is not None:
+        return itemSize, itemMap
+
+    if itemSize >= bytesPerPixel:
+        # Only the first element of every item is needed
+        addrMap = addrMap[::itemSize // bytesPerPixel]
+
+    if any(map(itemSize.__rmod__, addrMap)):
+        return itemSize, None
+
+    if itemSize >= bytesPerPixel:
+        itemMap = array('I', [addr // itemSize for addr in addrMap])
+
+    else:
+        itemOffsets = range(bytesPerPixel // itemSize)
+        itemMap = array('I', [addr // itemSize + i for addr in addrMap for i in itemOffsets])
+
+    return itemSize, addrMapCache.put(key, itemMap)
+
+
+def swizzleSurf(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                pitch, bitsPerPixel, slice, sample, data, dataSize, swizzle, out=None, offset=0, threads=1,
+                transform=None):
+
+    """
+    Same as addrlib.swizzleSurf(), but the source and destination are cast to typed memoryviews
+    and every element is moved by index (as one or more items), without any slice object.
+    Falls back to addrlib.swizzleSurf() if some elements are out of bounds or unaligned,
+    or have to be transformed.
+    """
+
+    if transform is not None:
+        return swizzleSurfByRuns(width, height, depth, format_, aa, use, tileMode, swizzle_, pitch, bitsPerPixel,
+                                 slice, sample, data, dataSize, swizzle, out, offset, threads, transform)
+
+    bytesPerPixel = bitsPerPixel // 8
+    src = memoryview(data).cast('B')
+    result = getResultView(out, offset, dataSize)
+
+    if swizzle:
+        linearSize, swizzledSize = len(src), dataSize
+
+    else:
+        linearSize, swizzledSize = dataSize, len(src)
+
+    if GX2TileModeToAddrTileMode(tileMode) in [0, 1]:
+        swizzleLinearSurf(width, height, depth, format_, tileMode, pitch, bytesPerPixel, slice, sample,
+                          src, result, linearSize, swizzledSize, swizzle, threads)
+
+        return result
+
+    if not bytesPerPixel:
+        return result
+
+    itemSize, itemMap = getSurfaceItemMap(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                                          pitch, bitsPerPixel, slice, sample)
+
+    elemWidth, elemHeight = width, height
+    if format_ in BCn_formats:
+        elemWidth = (width + 3) // 4
+        elemHeight = (height + 3) // 4
+
+    linearSize_ = elemWidth * elemHeight * bytesPerPixel
+
+    if (itemMap is None or not itemMap or linearSize_ > linearSize
+            or (max(itemMap) + 1) * itemSize > swizzledSize):
+
+        return swizzleSurfByRuns(width, height, depth, format_, aa, use, tileMode, swizzle_, pitch,
+                                 bitsPerPixel, slice, sample, data, dataSize, swizzle, out, offset, threads)
+
+    typecode = itemTypecodes[itemSize]
+    rowItems = elemWidth * bytesPerPixel // itemSize
+
+    if swizzle:
+        linear = src[:linearSize_].cast(typecode)
+        swizzled = result[:dataSize // itemSize * itemSize].cast(typecode)
+
+        def copyRows(yStart, yEnd):
+            start, end = yStart * rowItems, yEnd * rowItems
+            deque(map(swizzled.__setitem__, itemMap[start:end], linear[start:end]), 0)
+
+    else:
+        linear = result[:linearSize_].cast(typecode)
+        swizzled = src[:len(src) // itemSize * itemSize].cast(typecode)
+
+        def copyRows(yStart, yEnd):
+            start, end = yStart * rowItems, yEnd * rowItems
+            linear[start:end] = array(typecode, map(swizzled.__getitem__, itemMap[start:end]))
+
+    runBands(copyRows, getRowBands(elemHeight, tileMode, threads))
+
+    return result
+
+
+def retileSurf(srcDesc, dstDesc, data, dataSize, out=None, offset=0, threads=1):
+    """
+    Same as addrlib.retileSurf(), but every element is moved by index (as one or more items)
+    through typed memoryviews.
+    Falls back to addrlib.retileSurf() if some elements are out of bounds or unaligned.
+    """
+
+    srcDesc, dstDesc = SurfaceDesc(*srcDesc), SurfaceDesc(*dstDesc)
+    width, height = getRetileSize(srcDesc, dstDesc)
+
+    bytesPerPixel = srcDesc.bpp // 8
+    src = memoryview(data).cast('B')
+    result = getResultView(out, offset, dataSize)
+
+    if not bytesPerPixel:
+        return result
+
+    # The runs of contiguous elements can differ between the two layouts
+    itemSize = getItemSize(width, bytesPerPixel, 1)
+    numItems = width * height * bytesPerPixel // itemSize
+
+    srcItems = getSurfaceItemMap(*srcDesc, itemSize)[1]
+    dstItems = getSurfaceItemMap(*dstDesc, itemSize)[1]
+
+    if (srcItems is None or dstItems is None or not numItems
+            or (max(srcItems[:numItems]) + 1) * itemSize > len(src)
+            or (max(dstItems[:numItems]) + 1) * itemSize > dataSize):
+
+        return retileSurfByElements(srcDesc, dstDesc, data, dataSize, out, offset, threads)
+
+    typecode = itemTypecodes[itemSize]
+    rowItems = width * bytesPerPixel // itemSize
+
+    srcView = src[:len(src) // itemSize * itemSize].cast(typecode)
+    dstView = result[:dataSize // itemSize * itemSize].cast(typecode)
+
+    def copyRows(yStart, yEnd):
+        start, end = yStart * rowItems, yEnd * rowItems
+        deque(map(dstView.__setitem__, dstItems[start:end], map(srcView.__getitem__, srcItems[start:end])), 0)
+
+    runBands(copyRows, getRowBands(height, dstDesc.tileMode, threads))
+
+    return result
+
+
+def deswizzle(width, height, depth, format_, aa, use, tileMode, swizzle_,
+              pitch, bpp, slice, sample, data, threads=1):
+
+    return bytes(swizzleSurf(width, height, depth, format_, aa, use, tileMode, swizzle_, pitch, bpp,
+                             slice, sample, data, len(data), False, threads=threads))
+
+
+def swizzle(width, height, depth, format_, aa, use, tileMode, swizzle_,
+            pitch, bpp, slice, sample, data, threads=1, transform=None):
+
+    return bytes(swizzleSurf(width, height, depth, format_, aa, use, tileMode, swizzle_, pitch, bpp,
+                             slice, sample, data, getTransformedSize(len(data), bpp, transform), True,
+                             threads=threads, transform=transform))
+
+
+def deswizzleInto(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                  pitch, bpp, slice, sample, data, out=None, offset=0, size=None, threads=1):
+
+    if size is None:
+        size = getLinearSize(width, height, format_, bpp)
+
+    return swizzleSurf(width, height, depth, format_, aa, use, tileMode, swizzle_, pitch, bpp,
+                       slice, sample, data, size, False, out, offset, threads)
+
+
+def swizzleInto(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                pitch, bpp, slice, sample, data, out=None, offset=0, size=None, threads=1, transform=None):
+
+    if size is None:
+        size = getTransformedSize(len(memoryview(data).cast('B')), bpp, transform)
+
+    return swizzleSurf(width, height, depth, format_, aa, use, tileMode, swizzle_, pitch, bpp,
+                       slice, sample, data, size, True, out, offset, threads, transform)
+
+
+def retile(srcDesc, dstDesc, data, threads=1):
+    return bytes(retileSurf(srcDesc, dstDesc, data, len(data), threads=threads))
+
+
+def retileInto(srcDesc, dstDesc, data, out=None, offset=0, size=None, threads=1):
+    if size is None:
+        size = len(memoryview(data).cast('B'))
+
+    return retileSurf(srcDesc, dstDesc, data, size, out, offset, threads)
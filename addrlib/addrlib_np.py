@@ -0,0 +1,523 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# addrlib_np.py
+# A NumPy (vectorized) swizzling backend for the Address Library.
+
+
+################################################################
+################################################################
+
+from array import array
+from functools import partial
+
+import numpy as np
+
+from .addrlib import (
+    BCn_formats, GX2TileModeToAddrTileMode, bankSwapOrder, getSurfaceAddrMap,
+    getResultView, getLinearSize, getRowBands, runBands, swizzleLinearSurf, SurfaceDesc, getRetileSize,
+    getRegionElements, getElementTransform, getTransformedSize,
+    computeSurfaceThickness, computeSurfaceRotationFromTileMode,
+    isThickMacroTiled, isBankSwappedTileMode,
+    computeSurfaceBankSwappedWidth, getMacroTileSize, getMacroTileTemplate,
+)
+from .tables import pipeTable, bankTable, getPixelIndexTable
+
+
+def computePixelIndexWithinMicroTile(x, y, z, bpp, tileMode, isDepth):
+    thickness = computeSurfaceThickness(tileMode)
+    pixelIndexTable = np.frombuffer(getPixelIndexTable(bpp, thickness, isDepth), np.uint16)
+
+    return pixelIndexTable[(z & (thickness - 1)) << 6 | (y & 7) << 3 | x & 7].astype(np.int64)
+
+
+def computePipeFromCoordWoRotation(x, y):
+    return np.frombuffer(pipeTable, np.uint8)[(x >> 3) & 1 | ((y >> 3) & 1) << 1].astype(np.int64)
+
+
+def computeBankFromCoordWoRotation(x, y):
+    return np.frombuffer(bankTable, np.uint8)[(x >> 3) & 3 | ((y >> 4) & 3) << 2].astype(np.int64)
+
+
+def computeSurfaceAddrFromCoordLinear(x, y, slice, sample, bpp, pitch, height, numSlices):
+    sliceOffset = pitch * height * (slice + sample * numSlices)
+    return (y * pitch + x + sliceOffset) * bpp
+
+
+def computeSurfaceAddrFromCoordMicroTiled(x, y, slice, bpp, pitch, height,
+                                          tileMode, isDepth):
+
+    microTileThickness = 1
+    if tileMode == 3:
+        microTileThickness = 4
+
+    microTileBytes = (64 * microTileThickness * bpp + 7) // 8
+    microTilesPerRow = pitch >> 3
+
+    microTileOffset = microTileBytes * ((x >> 3) + (y >> 3) * microTilesPerRow)
+    sliceBytes = (pitch * height * microTileThickness * bpp + 7) // 8
+    sliceOffset = (slice // microTileThickness) * sliceBytes
+
+    pixelIndex = computePixelIndexWithinMicroTile(x, y, slice, bpp, tileMode, isDepth)
+    pixelOffset = (bpp * pixelIndex) >> 3
+
+    return pixelOffset + microTileOffset + sliceOffset
+
+
+def computeSurfaceAddrFromCoordMacroTiled(x, y, slice, sample, bpp, pitch, height,
+                                          numSamples, tileMode, isDepth,
+                                          pipeSwizzle, bankSwizzle):
+
+    microTileThickness = computeSurfaceThickness(tileMode)
+
+    microTileBits = numSamples * bpp * (microTileThickness * 64)
+    microTileBytes = (microTileBits + 7) // 8
+
+    pixelIndex = computePixelIndexWithinMicroTile(x, y, slice, bpp, tileMode, isDepth)
+    bytesPerSample = microTileBytes // numSamples
+
+    if isDepth:
+        sampleOffset = bpp * sample
+        pixelOffset = numSamples * bpp * pixelIndex
+
+    else:
+        sampleOffset = sample * (microTileBits // numSamples)
+        pixelOffset = bpp * pixelIndex
+
+    elemOffset = pixelOffset + sampleOffset
+
+    if numSamples <= 1 or microTileBytes <= 2048:
+        numSampleSplits = 1
+        sampleSlice = 0
+
+    else:
+        samplesPerSlice = 2048 // bytesPerSample
+        numSampleSplits = numSamples // samplesPerSlice
+        numSamples = samplesPerSlice
+
+        tileSliceBits = microTileBits // numSampleSplits
+        sampleSlice = elemOffset // tileSliceBits
+        elemOffset = elemOffset % tileSliceBits
+
+    elemOffset = (elemOffset + 7) // 8
+
+    pipe = computePipeFromCoordWoRotation(x, y)
+    bank = computeBankFromCoordWoRotation(x, y)
+
+    swizzle_ = pipeSwizzle + 2 * bankSwizzle
+    bankPipe = pipe + 2 * bank
+    rotation = computeSurfaceRotationFromTileMode(tileMode)
+    sliceIn = slice
+
+    if isThickMacroTiled(tileMode):
+        sliceIn >>= 2
+
+    bankPipe ^= 2 * sampleSlice * 3 ^ (swizzle_ + sliceIn * rotation)
+    bankPipe %= 8
+    pipe = bankPipe % 2
+    bank = bankPipe // 2
+
+    sliceBytes = (height * pitch * microTileThickness * bpp * numSamples + 7) // 8
+    sliceOffset = sliceBytes * ((sampleSlice + numSampleSplits * slice) // microTileThickness)
+
+    macroTilePitch = 32
+    macroTileHeight = 16
+
+    if tileMode in [5, 9]:
+        macroTilePitch = 16
+        macroTileHeight = 32
+
+    elif tileMode in [6, 10]:
+        macroTilePitch = 8
+        macroTileHeight = 64
+
+    macroTilesPerRow = pitch // macroTilePitch
+    macroTileBytes = (numSamples * microTileThickness * bpp * macroTileHeight
+                      * macroTilePitch + 7) // 8
+    macroTileIndexX = x // macroTilePitch
+    macroTileIndexY = y // macroTileHeight
+    macroTileOffset = (macroTileIndexX + macroTilesPerRow * macroTileIndexY) * macroTileBytes
+
+    if isBankSwappedTileMode(tileMode):
+        bankSwapWidth = computeSurfaceBankSwappedWidth(tileMode, bpp, numSamples, pitch)
+        swapIndex = macroTilePitch * macroTileIndexX // bankSwapWidth
+        bank ^= np.array(bankSwapOrder, np.int64)[swapIndex & 3]
+
+    totalOffset = elemOffset + ((macroTileOffset + sliceOffset) >> 3)
+    return bank << 9 | pipe << 8 | totalOffset & 255 | (totalOffset & -256) << 3
+
+
+def unpackAddr(addr):
+    # Removes the pipe and bank bits of an address
+    return addr & 255 | (addr >> 11) << 8
+
+
+def computeSurfaceAddrMap(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                          pitch, bitsPerPixel, slice, sample, yStart=0, yEnd=None):
+    """
+    Returns the swizzled byte address of every element of the surface (or of rows yStart to yEnd),
+    as a flat int64 array in linear (row-major) element order.
+    """
+
+    bytesPerPixel = bitsPerPixel // 8
+
+    if format_ in BCn_formats:
+        width = (width + 3) // 4
+        height = (height + 3) // 4
+
+    pipeSwizzle = (swizzle_ >> 8) & 1
+    bankSwizzle = (swizzle_ >> 9) & 3
+
+    tileMode = GX2TileModeToAddrTileMode(tileMode)
+
+    y, x = np.mgrid[yStart:height if yEnd is None else yEnd, :width].astype(np.int64)
+
+    if tileMode in [0, 1]:
+        pos = computeSurfaceAddrFromCoordLinear(x, y, slice, sample, bytesPerPixel, pitch, height, depth)
+
+    elif tileMode in [2, 3]:
+        pos = computeSurfaceAddrFromCoordMicroTiled(x, y, slice, bitsPerPixel, pitch, height, tileMode, bool(use & 4))
+
+    else:
+        numSamples = 1 << aa
+        microTileBytes = (numSamples * bitsPerPixel * computeSurfaceThickness(tileMode) * 64 + 7) // 8
+
+        if numSamples > 1 and microTileBytes > 2048:
+            pos = computeSurfaceAddrFromCoordMacroTiled(x, y, slice, sample, bitsPerPixel, pitch, height, numSamples,
+                                                        tileMode, bool(use & 4), pipeSwizzle, bankSwizzle)
+
+        else:
+            # Only the first element of every macro tile is computed in full,
+            # the others are moved from the template of the first macro tile
+            macroTilePitch, macroTileHeight = getMacroTileSize(tileMode)
+
+            template = np.array(getMacroTileTemplate(bitsPerPixel, tileMode, numSamples, bool(use & 4), slice,
+                                                     sample, 0), np.int64)
+
+            tileX = x[:1, ::macroTilePitch]
+            tileY = y[::macroTileHeight, :1] // macroTileHeight * macroTileHeight
+            tileAddr = computeSurfaceAddrFromCoordMacroTiled(tileX, tileY, slice, sample, bitsPerPixel, pitch, height,
+                                                             numSamples, tileMode, bool(use & 4),
+                                                             pipeSwizzle, bankSwizzle)
+
+            tileOffset = unpackAddr(tileAddr) - unpackAddr(template[0, 0])
+            bankPipe = (tileAddr ^ template[0, 0]) & 0x700
+
+            tileIndex = (y // macroTileHeight - y[0, 0] // macroTileHeight, x // macroTilePitch)
+            template = template[y % macroTileHeight, x % macroTilePitch]
+
+            elemOffset = unpackAddr(template) + tileOffset[tileIndex]
+            pos = (template ^ bankPipe[tileIndex]) & 0x700 | elemOffset & 255 | (elemOffset >> 8) << 11
+
+    return pos.ravel()
+
+
+def computeSurfaceAddrMapArray(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                               pitch, bitsPerPixel, slice, sample, threads=1):
+
+    # The cached maps are always stored as array('I')
+    elemWidth, elemHeight = width, height
+    if format_ in BCn_formats:
+        elemWidth = (width + 3) // 4
+        elemHeight = (height + 3) // 4
+
+    addrMap = np.empty(elemWidth * elemHeight, np.uint32)
+
+    def computeRows(yStart, yEnd):
+        addrMap[yStart * elemWidth:yEnd * elemWidth] = computeSurfaceAddrMap(
+            width, height, depth, format_, aa, use, tileMode, swizzle_,
+            pitch, bitsPerPixel, slice, sample, yStart, yEnd)
+
+    runBands(computeRows, getRowBands(elemHeight, tileMode, threads))
+
+    return array('I', addrMap.tobytes())
+
+
+def transformElements(elems, bitsPerPixel, transform):
+    """
+    Converts the elements (rows of bytes) with the given transform (see addrlib.elementTransforms),
+    returning the transformed elements as rows of bytes.
+    """
+
+    srcBytesPerPixel, shift, bits = getElementTransform(transform, bitsPerPixel)
+    mask = (1 << bits) - 1
+
+    value = np.zeros(len(elems), np.uint32)
+    for i in range(srcBytesPerPixel):
+        value |= elems[:, i].astype(np.uint32) << (8 * i)
+
+    if srcBytesPerPixel == 3:
+        value |= 0xFF000000
+
+    value = value & (~(mask | mask << shift) & 0xFFFFFFFF) | (value & mask) << shift | (value >> shift) & mask
+
+    return value.astype('<u%d' % (bitsPerPixel // 8)).view(np.uint8).reshape(-1, bitsPerPixel // 8)
+
+
+def swizzleTransformedSurf(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                           pitch, bitsPerPixel, slice, sample, src, result, transform, threads=1):
+
+    """
+    Same as addrlib.swizzleTransformedSurf(), but the elements of a band are converted
+    between their gather and scatter.
+    """
+
+    bytesPerPixel = bitsPerPixel // 8
+    srcBytesPerPixel = getElementTransform(transform, bitsPerPixel)[0]
+
+    addrMap = getSurfaceAddrMap(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                                pitch, bitsPerPixel, slice, sample,
+                                partial(computeSurfaceAddrMapArray, threads=threads))
+
+    addrMap = np.frombuffer(addrMap, np.uint32)
+
+    if format_ in BCn_formats:
+        width = (width + 3) // 4
+        height = (height + 3) // 4
+
+    srcOffsets = np.arange(srcBytesPerPixel, dtype=np.int64)
+    offsets = np.arange(bytesPerPixel, dtype=np.int64)
+
+    def copyRows(yStart, yEnd):
+        pos = addrMap[yStart * width:yEnd * width].astype(np.int64)
+        pos_ = np.arange(yStart * width, yEnd * width, dtype=np.int64) * srcBytesPerPixel
+
+        valid = (pos_ + srcBytesPerPixel <= src.size) & (pos + bytesPerPixel <= result.size)
+        if not valid.all():
+            pos = pos[valid]
+            pos_ = pos_[valid]
+
+        elems = transformElements(src[pos_[:, None] + srcOffsets], bitsPerPixel, transform)
+        result[(pos[:, None] + offsets).ravel()] = elems.ravel()
+
+    runBands(copyRows, getRowBands(height, tileMode, threads))
+
+
+def swizzleSurf(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                pitch, bitsPerPixel, slice, sample, data, dataSize, swizzle, out=None, offset=0, threads=1,
+                transform=None):
+
+    """
+    Same as addrlib.swizzleSurf(), but the addresses of all the elements of a band are computed
+    at once and the copy is done as a single gather (or scatter).
+    """
+
+    bytesPerPixel = bitsPerPixel // 8
+    resultView = getResultView(out, offset, dataSize)
+
+    src = np.frombuffer(memoryview(data).cast('B'), np.uint8)
+    result = np.frombuffer(resultView, np.uint8)
+
+    if transform is not None:
+        if not swizzle:
+            raise ValueError("Elements can only be transformed while swizzling.")
+
+        swizzleTransformedSurf(width, height, depth, format_, aa, use, tileMode, swizzle_, pitch, bitsPerPixel,
+                               slice, sample, src, result, transform, threads)
+
+        return resultView
+
+    if not bytesPerPixel:
+        return resultView
+
+    if swizzle:
+        linearSize, swizzledSize = src.size, dataSize
+
+    else:
+        linearSize, swizzledSize = dataSize, src.size
+
+    if GX2TileModeToAddrTileMode(tileMode) in [0, 1]:
+        # Whole rows are plain slice copies already
+        swizzleLinearSurf(width, height, depth, format_, tileMode, pitch, bytesPerPixel, slice, sample,
+                          memoryview(src), resultView, linearSize, swizzledSize, swizzle, threads)
+
+        return resultView
+
+    addrMap = getSurfaceAddrMap(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                                pitch, bitsPerPixel, slice, sample,
+                                partial(computeSurfaceAddrMapArray, threads=threads))
+
+    addrMap = np.frombuffer(addrMap, np.uint32)
+
+    if format_ in BCn_formats:
+        width = (width + 3) // 4
+        height = (height + 3) // 4
+
+    elemType = np.dtype((np.void, bytesPerPixel))
+    srcElems = src[:src.size // bytesPerPixel * bytesPerPixel].view(elemType)
+    dstElems = result[:dataSize // bytesPerPixel * bytesPerPixel].view(elemType)
+    offsets = np.arange(bytesPerPixel, dtype=np.int64)
+
+    def copyRows(yStart, yEnd):
+        pos = addrMap[yStart * width:yEnd * width].astype(np.int64)
+        pos_ = np.arange(yStart * width, yEnd * width, dtype=np.int64) * bytesPerPixel
+
+        valid = (pos_ + bytesPerPixel <= linearSize) & (pos + bytesPerPixel <= swizzledSize)
+        if not valid.all():
+            pos = pos[valid]
+            pos_ = pos_[valid]
+
+        if swizzle:
+            pos, pos_ = pos_, pos
+
+        if not ((pos % bytesPerPixel).any() or (pos_ % bytesPerPixel).any()):
+            # Every element is aligned, move them as whole items
+            dstElems[pos_ // bytesPerPixel] = srcElems[pos // bytesPerPixel]
+
+        else:
+            result[(pos_[:, None] + offsets).ravel()] = src[(pos[:, None] + offsets).ravel()]
+
+    runBands(copyRows, getRowBands(height, tileMode, threads))
+
+    return resultView
+
+
+def retileSurf(srcDesc, dstDesc, data, dataSize, out=None, offset=0, threads=1):
+    """
+    Same as addrlib.retileSurf(), but the elements of a band are moved with a single gather and scatter.
+    """
+
+    srcDesc, dstDesc = SurfaceDesc(*srcDesc), SurfaceDesc(*dstDesc)
+    width, height = getRetileSize(srcDesc, dstDesc)
+
+    bytesPerPixel = srcDesc.bpp // 8
+    resultView = getResultView(out, offset, dataSize)
+
+    src = np.frombuffer(memoryview(data).cast('B'), np.uint8)
+    result = np.frombuffer(resultView, np.uint8)
+
+    if not bytesPerPixel:
+        return resultView
+
+    srcMap, dstMap = [
+        np.frombuffer(getSurfaceAddrMap(*desc, computeAddrMap=partial(computeSurfaceAddrMapArray, threads=threads)),
+                      np.uint32)
+        for desc in (srcDesc, dstDesc)]
+
+    offsets = np.arange(bytesPerPixel, dtype=np.int64)
+
+    def copyRows(yStart, yEnd):
+        pos = srcMap[yStart * width:yEnd * width].astype(np.int64)
+        pos_ = dstMap[yStart * width:yEnd * width].astype(np.int64)
+
+        valid = (pos + bytesPerPixel <= src.size) & (pos_ + bytesPerPixel <= dataSize)
+        if not valid.all():
+            pos = pos[valid]
+            pos_ = pos_[valid]
+
+        result[(pos_[:, None] + offsets).ravel()] = src[(pos[:, None] + offsets).ravel()]
+
+    runBands(copyRows, getRowBands(height, dstDesc.tileMode, threads))
+
+    return resultView
+
+
+def deswizzle(width, height, depth, format_, aa, use, tileMode, swizzle_,
+              pitch, bpp, slice, sample, data, threads=1):
+
+    return bytes(swizzleSurf(width, height, depth, format_, aa, use, tileMode, swizzle_, pitch, bpp,
+                             slice, sample, data, len(data), False, threads=threads))
+
+
+def swizzle(width, height, depth, format_, aa, use, tileMode, swizzle_,
+            pitch, bpp, slice, sample, data, threads=1, transform=None):
+
+    return bytes(swizzleSurf(width, height, depth, format_, aa, use, tileMode, swizzle_, pitch, bpp,
+                             slice, sample, data, getTransformedSize(len(data), bpp, transform), True,
+                             threads=threads, transform=transform))
+
+
+def deswizzleInto(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                  pitch, bpp, slice, sample, data, out=None, offset=0, size=None, threads=1):
+
+    if size is None:
+        size = getLinearSize(width, height, format_, bpp)
+
+    return swizzleSurf(width, height, depth, format_, aa, use, tileMode, swizzle_, pitch, bpp,
+                       slice, sample, data, size, False, out, offset, threads)
+
+
+def swizzleInto(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                pitch, bpp, slice, sample, data, out=None, offset=0, size=None, threads=1, transform=None):
+
+    if size is None:
+        size = getTransformedSize(len(memoryview(data).cast('B')), bpp, transform)
+
+    return swizzleSurf(width, height, depth, format_, aa, use, tileMode, swizzle_, pitch, bpp,
+                       slice, sample, data, size, True, out, offset, threads, transform)
+
+
+def retile(srcDesc, dstDesc, data, threads=1):
+    return bytes(retileSurf(srcDesc, dstDesc, data, len(data), threads=threads))
+
+
+def retileInto(srcDesc, dstDesc, data, out=None, offset=0, size=None, threads=1):
+    if size is None:
+        size = len(memoryview(data).cast('B'))
+
+    return retileSurf(srcDesc, dstDesc, data, size, out, offset, threads)
+
+
+def computeSurfaceRegionAddrMap(x, y, w, h, width, height, depth, format_, aa, use, tileMode, swizzle_,
+                                pitch, bitsPerPixel, slice, sample):
+
+    """
+    Same as addrlib.computeSurfaceRegionAddrMap(), but all the addresses are computed at once,
+    as a flat int64 array.
+    """
+
+    bytesPerPixel = bitsPerPixel // 8
+
+    if format_ in BCn_formats:
+        height = (height + 3) // 4
+
+    pipeSwizzle = (swizzle_ >> 8) & 1
+    bankSwizzle = (swizzle_ >> 9) & 3
+
+    tileMode = GX2TileModeToAddrTileMode(tileMode)
+
+    y, x = np.mgrid[y:y + h, x:x + w].astype(np.int64)
+
+    if tileMode in [0, 1]:
+        pos = computeSurfaceAddrFromCoordLinear(x, y, slice, sample, bytesPerPixel, pitch, height, depth)
+
+    elif tileMode in [2, 3]:
+        pos = computeSurfaceAddrFromCoordMicroTiled(x, y, slice, bitsPerPixel, pitch, height, tileMode, bool(use & 4))
+
+    else:
+        pos = computeSurfaceAddrFromCoordMacroTiled(x, y, slice, sample, bitsPerPixel, pitch, height, 1 << aa,
+                                                    tileMode, bool(use & 4), pipeSwizzle, bankSwizzle)
+
+    return pos.ravel()
+
+
+def deswizzleRegion(x, y, w, h, width, height, depth, format_, aa, use, tileMode, swizzle_,
+                    pitch, bpp, slice, sample, data):
+
+    """
+    Same as addrlib.deswizzleRegion(), but the elements of the region are copied with a single gather.
+    """
+
+    x, y, w, h = getRegionElements(x, y, w, h, width, height, format_)
+
+    bytesPerPixel = bpp // 8
+    src = np.frombuffer(memoryview(data).cast('B'), np.uint8)
+    result = np.zeros(w * h * bytesPerPixel, np.uint8)
+
+    if not bytesPerPixel:
+        return result.tobytes()
+
+    pos = computeSurfaceRegionAddrMap(x, y, w, h, width, height, depth, format_, aa, use, tileMode, swizzle_,
+                                      pitch, bpp, slice, sample)
+
+    pos_ = np.arange(w * h, dtype=np.int64) * bytesPerPixel
+
+    valid = pos + bytesPerPixel <= src.size
+    if not valid.all():
+        pos = pos[valid]
+        pos_ = pos_[valid]
+
+    offsets = np.arange(bytesPerPixel, dtype=np.int64)
+    result[(pos_[:, None] + offsets).ravel()] = src[(pos[:, None] + offsets).ravel()]
+
+    return result.tobytes()
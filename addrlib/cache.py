@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# cache.py
+# Bounded LRU caches of swizzle address maps and surface infos.
+
+
+################################################################
+################################################################
+
+from collections import OrderedDict
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+
+
+class LRUCache:
+    """
+    Least recently used cache.
+    Every value is accounted by sizeOf() (1 by default) and the least recently used
+    values are evicted once the total size would exceed maxSize.
+    """
+
+    def __init__(self, maxSize):
+        self.maxSize = maxSize
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._values)
+
+    def sizeOf(self, value):
+        return 1
+
+    def get(self, key):
+        with self._lock:
+            value = self._values.get(key)
+            if value is None:
+                self.misses += 1
+
+            else:
+                self.hits += 1
+                self._values.move_to_end(key)
+
+        return value
+
+    def put(self, key, value):
+        valueSize = self.sizeOf(value)
+        if valueSize > self.maxSize:
+            return value
+
+        with self._lock:
+            old = self._values.pop(key, None)
+            if old is not None:
+                self.size -= self.sizeOf(old)
+
+            self._values[key] = value
+            self.size += valueSize
+            self._evict(self.maxSize)
+
+        return value
+
+    def resize(self, maxSize):
+        with self._lock:
+            self.maxSize = maxSize
+            self._evict(maxSize)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+            self.size = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._values),
+            'size': self.size,
+            'maxSize': self.maxSize,
+        }
+
+    def _evict(self, maxSize):
+        while self.size > maxSize and self._values:
+            _, value = self._values.popitem(last=False)
+            self.size -= self.sizeOf(value)
+            self.evictions += 1
+
+
+def getAddrMapVersion():
+    """
+    Returns a digest of the sources the address maps are computed and stored by,
+    so any change to them invalidates the maps stored on disk.
+    """
+
+    digest = hashlib.sha1(sys.byteorder.encode())
+    directory = os.path.dirname(os.path.abspath(__file__))
+
+    for name in ['addrlib.py', 'addrlib_np.py', 'addrlib_cy.pyx', 'addrlib_mv.py', 'tables.py', 'cache.py']:
+        try:
+            with open(os.path.join(directory, name), 'rb') as inf:
+                digest.update(inf.read())
+
+        except OSError:
+            # Frozen builds don't ship all the sources
+            digest.update(name.encode())
+
+    return digest.digest()
+
+
+class AddrMapDiskCache:
+    """
+    Directory of address maps shared across processes.
+    Every map is stored in its own file, made of a header (magic, format version, digest of the key
+    and the addrlib version, number of entries) followed by the entries as native 32-bit integers.
+    The files are opened with mmap, so the processes using the same maps share their pages.
+    Once the files take more than maxSize bytes, the least recently used ones are removed.
+    """
+
+    magic = b'GX2M'
+    formatVersion = 1
+
+    header = struct.Struct('<4sI20sQ28x')  # 64 bytes, to keep the entries aligned
+
+    def __init__(self, path, maxSize=256 * 1024 * 1024):
+        self.path = path
+        self.maxSize = maxSize
+
+        self.version = getAddrMapVersion()
+        os.makedirs(path, exist_ok=True)
+
+        # Only updated by this process, the directory is scanned again once it exceeds maxSize
+        self.size = self._scan()[1]
+
+    def _digest(self, key):
+        return hashlib.sha1(self.version + repr(key).encode()).digest()
+
+    def _filePath(self, digest):
+        return os.path.join(self.path, digest.hex() + '.map')
+
+    def get(self, key):
+        digest = self._digest(key)
+        filePath = self._filePath(digest)
+
+        try:
+            with open(filePath, 'rb') as inf:
+                data = mmap.mmap(inf.fileno(), 0, access=mmap.ACCESS_READ)
+
+            # Mark the file as recently used
+            os.utime(filePath)
+
+        except (OSError, ValueError):
+            return None
+
+        if len(data) < self.header.size:
+            return None
+
+        magic, formatVersion, digest_, numEntries = self.header.unpack_from(data)
+        if (magic != self.magic or formatVersion != self.formatVersion or digest_ != digest
+                or len(data) != self.header.size + numEntries * 4):
+
+            return None
+
+        return memoryview(data)[self.header.size:].cast('I')
+
+    def put(self, key, addrMap):
+        """
+        Stores addrMap and returns it, read back from the disk if it could be stored.
+        """
+
+        digest = self._digest(key)
+        entries = memoryview(addrMap).cast('B').cast('I')
+
+        try:
+            fd, tempPath = tempfile.mkstemp('.tmp', dir=self.path)
+            try:
+                with os.fdopen(fd, 'wb') as out:
+                    out.write(self.header.pack(self.magic, self.formatVersion, digest, len(entries)))
+                    out.write(entries)
+
+                # Atomic, other processes never see a partial file
+                os.replace(tempPath, self._filePath(digest))
+
+            except:
+                os.remove(tempPath)
+                raise
+
+        except OSError:
+            return addrMap
+
+        self.size += self.header.size + entries.nbytes
+        if self.size > self.maxSize:
+            self._evict()
+
+        storedMap = self.get(key)
+        if storedMap is None:
+            return addrMap
+
+        return storedMap
+
+    def _scan(self):
+        files = []
+        size = 0
+
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.map'):
+                try:
+                    stat = entry.stat()
+
+                except OSError:
+                    continue
+
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+                size += stat.st_size
+
+        return files, size
+
+    def _evict(self):
+        files, size = self._scan()
+
+        for _, fileSize, filePath in sorted(files):
+            if size <= self.maxSize:
+                break
+
+            try:
+                os.remove(filePath)
+
+            except OSError:
+                # Removed by another process, or still mapped (Windows)
+                continue
+
+            size -= fileSize
+
+        self.size = size
+
+    def clear(self):
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.map'):
+                try:
+                    os.remove(entry.path)
+
+                except OSError:
+                    pass
+
+        self.size = self._scan()[1]
+
+
+class AddrMapCache(LRUCache):
+    """
+    LRU cache of address maps, keyed by surface descriptor.
+    The maps are accounted by their size in bytes.
+    If diskCache is set (see setDiskCache()), the maps missing from memory are looked up there,
+    and the new ones are stored there as well.
+    """
+
+    def __init__(self, maxSize=64 * 1024 * 1024):
+        super().__init__(maxSize)
+
+        self.diskCache = None
+
+    def sizeOf(self, addrMap):
+        return memoryview(addrMap).nbytes
+
+    def setDiskCache(self, path, maxSize=256 * 1024 * 1024):
+        """
+        Shares the address maps across processes through the given directory, None to stop.
+        maxSize: size in bytes the directory is kept under
+        """
+
+        self.diskCache = None if path is None else AddrMapDiskCache(path, maxSize)
+
+    def get(self, key):
+        value = super().get(key)
+
+        diskCache = self.diskCache
+        if value is None and diskCache is not None:
+            value = diskCache.get(key)
+            if value is not None:
+                super().put(key, value)
+
+        return value
+
+    def put(self, key, value):
+        diskCache = self.diskCache
+        if diskCache is not None:
+            value = diskCache.put(key, value)
+
+        return super().put(key, value)
+
+
+addrMapCache = AddrMapCache()
+
+if os.environ.get('ADDRLIB_CACHE_DIR'):
+    addrMapCache.setDiskCache(os.environ['ADDRLIB_CACHE_DIR'],
+                              int(os.environ.get('ADDRLIB_CACHE_SIZE', 256 * 1024 * 1024)))
+
+# getSurfaceInfo() results, keyed by its arguments
+surfaceInfoCache = LRUCache(4096)
+
+# Macro tile templates of the pure Python Addrlib, keyed by getMacroTileTemplate()'s arguments
+macroTileTemplateCache = LRUCache(1024)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# tables.py
+# Lookup tables of the Address Library, shared by all the backends.
+
+
+################################################################
+################################################################
+
+from array import array
+
+
+# Indexed by AddrTileMode, other tile modes use the values of ADDR_TM_LINEAR_GENERAL
+numTileModes = 18
+
+surfaceThickness = [1, 1, 1, 4, 1, 1, 1, 4, 1, 1, 1, 4, 1, 4, 1, 4, 8, 8]
+surfaceRotation = [0, 0, 0, 0, 2, 2, 2, 2, 2, 2, 2, 2, 1, 1, 1, 1, 0, 0]
+thickMacroTiled = [0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 1, 0, 1, 0, 1, 0, 0]
+bankSwappedTileMode = [0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 0, 0, 1, 1, 0, 0]
+macroTileAspectRatio = [1, 1, 1, 1, 1, 2, 4, 1, 1, 2, 4, 1, 1, 1, 1, 1, 1, 1]
+
+# Pipe of a micro tile, indexed by bit 3 of x and y:
+# (x >> 3) & 1 | ((y >> 3) & 1) << 1
+pipeTable = array('B', [0, 1, 1, 0])
+
+# Bank of a micro tile, indexed by bits 3-4 of x and 4-5 of y:
+# (x >> 3) & 3 | ((y >> 4) & 3) << 2
+bankTable = array('B', [
+    ((y >> 1) ^ x) & 1 | 2 * ((y ^ (x >> 1)) & 1)
+    for y in range(4) for x in range(4)
+])
+
+# Order of the x and y bits in the index of an element within a micro tile
+depthPixelBits = ('x', 0), ('y', 0), ('x', 1), ('y', 1), ('x', 2), ('y', 2)
+
+pixelBits = {
+    0x08: (('x', 0), ('x', 1), ('x', 2), ('y', 1), ('y', 0), ('y', 2)),
+    0x10: (('x', 0), ('x', 1), ('x', 2), ('y', 0), ('y', 1), ('y', 2)),
+    0x40: (('x', 0), ('y', 0), ('x', 1), ('x', 2), ('y', 1), ('y', 2)),
+    0x80: (('y', 0), ('x', 0), ('x', 1), ('x', 2), ('y', 1), ('y', 2)),
+}
+
+defaultPixelBits = ('x', 0), ('x', 1), ('y', 0), ('x', 2), ('y', 1), ('y', 2)
+
+pixelIndexTables = {}
+
+
+def computePixelIndexTable(bpp, thickness, isDepth):
+    """
+    Returns the index of every element within a micro tile, as an array('H') indexed by:
+    (z & (thickness - 1)) << 6 | (y & 7) << 3 | (x & 7)
+    """
+
+    if isDepth:
+        bits = depthPixelBits
+
+    else:
+        bits = pixelBits.get(bpp, defaultPixelBits)
+
+    table = array('H', [0]) * (64 * thickness)
+    for z in range(thickness):
+        for y in range(8):
+            for x in range(8):
+                coords = {'x': x, 'y': y}
+
+                pixelIndex = z << 6
+                for i, (coord, bit) in enumerate(bits):
+                    pixelIndex |= ((coords[coord] >> bit) & 1) << i
+
+                table[z << 6 | y << 3 | x] = pixelIndex
+
+    return table
+
+
+def getPixelIndexTable(bpp, thickness, isDepth):
+    """
+    Same as computePixelIndexTable(), but every table is only built once.
+    """
+
+    key = (bpp, thickness, bool(isDepth))
+
+    table = pixelIndexTables.get(key)
+    if table is None:
+        table = pixelIndexTables.setdefault(key, computePixelIndexTable(*key))
+
+    return table
+
@@ -38,16 +38,28 @@ except ImportError:
 
 dx10_formats = ["BC4U", "BC4S", "BC5U", "BC5S"]
 
-
-def readDDS(f, SRGB):
+# DXGI formats of the DX10 header
+dx10_codes = {"BC1": 71, "BC2": 74, "BC3": 77, "BC4U": 80, "BC4S": 81, "BC5U": 83, "BC5S": 84}
+
+# DXGI format: (format, bytes per pixel (per block if compressed), compressed)
+dxgi_formats = {
+    28: (0x1a, 4, False), 29: (0x41a, 4, False), 24: (0x19, 4, False), 85: (8, 2, False),
+    86: (0xa, 2, False), 115: (0xb, 2, False), 61: (1, 1, False), 49: (7, 2, False),
+    71: (0x31, 8, True), 72: (0x431, 8, True), 74: (0x32, 16, True), 75: (0x432, 16, True),
+    77: (0x33, 16, True), 78: (0x433, 16, True), 80: (0x34, 8, True), 81: (0x234, 8, True),
+    83: (0x35, 16, True), 84: (0x235, 16, True),
+}
+
+
+def readDDS(f, SRGB, expandRGB8=True):
+    """
+    Reads the DDS file f, raises a ValueError if it's invalid or unsupported.
+    """
     with open(f, "rb") as inf:
         inb = inf.read()
 
     if len(inb) < 0x80 or inb[:4] != b'DDS ':
-        print("")
-        print(f + " is not a valid DDS file!")
-
-        return 0, 0, 0, b'', 0, [], 0, []
+        raise ValueError(f + " is not a valid DDS file!")
 
     width = struct.unpack("<I", inb[16:20])[0]
     height = struct.unpack("<I", inb[12:16])[0]
@@ -61,12 +73,25 @@ def readDDS(f, SRGB):
     channel2 = struct.unpack("<I", inb[100:104])[0]
     channel3 = struct.unpack("<I", inb[104:108])[0]
     caps = struct.unpack("<I", inb[108:112])[0]
+    caps2 = struct.unpack("<I", inb[112:116])[0]
+
+    if caps & ~0x400008 != 0x1000:
+        raise ValueError("Invalid texture.")
 
-    if caps not in [0x1000, 0x401008]:
-        print("")
-        print("Invalid texture.")
+    # GX2SurfaceDim and number of slices
+    dim = 1
+    depth = 1
 
-        return 0, 0, 0, b'', 0, [], 0, []
+    if caps2 & 0x200:
+        if caps2 & 0xfc00 != 0xfc00:
+            raise ValueError("Cube maps must have all 6 faces.")
+
+        dim = 3
+        depth = 6
+
+    elif caps2 & 0x200000:
+        dim = 2
+        depth = max(1, struct.unpack("<I", inb[24:28])[0])
 
     abgr8_masks = {0xff: 0, 0xff00: 1, 0xff0000: 2, 0xff000000: 3, 0: 5}
     bgr8_masks = {0xff: 0, 0xff00: 1, 0xff0000: 2, 0: 5}
@@ -101,27 +126,59 @@ def readDDS(f, SRGB):
         has_alpha = True
 
     else:
-        print("")
-        print("Invalid texture.")
-
-        return 0, 0, 0, b'', 0, [], 0, []
+        raise ValueError("Invalid texture.")
 
     format_ = 0
     compSel = [0, 1, 2, 3]
 
     if fourcc == b'DX10':
-        if not compressed:
-            print("")
-            print("Uncompressed DX10 DDS files are not supported.")
+        if len(inb) < 0x94:
+            raise ValueError(f + " is not a valid DDS file!")
+
+        dxgiFormat, resourceDimension, miscFlag, arraySize = struct.unpack("<4I", inb[128:144])
+
+        if dxgiFormat not in dxgi_formats:
+            raise ValueError("Unsupported DX10 DDS format!")
+
+        format_, bpp, compressed = dxgi_formats[dxgiFormat]
+
+        if SRGB and format_ in [0x1a, 0x31, 0x32, 0x33]:
+            format_ |= 0x400
+
+        if format_ == 1:
+            compSel = [0, 5, 5, 5]
+
+        elif format_ == 7:
+            compSel = [0, 5, 5, 1]
 
-            return 0, 0, 0, b'', 0, [], 0, []
+        elif format_ == 8:
+            compSel = [0, 1, 2, 5]
+
+        if miscFlag & 4:
+            dim = 3
+            depth = 6 * max(1, arraySize)
+
+        elif resourceDimension == 4:
+            dim = 2
+            depth = max(1, struct.unpack("<I", inb[24:28])[0])
+
+        elif arraySize > 1:
+            dim = 5
+            depth = arraySize
 
         headSize = 0x94
 
     else:
         headSize = 0x80
 
-    if compressed:
+    if fourcc == b'DX10':
+        if compressed:
+            size = ((width + 3) >> 2) * ((height + 3) >> 2) * bpp
+
+        else:
+            size = width * height * bpp
+
+    elif compressed:
         if fourcc == b'ETC1':
             format_ = 0x31
             bpp = 8
@@ -154,23 +211,6 @@ def readDDS(f, SRGB):
             format_ = 0x235
             bpp = 16
 
-        elif fourcc == b'DX10':
-            if inb[128:148] == b"\x50\x00\x00\x00\x03\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00":
-                format_ = 0x34
-                bpp = 8
-
-            elif inb[128:148] == b"\x51\x00\x00\x00\x03\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00":
-                format_ = 0x234
-                bpp = 8
-
-            elif inb[128:148] == b"\x53\x00\x00\x00\x03\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00":
-                format_ = 0x35
-                bpp = 16
-
-            elif inb[128:148] == b"\x54\x00\x00\x00\x03\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00":
-                format_ = 0x235
-                bpp = 16
-
         size = ((width + 3) >> 2) * ((height + 3) >> 2) * bpp
 
     else:
@@ -234,7 +274,7 @@ def readDDS(f, SRGB):
 
         size = width * height * bpp
 
-    if caps == 0x401008:
+    if caps & 0x400000:
         numMips = struct.unpack("<I", inb[28:32])[0] - 1
         mipSize = get_mipSize(width, height, bpp, numMips, compressed)
 
@@ -242,26 +282,29 @@ def readDDS(f, SRGB):
         numMips = 0
         mipSize = 0
 
-    if len(inb) < headSize + size + mipSize:
-        print("")
-        print(f + " is not a valid DDS file!")
+    # Cube maps and arrays store all the levels of each face one after the other,
+    # volumes all the slices of each level
+    if dim == 2:
+        dataSize = get_volumeSize(width, height, depth, bpp, numMips, compressed)
 
-        return 0, 0, 0, b'', 0, [], 0, []
+    else:
+        dataSize = (size + mipSize) * depth
 
-    if format_ == 0:
-        print("")
-        print("Unsupported DDS format!")
+    if len(inb) < headSize + dataSize:
+        raise ValueError(f + " is not a valid DDS file!")
 
-        return 0, 0, 0, b'', 0, [], 0, []
+    if format_ == 0:
+        raise ValueError("Unsupported DDS format!")
 
-    data = bytearray(inb[headSize:headSize + size + mipSize])
+    data = bytearray(inb[headSize:headSize + dataSize])
 
-    if format_ in [0x1a, 0x41a] and bpp == 3:
+    # RGB8 data can also be expanded while it's swizzled
+    if format_ in [0x1a, 0x41a] and bpp == 3 and expandRGB8:
         data = form_conv.rgb8torgbx8(data)
         bpp += 1
         size = width * height * bpp
 
-    return width, height, format_, fourcc, size, compSel, numMips, bytes(data)
+    return width, height, format_, fourcc, size, compSel, numMips, bytes(data), dim, depth
 
 
 def get_mipSize(width, height, bpp, numMips, compressed):
@@ -277,9 +320,38 @@ def get_mipSize(width, height, bpp, numMips, compressed):
     return size
 
 
-def generateHeader(num_mipmaps, w, h, format_, compSel, size, compressed):
+def get_volumeSize(width, height, depth, bpp, numMips, compressed):
+    size = 0
+    for level in range(numMips + 1):
+        if compressed:
+            size += ((max(1, width >> level) + 3) >> 2) * ((max(1, height >> level) + 3) >> 2) * bpp * max(1, depth >> level)
+
+        else:
+            size += max(1, width >> level) * max(1, height >> level) * bpp * max(1, depth >> level)
+
+    return size
+
+
+def generateHeader(num_mipmaps, w, h, format_, compSel, size, compressed, dim=1, depth=1):
     hdr = bytearray(128)
 
+    # Arrays (and arrays of cube maps) can only be described by the DX10 header
+    cube = dim == 3
+    dx10 = format_ in dx10_formats or dim == 5 or (dim == 4 and depth > 1) or (cube and depth > 6)
+
+    if dx10:
+        if compressed:
+            dxgiFormat = dx10_codes.get(format_, 0)
+
+        elif format_ in dxgi_formats:
+            dxgiFormat = format_
+
+        else:
+            dxgiFormat = 0
+
+        if not dxgiFormat:  # No DXGI equivalent
+            return b''
+
     luminance = False
     RGB = False
 
@@ -383,8 +455,20 @@ def generateHeader(num_mipmaps, w, h, format_, compSel, size, compressed):
         elif format_ == "BC3":
             fourcc = b'DXT5'
 
-        elif format_ in dx10_formats:
-            fourcc = b'DX10'
+    if dx10:
+        pflags = 0x00000004
+        fourcc = b'DX10'
+
+    caps2 = 0
+
+    if dim == 2:  # VOLUME
+        flags |= 0x00800000
+        caps |= 0x00000008
+        caps2 = 0x00200000
+
+    elif cube:  # CUBEMAP | ALLFACES
+        caps |= 0x00000008
+        caps2 = 0x0000fe00
 
     hdr[0:0 + 4] = b'DDS '
     hdr[4:4 + 4] = 124 .to_bytes(4, 'little')
@@ -392,11 +476,12 @@ def generateHeader(num_mipmaps, w, h, format_, compSel, size, compressed):
     hdr[12:12 + 4] = h.to_bytes(4, 'little')
     hdr[16:16 + 4] = w.to_bytes(4, 'little')
     hdr[20:20 + 4] = size.to_bytes(4, 'little')
+    hdr[24:24 + 4] = (depth if dim == 2 else 0).to_bytes(4, 'little')
     hdr[28:28 + 4] = num_mipmaps.to_bytes(4, 'little')
     hdr[76:76 + 4] = 32 .to_bytes(4, 'little')
     hdr[80:80 + 4] = pflags.to_bytes(4, 'little')
 
-    if compressed:
+    if compressed or dx10:
         hdr[84:84 + 4] = fourcc
 
     else:
@@ -427,17 +512,18 @@ def generateHeader(num_mipmaps, w, h, format_, compSel, size, compressed):
             hdr[104:104 + 4] = compSels[3].to_bytes(4, 'little')
 
     hdr[108:108 + 4] = caps.to_bytes(4, 'little')
+    hdr[112:112 + 4] = caps2.to_bytes(4, 'little')
 
-    if format_ == "BC4U":
-        hdr += bytearray(b"\x50\x00\x00\x00\x03\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00")
+    if dx10:
+        if cube:
+            miscFlag, arraySize = 4, depth // 6
 
-    elif format_ == "BC4S":
-        hdr += bytearray(b"\x51\x00\x00\x00\x03\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00")
+        elif dim in [4, 5]:
+            miscFlag, arraySize = 0, depth
 
-    elif format_ == "BC5U":
-        hdr += bytearray(b"\x53\x00\x00\x00\x03\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00")
+        else:
+            miscFlag, arraySize = 0, 1
 
-    elif format_ == "BC5S":
-        hdr += bytearray(b"\x54\x00\x00\x00\x03\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x00\x00\x00\x00")
+        hdr += struct.pack("<5I", dxgiFormat, 3, miscFlag, arraySize, 0)
 
     return hdr
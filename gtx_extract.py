@@ -22,10 +22,18 @@
 
 """gtx_extract.py: Decode and encode GTX files."""
 
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+import contextlib
+import io
+import json
+import mmap
+import multiprocessing
 import os
 import struct
 import sys
 import time
+import traceback
 
 import addrlib
 import dds
@@ -60,10 +68,111 @@ formats = {0x00000000: 'GX2_SURFACE_FORMAT_INVALID',
 BCn_formats = [0x31, 0x431, 0x32, 0x432, 0x33, 0x433, 0x34, 0x234, 0x35, 0x235]
 
 
-class GFDData:
+class GTXError(ValueError):
+    """
+    Base class of the errors raised while reading or writing a texture,
+    the CLI decides whether to skip the texture or to stop.
+    """
+
+
+class InvalidHeaderError(GTXError):
     pass
 
 
+class TruncatedBlockError(GTXError):
+    pass
+
+
+class UnsupportedSurfaceError(GTXError):
+    pass
+
+
+class UnsupportedFormatError(UnsupportedSurfaceError):
+    pass
+
+
+class UnsupportedAAError(UnsupportedSurfaceError):
+    pass
+
+
+class UnsupportedDimError(UnsupportedSurfaceError):
+    pass
+
+
+class Surface:
+    """
+    A GX2 Surface with its component selector, mip offsets, image data and mip data.
+    """
+    __slots__ = ('dim', 'width', 'height', 'depth', 'numMips', 'format_', 'aa', 'use', 'imageSize', 'imagePtr',
+                 'mipSize', 'mipPtr', 'tileMode', 'swizzle', 'alignment', 'pitch', 'compSel', 'mipOffsets',
+                 'bpp', 'realSize', 'data', 'mipData')
+
+    def __getstate__(self):
+        # The data is copied out of the file it's a view of when it's sent to another process
+        return [bytes(value) if isinstance(value, memoryview) else value
+                for value in (getattr(self, name) for name in self.__slots__)]
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+
+class GFDData:
+    def __init__(self):
+        self.surfaces = []
+
+        # Header and data offset of every block
+        self.blocks = []
+
+    @property
+    def numImages(self):
+        return len(self.surfaces)
+
+
+class GTXFile(GFDData):
+    """
+    A GTX file that is memory-mapped instead of read into memory.
+    Only its block headers and GX2 Surfaces are parsed when it is opened, the image and mip data
+    are memoryview slices of the mapping, so only the pages of the levels that are used are read.
+    """
+    def __init__(self, name):
+        with open(name, "rb") as inf:
+            # Empty files can't be mapped
+            if not os.fstat(inf.fileno()).st_size:
+                raise InvalidHeaderError("Invalid file header!")
+
+            self.mmap = mmap.mmap(inf.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.view = memoryview(self.mmap)
+
+        super().__init__()
+
+        try:
+            readGFD(self.view, self)
+
+        except:
+            # The slices of the mapping made before the error are still held by the frames of the traceback
+            traceback.clear_frames(sys.exc_info()[2])
+            self.close()
+            raise
+
+    def close(self):
+        # The mapping can't be closed while slices of it are still alive
+        for surface in self.surfaces:
+            for data in (surface.data, surface.mipData):
+                if isinstance(data, memoryview):
+                    data.release()
+
+        self.view.release()
+        self.mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
 class GFDHeader(struct.Struct):
     def __init__(self):
         super().__init__('>4s7I')
@@ -125,30 +234,143 @@ def roundUp(x, y):
     return ((x - 1) | (y - 1)) + 1
 
 
-def readGFD(f):
-    gfd = GFDData()
+def getDDSSliceOffsets(layout, dim):
+    """
+    Offsets of every slice of every level in the data of a DDS file.
+    Cube maps and arrays are stored face by face (each with all of its levels),
+    volumes level by level (each with all of its slices).
+    """
+    if dim == 2:
+        return [[level.linearOffset + slice_ * (level.linearSize // level.numSlices)
+                 for slice_ in range(level.numSlices)] for level in layout]
+
+    chainSize = (layout[-1].linearOffset + layout[-1].linearSize) // layout[0].numSlices
+    return [[slice_ * chainSize + level.linearOffset // level.numSlices
+             for slice_ in range(level.numSlices)] for level in layout]
+
+
+def forEachSlice(func, numSlices):
+    # Slices don't overlap, so they can be (un)swizzled in parallel
+    if numSlices == 1:
+        func(0)
+
+    else:
+        with ThreadPoolExecutor(min(numSlices, os.cpu_count() or 1)) as executor:
+            list(executor.map(func, range(numSlices)))
+
 
+def readGFDHeader(f):
+    """
+    Returns the header of the GTX file f and the types of its surface, image data and mip data blocks.
+    """
     header = GFDHeader()
+
+    if len(f) < header.size:
+        raise InvalidHeaderError("Invalid file header!")
+
     header.data(f, 0)
 
     if header.magic != b'Gfx2':
-        raise ValueError("Invalid file header!")
+        raise InvalidHeaderError("Invalid file header!")
 
     if header.majorVersion == 6 and header.minorVersion == 0:
-        surfBlkType = 0x0A
-        dataBlkType = 0x0B
-        mipBlkType = 0x0C
+        blockTypes = 0x0A, 0x0B, 0x0C
 
     elif header.majorVersion in [6, 7]:
-        surfBlkType = 0x0B
-        dataBlkType = 0x0C
-        mipBlkType = 0x0D
+        blockTypes = 0x0B, 0x0C, 0x0D
 
     else:
-        raise ValueError("Unsupported GTX version!")
+        raise InvalidHeaderError("Unsupported GTX version!")
 
     if header.gpuVersion != 2:
-        raise ValueError("Unsupported GPU version!")
+        raise InvalidHeaderError("Unsupported GPU version!")
+
+    return header, blockTypes
+
+
+def readSurface(f, pos, image):
+    """
+    Returns the GX2 Surface of the given image, found at pos in f, without its data.
+    """
+    surface = Surface()
+
+    (surface.dim,
+     surface.width,
+     surface.height,
+     surface.depth,
+     surface.numMips,
+     surface.format_,
+     surface.aa,
+     surface.use,
+     surface.imageSize,
+     surface.imagePtr,
+     surface.mipSize,
+     surface.mipPtr,
+     surface.tileMode,
+     surface.swizzle,
+     surface.alignment,
+     surface.pitch) = GX2Surface().unpack_from(f, pos)
+
+    pos += 64
+
+    if not 1 <= surface.tileMode <= 16:
+        raise UnsupportedSurfaceError("Invalid tileMode for image " + str(image))
+
+    if surface.numMips > 14:
+        raise UnsupportedSurfaceError("Invalid number of mipmaps for image " + str(image))
+
+    surface.mipOffsets = list(struct.unpack_from('>13I', f, pos))
+
+    pos += 68
+
+    if surface.format_ in [0xa, 0xb, 0x19, 0x1a, 0x41a] or surface.format_ in BCn_formats:
+        compSel = [0, 1, 2, 3]
+
+    elif surface.format_ in [2, 7]:
+        compSel = [0, 5, 5, 1]
+
+    elif surface.format_ == 1:
+        compSel = [0, 5, 5, 5]
+
+    elif surface.format_ == 8:
+        compSel = [0, 1, 2, 5]
+
+    else:
+        compSel = []
+        for i in range(4):
+            comp = f[pos + i]
+            if comp == 4:  # Sorry, but this is unsupported.
+                comp = i
+            compSel.append(comp)
+
+    surface.compSel = compSel
+
+    bpp = roundUp(addrlib.surfaceGetBitsPerPixel(surface.format_), 8)
+    surface.bpp = bpp
+
+    if surface.format_ in BCn_formats:
+        surface.realSize = divRoundUp(surface.width, 4) * divRoundUp(surface.height, 4) * (bpp // 8)
+
+    else:
+        surface.realSize = surface.width * surface.height * (bpp // 8)
+
+    surface.data = None
+    surface.mipData = b''
+
+    return surface
+
+
+def readGFD(f, gfd=None):
+    """
+    Reads the GTX file f into gfd (a new GFDData by default).
+    The image and mip data are memoryview slices of f, none of them is copied.
+    """
+    if gfd is None:
+        gfd = GFDData()
+
+    f = memoryview(f)
+
+    header, (surfBlkType, dataBlkType, mipBlkType) = readGFDHeader(f)
 
     pos = header.size
 
@@ -158,368 +380,460 @@ def readGFD(f):
     images = 0
     imgInfo = 0
 
-    gfd.dim = []
-    gfd.width = []
-    gfd.height = []
-    gfd.depth = []
-    gfd.numMips = []
-    gfd.format = []
-    gfd.aa = []
-    gfd.use = []
-    gfd.imageSize = []
-    gfd.imagePtr = []
-    gfd.mipSize = []
-    gfd.mipPtr = []
-    gfd.tileMode = []
-    gfd.swizzle = []
-    gfd.alignment = []
-    gfd.pitch = []
-    gfd.compSel = []
-    gfd.bpp = []
-    gfd.realSize = []
-
-    gfd.dataSize = []
-    gfd.data = []
-
-    gfd.mipOffsets = []
-    gfd.mipData = {}
+    data = []
+    mipData = {}
 
     while pos < len(f):  # Loop through the entire file, stop if reached the end of the file.
         block = GFDBlockHeader()
+
+        if pos + block.size > len(f):
+            raise TruncatedBlockError("Truncated block header at " + hex(pos))
+
         block.data(f, pos)
 
         if block.magic != b'BLK{':
-            raise ValueError("Invalid block header!")
+            raise InvalidHeaderError("Invalid block header!")
 
         pos += block.size
 
+        if pos + block.dataSize > len(f):
+            raise TruncatedBlockError("Truncated block at " + hex(pos - block.size))
+
+        gfd.blocks.append((block, pos))
+
         if block.type_ == surfBlkType:
             imgInfo += 1
             blockB = True
 
-            surface = GX2Surface()
-            surface.data(f, pos)
-
-            pos += surface.size
-
-            if not 1 <= surface.tileMode <= 16:
-                print("")
-                print("Invalid tileMode for image " + str(imgInfo - 1))
-                print("")
-                print("Exiting in 5 seconds...")
-                time.sleep(5)
-                sys.exit(1)
-
-            if surface.numMips > 14:
-                print("")
-                print("Invalid number of mipmaps for image " + str(imgInfo - 1))
-                print("")
-                print("Exiting in 5 seconds...")
-                time.sleep(5)
-                sys.exit(1)
+            if block.dataSize < 0x9c:
+                raise TruncatedBlockError("Truncated GX2 Surface for image " + str(imgInfo - 1))
 
-            mipOffsets = []
-            for i in range(13):
-                mipOffsets.append(
-                    f[i * 4 + pos] << 24 | f[i * 4 + 1 + pos] << 16 | f[i * 4 + 2 + pos] << 8 | f[i * 4 + 3 + pos])
-
-            gfd.mipOffsets.append(mipOffsets)
-
-            pos += 68
-
-            if surface.format_ in [0xa, 0xb, 0x19, 0x1a, 0x41a] or surface.format_ in BCn_formats:
-                compSel = [0, 1, 2, 3]
-
-            elif surface.format_ in [2, 7]:
-                compSel = [0, 5, 5, 1]
-
-            elif surface.format_ == 1:
-                compSel = [0, 5, 5, 5]
-
-            elif surface.format_ == 8:
-                compSel = [0, 1, 2, 5]
-
-            else:
-                compSel = []
-                for i in range(4):
-                    comp = f[pos + i]
-                    if comp == 4:  # Sorry, but this is unsupported.
-                        comp = i
-                    compSel.append(comp)
-
-            pos += 24
-
-            gfd.dim.append(surface.dim)
-            gfd.width.append(surface.width)
-            gfd.height.append(surface.height)
-            gfd.depth.append(surface.depth)
-            gfd.numMips.append(surface.numMips)
-            gfd.format.append(surface.format_)
-            gfd.aa.append(surface.aa)
-            gfd.use.append(surface.use)
-            gfd.imageSize.append(surface.imageSize)
-            gfd.imagePtr.append(surface.imagePtr)
-            gfd.mipSize.append(surface.mipSize)
-            gfd.mipPtr.append(surface.mipPtr)
-            gfd.tileMode.append(surface.tileMode)
-            gfd.swizzle.append(surface.swizzle)
-            gfd.alignment.append(surface.alignment)
-            gfd.pitch.append(surface.pitch)
-            gfd.compSel.append(compSel)
-
-            bpp = roundUp(addrlib.surfaceGetBitsPerPixel(surface.format_), 8)
-            gfd.bpp.append(bpp)
-
-            if surface.format_ in BCn_formats:
-                gfd.realSize.append(divRoundUp(surface.width, 4) * divRoundUp(surface.height, 4) * (bpp // 8))
-
-            else:
-                gfd.realSize.append(surface.width * surface.height * (bpp // 8))
+            gfd.surfaces.append(readSurface(f, pos, imgInfo - 1))
+            pos += block.dataSize
 
         elif block.type_ == dataBlkType:
             images += 1
             blockC = True
 
-            gfd.dataSize.append(block.dataSize)
-            gfd.data.append(f[pos:pos + block.dataSize])
+            data.append(f[pos:pos + block.dataSize])
             pos += block.dataSize
 
         elif block.type_ == mipBlkType:
-            gfd.mipData[images - 1] = f[pos:pos + block.dataSize]
+            mipData[images - 1] = f[pos:pos + block.dataSize]
             pos += block.dataSize
 
         else:
             pos += block.dataSize
 
     if images != imgInfo:
-        print("")
-        print("GX2 Surface and Image data count mismatch.")
-        print("")
-        print("Exiting in 5 seconds...")
-        time.sleep(5)
-        sys.exit(1)
+        raise TruncatedBlockError("GX2 Surface and Image data count mismatch.")
 
     if blockB:
         if not blockC:
-            print("")
-            print("GX2 Surface was found but no Image data was found.")
-            print("")
-            print("Exiting in 5 seconds...")
-            time.sleep(5)
-            sys.exit(1)
+            raise TruncatedBlockError("GX2 Surface was found but no Image data was found.")
     if not blockB:
         if not blockC:
-            print("")
-            print("No Image was found in this file.")
-            print("")
-            print("Exiting in 5 seconds...")
-            time.sleep(5)
-            sys.exit(1)
+            raise InvalidHeaderError("No Image was found in this file.")
 
         elif blockC:
-            print("")
-            print("Image data was found but no GX2 Surface was found.")
-            print("")
-            print("Exiting in 5 seconds...")
-            time.sleep(5)
-            sys.exit(1)
+            raise InvalidHeaderError("Image data was found but no GX2 Surface was found.")
 
-    gfd.numImages = images
+    for i, surface in enumerate(gfd.surfaces):
+        surface.data = data[i]
+        surface.mipData = mipData.get(i, b'')
 
     return gfd
 
 
-def get_deswizzled_data(i, gfd):
-    numImages = gfd.numImages
-    numMips = gfd.numMips[i]
-    width = gfd.width[i]
-    height = gfd.height[i]
-    depth = gfd.depth[i]
-    dim = gfd.dim[i]
-    format_ = gfd.format[i]
-    aa = gfd.aa[i]
-    use = gfd.use[i]
-    tileMode = gfd.tileMode[i]
-    swizzle_ = gfd.swizzle[i]
-    compSel = gfd.compSel[i]
-    data = gfd.data[i]
-    realSize = gfd.realSize[i]
-    mipOffsets = gfd.mipOffsets[i]
-
-    surfOut = addrlib.getSurfaceInfo(format_, width, height, depth, dim, tileMode, aa, 0)
-    bpp = divRoundUp(surfOut.bpp, 8)
+def readExactly(f, size):
+    """
+    Reads size bytes from the readable binary stream f.
+    """
+    data = bytearray(size)
+    view = memoryview(data)
 
-    try:
-        mipData = gfd.mipData[i]
+    pos = 0
+    while pos < size:
+        n = f.readinto(view[pos:])
+        if not n:
+            raise TruncatedBlockError("Unexpected end of file")
 
-    except KeyError:
-        mipData = b''
+        pos += n
 
-    if format_ in formats:
-        if aa != 0:
-            print("")
-            print("Unsupported aa!")
-            print("")
+    view.release()
+    return data
 
-            if i != (numImages - 1):
-                print("Continuing in 5 seconds...")
-                time.sleep(5)
-                return b'', []
 
-            else:
-                print("Exiting in 5 seconds...")
-                time.sleep(5)
-                sys.exit(1)
+def iterGFD(f):
+    """
+    Reads the GTX file from the readable binary stream f one block at a time.
+    Yields (surface, last) for every image as soon as the block that follows its data has been read,
+    so that it can be converted and released before the next one is read.
+    """
+    header, (surfBlkType, dataBlkType, mipBlkType) = readGFDHeader(f.read(GFDHeader().size))
 
-        if format_ == 0x00:
-            print("")
-            print("Invalid texture format!")
-            print("")
+    surface = None
+    image = 0
 
-            if i != (numImages - 1):
-                print("Continuing in 5 seconds...")
-                time.sleep(5)
-                return b'', []
+    while True:
+        block = GFDBlockHeader()
 
-            else:
-                print("Exiting in 5 seconds...")
-                time.sleep(5)
-                sys.exit(1)
+        blockHead = f.read(block.size)
+        if not blockHead:
+            break
 
-        else:
-            if format_ in [0x1a, 0x41a]:
-                format__ = 28
+        if len(blockHead) != block.size:
+            raise TruncatedBlockError("Truncated block header")
+
+        block.data(blockHead, 0)
+
+        if block.magic != b'BLK{':
+            raise InvalidHeaderError("Invalid block header!")
 
-            elif format_ == 0x19:
-                format__ = 24
+        data = readExactly(f, block.dataSize)
 
-            elif format_ == 0x8:
-                format__ = 85
+        if block.type_ == surfBlkType:
+            if surface is not None:
+                if surface.data is None:
+                    raise TruncatedBlockError("GX2 Surface was found but no Image data was found.")
 
-            elif format_ == 0xa:
-                format__ = 86
+                yield surface, False
+                image += 1
 
-            elif format_ == 0xb:
-                format__ = 115
+            if block.dataSize < 0x9c:
+                raise TruncatedBlockError("Truncated GX2 Surface for image " + str(image))
 
-            elif format_ == 0x1:
-                format__ = 61
+            surface = readSurface(data, 0, image)
 
-            elif format_ == 0x7:
-                format__ = 49
+        elif block.type_ == dataBlkType:
+            if surface is None or surface.data is not None:
+                raise TruncatedBlockError("GX2 Surface and Image data count mismatch.")
 
-            elif format_ == 0x2:
-                format__ = 112
+            surface.data = data
 
-            elif format_ in [0x31, 0x431]:
-                format__ = "BC1"
+        elif block.type_ == mipBlkType and surface is not None:
+            surface.mipData = data
 
-            elif format_ in [0x32, 0x432]:
-                format__ = "BC2"
+    if surface is None:
+        raise InvalidHeaderError("No Image was found in this file.")
 
-            elif format_ in [0x33, 0x433]:
-                format__ = "BC3"
+    if surface.data is None:
+        raise TruncatedBlockError("GX2 Surface was found but no Image data was found.")
 
-            elif format_ == 0x34:
-                format__ = "BC4U"
+    yield surface, True
 
-            elif format_ == 0x234:
-                format__ = "BC4S"
 
-            elif format_ == 0x35:
-                format__ = "BC5U"
+def iterImages(gfd):
+    """
+    Yields (surface, last) for every image of gfd, like iterGFD().
+    """
+    for i, surface in enumerate(gfd.surfaces):
+        yield surface, i == gfd.numImages - 1
 
-            elif format_ == 0x235:
-                format__ = "BC5S"
 
-            tilingDepth = surfOut.depth
-            if surfOut.tileMode == 3:
-                tilingDepth //= 4
+def getDDSFormat(format_):
+    """
+    Returns the format of the DDS the given GX2 format is extracted to (see dds.generateHeader()).
+    """
+    if format_ in [0x1a, 0x41a]:
+        return 28
 
-            if tilingDepth != 1:
-                print("")
-                print("Unsupported depth!")
-                print("")
+    elif format_ == 0x19:
+        return 24
 
-                if i != (numImages - 1):
-                    print("Continuing in 5 seconds...")
-                    time.sleep(5)
-                    return b'', b'', b''
+    elif format_ == 0x8:
+        return 85
 
-                else:
-                    print("Exiting in 5 seconds...")
-                    time.sleep(5)
-                    sys.exit(1)
+    elif format_ == 0xa:
+        return 86
 
-            if numMips > 1:
-                print("")
-                print("Processing " + str(numMips - 1) + " mipmap(s):")
+    elif format_ == 0xb:
+        return 115
 
-            if format_ in BCn_formats:
-                blkWidth, blkHeight = 4, 4
+    elif format_ == 0x1:
+        return 61
 
-            else:
-                blkWidth, blkHeight = 1, 1
+    elif format_ == 0x7:
+        return 49
 
-            result = []
-            for mipLevel in range(numMips):
-                width_ = max(1, width >> mipLevel)
-                height_ = max(1, height >> mipLevel)
+    elif format_ == 0x2:
+        return 112
 
-                size = divRoundUp(width_, blkWidth) * divRoundUp(height_, blkHeight) * bpp
+    elif format_ in [0x31, 0x431]:
+        return "BC1"
 
-                if mipLevel != 0:
-                    print(str(mipLevel) + ": " + str(width_) + "x" + str(height_))
+    elif format_ in [0x32, 0x432]:
+        return "BC2"
 
-                    mipOffset = mipOffsets[mipLevel - 1]
-                    if mipLevel == 1:
-                        mipOffset -= surfOut.surfSize
+    elif format_ in [0x33, 0x433]:
+        return "BC3"
 
-                    surfOut = addrlib.getSurfaceInfo(format_, width, height, depth, dim, tileMode, aa, mipLevel)
-                    data = mipData[mipOffset:mipOffset + surfOut.surfSize]
+    elif format_ == 0x34:
+        return "BC4U"
 
-                result_ = addrlib.deswizzle(
-                    width_, height_, 1, format_, 0, use, surfOut.tileMode,
-                    swizzle_, surfOut.pitch, surfOut.bpp, 0, 0, data,
-                )
+    elif format_ == 0x234:
+        return "BC4S"
 
-                result.append(result_[:size])
+    elif format_ == 0x35:
+        return "BC5U"
 
-            hdr = dds.generateHeader(numMips, width, height, format__, compSel, realSize, format_ in BCn_formats)
+    elif format_ == 0x235:
+        return "BC5S"
 
-    else:
-        print("")
-        print("Unsupported texture format_: " + hex(format_))
+
+def get_deswizzled_data(surface, firstMip=0, lastMip=None):
+    """
+    Deswizzles mip levels firstMip to lastMip (all of them by default) of the given surface,
+    the levels outside of that range are never touched.
+    Returns the header and data of a DDS holding them, firstMip being its base level.
+    Raises an UnsupportedSurfaceError if the image can't be extracted.
+    """
+    numMips = surface.numMips
+    width = surface.width
+    height = surface.height
+    depth = surface.depth
+    dim = surface.dim
+    format_ = surface.format_
+    aa = surface.aa
+    use = surface.use
+    tileMode = surface.tileMode
+    swizzle_ = surface.swizzle
+    compSel = surface.compSel
+
+    # The range is clamped to the levels of the image
+    if lastMip is None or lastMip >= numMips:
+        lastMip = numMips - 1
+
+    firstMip = min(firstMip, lastMip)
+
+    if format_ not in formats:
+        raise UnsupportedFormatError("Unsupported texture format_: " + hex(format_))
+
+    if aa != 0:
+        raise UnsupportedAAError("Unsupported aa!")
+
+    if format_ == 0x00:
+        raise UnsupportedFormatError("Invalid texture format!")
+
+    # The MSAA dims (6 and 7) can't be stored in a DDS
+    if dim not in [0, 1, 2, 3, 4, 5]:
+        raise UnsupportedDimError("Unsupported dim!")
+
+    format__ = getDDSFormat(format_)
+
+    if lastMip > 0:
         print("")
+        print("Processing " + str(lastMip - max(firstMip, 1) + 1) + " mipmap(s):")
 
-        if i != (numImages - 1):
-            print("Continuing in 5 seconds...")
-            time.sleep(5)
-            hdr, result = b'', []
+    layout = addrlib.getMipChainLayout(format_, width, height, depth, dim, tileMode, aa, numMips)
 
-        else:
-            print("Exiting in 5 seconds...")
-            time.sleep(5)
-            sys.exit(1)
+    # Offsets in the DDS, which starts at firstMip
+    levels = [level._replace(linearOffset=level.linearOffset - layout[firstMip].linearOffset)
+              for level in layout[firstMip:lastMip + 1]]
+
+    hdr = dds.generateHeader(len(levels), levels[0].width, levels[0].height, format__, compSel,
+                             levels[0].linearSize // levels[0].numSlices, format_ in BCn_formats,
+                             dim, levels[0].numSlices)
+
+    if hdr == b'':
+        raise UnsupportedFormatError("This format can't be stored in a DDS file of this type!")
+
+    # Deswizzle all the slices of all the levels straight into a single buffer, in DDS order
+    output = bytearray(levels[-1].linearOffset + levels[-1].linearSize)
+
+    for level, sliceOffsets in zip(levels, getDDSSliceOffsets(levels, dim)):
+        mipLevel = level.level
+        data = getLevelData(surface, layout, mipLevel)
 
-    return hdr, result
+        if mipLevel != 0:
+            print(str(mipLevel) + ": " + str(level.width) + "x" + str(level.height))
 
+        sliceSize = level.linearSize // level.numSlices
 
-def getCurrentMipOffset_Size(width, height, blkWidth, blkHeight, bpp, currLevel):
-    offset = 0
+        # The slices are addressed with the padded height of the level
+        levelHeight = level.pixelHeight if level.numSlices > 1 else level.height
 
-    for mipLevel in range(currLevel):
-        width_ = divRoundUp(max(1, width >> mipLevel), blkWidth)
-        height_ = divRoundUp(max(1, height >> mipLevel), blkHeight)
+        def deswizzleSlice(slice_):
+            addrlib.deswizzleInto(
+                level.width, levelHeight, level.numSlices, format_, 0, use, level.tileMode,
+                swizzle_, level.pitch, level.bpp, slice_, 0, data,
+                output, sliceOffsets[slice_], sliceSize,
+            )
 
-        offset += width_ * height_ * bpp
+        forEachSlice(deswizzleSlice, level.numSlices)
 
-    width_ = divRoundUp(max(1, width >> currLevel), blkWidth)
-    height_ = divRoundUp(max(1, height >> currLevel), blkHeight)
+    return hdr, [output]
 
-    size = width_ * height_ * bpp
 
-    return offset, size
+def getThumbnailMip(surface, width, height):
+    """
+    Returns the smallest mip level of the surface that is at least width x height, the base level if none is.
+    """
+    for mipLevel in reversed(range(surface.numMips)):
+        if max(surface.width >> mipLevel, 1) >= width and max(surface.height >> mipLevel, 1) >= height:
+            return mipLevel
+
+    return 0
+
+
+def getLevelData(surface, layout, mipLevel):
+    """
+    Returns the swizzled data of the given level of the surface, layout being its mip chain layout.
+    """
+    if mipLevel == 0:
+        return surface.data
+
+    mipOffset = surface.mipOffsets[mipLevel - 1]
+    if mipLevel == 1:
+        mipOffset -= layout[0].surfSize
+
+    return surface.mipData[mipOffset:mipOffset + layout[mipLevel].surfSize]
+
+
+def get_deswizzled_region(surface, mipLevel, x, y, w, h, slice_=0):
+    """
+    Deswizzles only the w x h pixels starting at pixel (x, y) of one slice of one level of the surface
+    (the 4x4 blocks covering them for BCn).
+    Returns the header and data of a single-level 2D DDS holding the region.
+    """
+    format_ = surface.format_
+
+    if format_ not in formats or format_ == 0x00:
+        raise UnsupportedFormatError("Unsupported texture format_: " + hex(format_))
+
+    if surface.aa != 0:
+        raise UnsupportedAAError("Unsupported aa!")
+
+    if not 0 <= mipLevel < surface.numMips:
+        raise ValueError("Invalid mip level: " + str(mipLevel))
+
+    layout = addrlib.getMipChainLayout(format_, surface.width, surface.height, surface.depth, surface.dim,
+                                       surface.tileMode, surface.aa, surface.numMips)
+
+    level = layout[mipLevel]
+
+    if not 0 <= slice_ < level.numSlices:
+        raise ValueError("Invalid slice: " + str(slice_))
+
+    # The slices are addressed with the padded height of the level
+    levelHeight = level.pixelHeight if level.numSlices > 1 else level.height
+
+    data = addrlib.deswizzleRegion(
+        x, y, w, h, level.width, levelHeight, level.numSlices, format_, 0, surface.use, level.tileMode,
+        surface.swizzle, level.pitch, level.bpp, slice_, 0, getLevelData(surface, layout, mipLevel),
+    )
+
+    if format_ in BCn_formats:
+        # Whole blocks were deswizzled
+        w = ((x + w + 3) // 4 - x // 4) * 4
+        h = ((y + h + 3) // 4 - y // 4) * 4
+
+    hdr = dds.generateHeader(1, w, h, getDDSFormat(format_), surface.compSel, len(data), format_ in BCn_formats)
+
+    if hdr == b'':
+        raise UnsupportedFormatError("This format can't be stored in a DDS file of this type!")
+
+    return hdr, [data]
+
+
+def printSurfaceInfo(surface):
+    compSel = ["R", "G", "B", "A", "0", "1"]
+
+    print("")
+    print("// ----- GX2Surface Info ----- ")
+    print("  dim             = " + str(surface.dim))
+    print("  width           = " + str(surface.width))
+    print("  height          = " + str(surface.height))
+    print("  depth           = " + str(surface.depth))
+    print("  numMips         = " + str(surface.numMips))
+
+    if surface.format_ in formats:
+        print("  format          = " + formats[surface.format_])
+
+    else:
+        print("  format          = " + hex(surface.format_))
+
+    print("  aa              = " + str(surface.aa))
+    print("  use             = " + str(surface.use))
+    print("  imageSize       = " + str(surface.imageSize))
+    print("  mipSize         = " + str(surface.mipSize))
+    print("  tileMode        = " + str(surface.tileMode))
+    print("  swizzle         = " + str(surface.swizzle) + ", " + hex(surface.swizzle))
+    print("  alignment       = " + str(surface.alignment))
+    print("  pitch           = " + str(surface.pitch))
+    print("")
+    print("  GX2 Component Selector:")
+    print("    Red Channel:    " + str(compSel[surface.compSel[0]]))
+    print("    Green Channel:  " + str(compSel[surface.compSel[1]]))
+    print("    Blue Channel:   " + str(compSel[surface.compSel[2]]))
+    print("    Alpha Channel:  " + str(compSel[surface.compSel[3]]))
+    print("")
+    print("  bits per pixel  = " + str(surface.bpp))
+    print("  bytes per pixel = " + str(surface.bpp // 8))
+    print("  realSize        = " + str(surface.realSize))
+
+    if surface.numMips > 1:
+        print("  mipOffsets      = " + ", ".join(hex(offset) for offset in surface.mipOffsets[:surface.numMips - 1]))
+
+
+def surfaceInfoDict(surface):
+    """
+    Returns the header fields of the surface as a dict that can be serialized to JSON.
+    """
+    return {
+        'dim': surface.dim,
+        'width': surface.width,
+        'height': surface.height,
+        'depth': surface.depth,
+        'numMips': surface.numMips,
+        'format': formats.get(surface.format_, hex(surface.format_)),
+        'aa': surface.aa,
+        'use': surface.use,
+        'imageSize': surface.imageSize,
+        'mipSize': surface.mipSize,
+        'tileMode': surface.tileMode,
+        'swizzle': surface.swizzle,
+        'alignment': surface.alignment,
+        'pitch': surface.pitch,
+        'compSel': surface.compSel,
+        'bpp': surface.bpp,
+        'realSize': surface.realSize,
+        'mipOffsets': surface.mipOffsets[:max(surface.numMips - 1, 0)],
+    }
+
+
+def extractImage(surface, firstMip, lastMip, thumbnail, name, capture=True):
+    """
+    Extracts mip levels firstMip to lastMip of the surface (the one closest to thumbnail if given)
+    to the DDS file name, or returns its data if name is "-".
+    Returns what was printed while doing so (if capture is set, else it's printed right away),
+    the data and the UnsupportedSurfaceError that was raised, if any.
+    """
+    messages = io.StringIO()
+    buffers = []
+    error = None
+
+    # An empty ExitStack does nothing (contextlib.nullcontext() needs Python 3.7)
+    with contextlib.redirect_stdout(messages) if capture else contextlib.ExitStack():
+        printSurfaceInfo(surface)
+
+        if thumbnail:
+            firstMip = lastMip = getThumbnailMip(surface, *thumbnail)
+
+        try:
+            hdr, result = get_deswizzled_data(surface, firstMip, lastMip)
+
+        except UnsupportedSurfaceError as e:
+            error = e
+
+        else:
+            buffers = [hdr] + result
+
+            if name != "-":
+                writeOutput(name, buffers)
+                buffers = []
+
+    return messages.getvalue(), buffers, error
 
 
 def warn_color():
@@ -539,84 +853,34 @@ def getAlignBlockSize(dataOffset, alignment):
 
 
 def writeGFD(f, tileMode, swizzle_, SRGB, n, pos, numImages):
-    width, height, format_, fourcc, dataSize, compSel, numMips, data = dds.readDDS(f, SRGB)
-
-    if 0 in [width, dataSize] and data == []:
-        print("")
-
-        if n != (numImages - 1):
-            print("Continuing in 5 seconds...")
-            time.sleep(5)
-            return b''
+    """
+    Returns the blocks of image n of the GTX file the DDS file f is converted to.
+    Raises a GTXError if f can't be converted.
+    """
+    try:
+        width, height, format_, fourcc, dataSize, compSel, numMips, data, dim, depth = dds.readDDS(f, SRGB, False)
 
-        else:
-            print("Exiting in 5 seconds...")
-            time.sleep(5)
-            sys.exit(1)
+    except ValueError as e:
+        raise InvalidHeaderError(str(e)) from None
 
     if format_ not in formats:
-        print("")
-        print("Unsupported DDS format!")
-        print("")
-
-        if n != (numImages - 1):
-            print("")
-            print("Continuing in 5 seconds...")
-            time.sleep(5)
-            return b''
-
-        else:
-            print("Exiting in 5 seconds...")
-            time.sleep(5)
-            sys.exit(1)
+        raise UnsupportedFormatError("Unsupported DDS format!")
 
     if numMips > 13:
-        print("")
-        print("Invalid number of mipmaps for " + f)
-        print("")
-
-        if n != (numImages - 1):
-            print("")
-            print("Continuing in 5 seconds...")
-            time.sleep(5)
-            return b''
-
-        else:
-            print("Exiting in 5 seconds...")
-            time.sleep(5)
-            sys.exit(1)
+        raise UnsupportedSurfaceError("Invalid number of mipmaps for " + f)
 
     numMips += 1
 
     if not tileMode:
-        tileMode = addrlib.getDefaultGX2TileMode(1, width, height, 1, format_, 0, 1)
+        tileMode = addrlib.getDefaultGX2TileMode(dim, width, height, depth, format_, 0, 1)
 
     bpp = addrlib.surfaceGetBitsPerPixel(format_) >> 3
-    surfOut = addrlib.getSurfaceInfo(format_, width, height, 1, 1, tileMode, 0, 0)
+    surfOut = addrlib.getSurfaceInfo(format_, width, height, depth, dim, tileMode, 0, 0)
 
     alignment = surfOut.baseAlign
     imageSize = surfOut.surfSize
     pitch = surfOut.pitch
 
-    tilingDepth = surfOut.depth
-    if surfOut.tileMode == 3:
-        tilingDepth //= 4
-
-    if tilingDepth != 1:
-        print("")
-        print("Unsupported depth!")
-        print("")
-
-        if n != (numImages - 1):
-            print("Continuing in 5 seconds...")
-            time.sleep(5)
-            return b''
-
-        else:
-            print("Exiting in 5 seconds...")
-            time.sleep(5)
-            sys.exit(1)
-
     s = swizzle_ << 8
 
     if numMips > 1:
@@ -629,6 +893,17 @@ def writeGFD(f, tileMode, swizzle_, SRGB, n, pos, numImages):
     else:
         blkWidth, blkHeight = 1, 1
 
+    # R and B are swapped (and RGB8 expanded to RGBX8) while swizzling, instead of in separate passes
+    swapRB = {0x8: 'rgb565', 0xa: 'rgb5a1', 0xb: 'rgba4', 0x19: 'bgr10a2', 0x1a: 'rgba8', 0x41a: 'rgba8'}
+
+    transform = None
+    if compSel[0] == 2 and compSel[2] == 0:
+        transform = swapRB.get(format_)
+
+    rgb8 = format_ in [0x1a, 0x41a] and dataSize == width * height * 3
+    if rgb8:
+        transform = 'bgr8' if transform else 'rgb8'
+
     swizzled_data = []
     mipSize = 0
     mipOffsets = []
@@ -636,34 +911,49 @@ def writeGFD(f, tileMode, swizzle_, SRGB, n, pos, numImages):
     tiling1dLevel = 0
     tiling1dLevelSet = False
 
-    for mipLevel in range(numMips):
-        offset, size = getCurrentMipOffset_Size(width, height, blkWidth, blkHeight, bpp, mipLevel)
-        data_ = data[offset:offset + size]
+    layout = addrlib.getMipChainLayout(format_, width, height, depth, dim, tileMode, 0, numMips)
 
-        width_ = max(1, width >> mipLevel)
-        height_ = max(1, height >> mipLevel)
+    for level, sliceOffsets in zip(layout, getDDSSliceOffsets(layout, dim)):
+        mipLevel = level.level
+        dataAlignSize = 0
 
         if mipLevel:
-            print(str(mipLevel) + ": " + str(width_) + "x" + str(height_))
-            surfOut = addrlib.getSurfaceInfo(format_, width, height, 1, 1, tileMode, 0, mipLevel)
+            print(str(mipLevel) + ": " + str(level.width) + "x" + str(level.height))
 
             if mipLevel == 1:
                 mipOffsets.append(imageSize)
 
             else:
-                mipOffsets.append(mipSize)
+                mipOffsets.append(level.offset)
 
-        data_ += b'\0' * (surfOut.surfSize - size)
-        dataAlignBytes = b'\0' * (roundUp(mipSize, surfOut.baseAlign) - mipSize)
+            dataAlignSize = level.offset - mipSize
+            mipSize = level.offset + level.surfSize
 
-        if mipLevel:
-            mipSize += surfOut.surfSize + len(dataAlignBytes)
+        sliceSize = level.linearSize // level.numSlices
+
+        if rgb8:
+            # The DDS still has 3 bytes per pixel
+            sliceOffsets = [offset // 4 * 3 for offset in sliceOffsets]
+            sliceSize = sliceSize // 4 * 3
 
-        swizzled_data.append(bytearray(dataAlignBytes) + addrlib.swizzle(
-            width_, height_, 1, format_, 0, 1, surfOut.tileMode,
-            s, surfOut.pitch, surfOut.bpp, 0, 0, data_))
+        # The slices are addressed with the padded height of the level
+        levelHeight = level.pixelHeight if level.numSlices > 1 else level.height
 
-        if surfOut.tileMode in [1, 2, 3, 16]:
+        # Swizzle right after the alignment bytes, the rest of the surface stays zeroed
+        swizzled = bytearray(dataAlignSize + level.surfSize)
+
+        def swizzleSlice(slice_):
+            addrlib.swizzleInto(
+                level.width, levelHeight, level.numSlices, format_, 0, 1, level.tileMode,
+                s, level.pitch, level.bpp, slice_, 0,
+                memoryview(data)[sliceOffsets[slice_]:sliceOffsets[slice_] + sliceSize],
+                swizzled, dataAlignSize, level.surfSize, transform=transform)
+
+        forEachSlice(swizzleSlice, level.numSlices)
+
+        swizzled_data.append(swizzled)
+
+        if level.tileMode in [1, 2, 3, 16]:
             tiling1dLevelSet = True
 
         if not tiling1dLevelSet:
@@ -691,45 +981,28 @@ def writeGFD(f, tileMode, swizzle_, SRGB, n, pos, numImages):
         if compSel not in [[0, 1, 2, 5], [2, 1, 0, 5]]:
             warn_color()
 
-        if compSel[0] == 2 and compSel[2] == 0:
-            swizzled_data = [dds.form_conv.swapRB_16bpp(data, 'rgb565') for data in swizzled_data]
-
         compSel = [0, 1, 2, 5]
 
     elif format_ in [0xa, 0xb]:
         if compSel not in [[0, 1, 2, 3], [2, 1, 0, 3]]:
             warn_color()
 
-        if compSel[0] == 2 and compSel[2] == 0:
-            if format_ == 0xb:
-                swizzled_data = [dds.form_conv.swapRB_16bpp(data, 'rgba4') for data in swizzled_data]
-
-            else:
-                swizzled_data = [dds.form_conv.swapRB_16bpp(data, 'rgb5a1') for data in swizzled_data]
-
         compSel = [0, 1, 2, 3]
 
     elif format_ in [0x1a, 0x41a, 0x19]:
         if compSel not in [[0, 1, 2, 3], [2, 1, 0, 3], [0, 1, 2, 5], [2, 1, 0, 5]]:
             warn_color()
 
-        if compSel[0] == 2 and compSel[2] == 0:
-            if format_ == 0x19:
-                swizzled_data = [dds.form_conv.swapRB_32bpp(data, 'bgr10a2') for data in swizzled_data]
-
-            else:
-                swizzled_data = [dds.form_conv.swapRB_32bpp(data, 'rgba8') for data in swizzled_data]
-
         compSel = [0, 1, 2, 3]
 
     compSels = ["R", "G", "B", "A", "0", "1"]
 
     print("")
     print("// ----- GX2Surface Info ----- ")
-    print("  dim             = 1")
+    print("  dim             = " + str(dim))
     print("  width           = " + str(width))
     print("  height          = " + str(height))
-    print("  depth           = 1")
+    print("  depth           = " + str(depth))
     print("  numMips         = " + str(numMips))
     print("  format          = " + formats[format_])
     print("  aa              = 0")
@@ -755,8 +1028,8 @@ def writeGFD(f, tileMode, swizzle_, SRGB, n, pos, numImages):
     gx2surf_blk_head = block_head_struct.pack(b"BLK{", 32, 1, 0, 0xb, 0x9c, 0, 0)
 
     gx2surf_struct = GX2Surface()
-    gx2surf = gx2surf_struct.pack(1, width, height, 1, numMips, format_, 0, 1, imageSize, 0, mipSize, 0, tileMode, s,
-                                  alignment, pitch)
+    gx2surf = gx2surf_struct.pack(dim, width, height, depth, numMips, format_, 0, 1, imageSize, 0, mipSize, 0, tileMode,
+                                  s, alignment, pitch)
 
     image_blk_head = block_head_struct.pack(b"BLK{", 32, 1, 0, 0xc, imageSize, 0, 0)
     mip_blk_head = block_head_struct.pack(b"BLK{", 32, 1, 0, 0xd, mipSize, 0, 0)
@@ -777,16 +1050,16 @@ def writeGFD(f, tileMode, swizzle_, SRGB, n, pos, numImages):
 
     output += numMips.to_bytes(4, 'big')
     output += b'\0' * 4
-    output += 1 .to_bytes(4, 'big')
+    output += depth.to_bytes(4, 'big')
 
     for value in compSel:
         output += value.to_bytes(1, 'big')
 
     if format_ in BCn_formats:
-        output += makeRegsBytearray(width, height, numMips, format_, tileMode, pitch * 4, compSel)
+        output += makeRegsBytearray(width, height, numMips, format_, tileMode, pitch * 4, compSel, dim, depth)
 
     else:
-        output += makeRegsBytearray(width, height, numMips, format_, tileMode, pitch, compSel)
+        output += makeRegsBytearray(width, height, numMips, format_, tileMode, pitch, compSel, dim, depth)
 
     alignSize = getAlignBlockSize(pos + len(output) + 32, alignment)
     align_blk_head = block_head_struct.pack(b"BLK{", 32, 1, 0, 2, alignSize, 0, 0)
@@ -809,15 +1082,159 @@ def writeGFD(f, tileMode, swizzle_, SRGB, n, pos, numImages):
     return output
 
 
+def retileImage(surface, tileMode, swizzle_):
+    """
+    Moves all the levels of the surface to tileMode and the pipe/bank swizzle swizzle_ (None to keep it),
+    straight from the old swizzled layout to the new one.
+    Returns its new layout, swizzle, mip offsets, image data and mip data.
+    """
+    numMips = surface.numMips
+    width = surface.width
+    height = surface.height
+    depth = surface.depth
+    dim = surface.dim
+    format_ = surface.format_
+    aa = surface.aa
+    use = surface.use
+    oldSwizzle = surface.swizzle
+
+    oldLayout = addrlib.getMipChainLayout(format_, width, height, depth, dim, surface.tileMode, aa, numMips)
+    layout = addrlib.getMipChainLayout(format_, width, height, depth, dim, tileMode, aa, numMips)
+
+    s = oldSwizzle & 0x700 if swizzle_ is None else swizzle_ << 8
+
+    imageData = bytearray(layout[0].surfSize)
+    newMipData = bytearray(layout[-1].offset + layout[-1].surfSize if numMips > 1 else 0)
+    newMipOffsets = []
+
+    tiling1dLevel = 0
+    tiling1dLevelSet = False
+
+    for oldLevel, level in zip(oldLayout, layout):
+        mipLevel = level.level
+
+        data = getLevelData(surface, oldLayout, mipLevel)
+
+        if mipLevel == 0:
+            out, offset = imageData, 0
+
+        else:
+            out, offset = newMipData, level.offset
+
+            newMipOffsets.append(layout[0].surfSize if mipLevel == 1 else level.offset)
+
+        def retileSlice(slice_):
+            # The slices are addressed with the padded height of the level
+            addrlib.retileInto(
+                addrlib.SurfaceDesc(level.width, oldLevel.pixelHeight if level.numSlices > 1 else level.height,
+                                    level.numSlices, format_, aa, use, oldLevel.tileMode, oldSwizzle,
+                                    oldLevel.pitch, level.bpp, slice_, 0),
+                addrlib.SurfaceDesc(level.width, level.pixelHeight if level.numSlices > 1 else level.height,
+                                    level.numSlices, format_, aa, use, level.tileMode, s,
+                                    level.pitch, level.bpp, slice_, 0),
+                data, out, offset, level.surfSize,
+            )
+
+        forEachSlice(retileSlice, level.numSlices)
+
+        if level.tileMode in [1, 2, 3, 16]:
+            tiling1dLevelSet = True
+
+        if not tiling1dLevelSet:
+            tiling1dLevel += 1
+
+    if tiling1dLevelSet:
+        s |= tiling1dLevel << 16
+
+    else:
+        s |= 13 << 16
+
+    return layout, s, newMipOffsets, imageData, newMipData
+
+
+def retileGFD(f, tileMode, swizzle_):
+    """
+    Returns a copy of the GTX file f with all of its images moved to tileMode (0 to keep theirs)
+    and the pipe/bank swizzle swizzle_ (None to keep theirs), without deswizzling them.
+    All the other blocks are kept as they are, except for the alignment of the image data.
+    """
+    gfd = readGFD(f)
+    header, (surfBlkType, dataBlkType, mipBlkType) = readGFDHeader(f)
+
+    output = bytearray(f[:header.size])
+    pos = header.size
+
+    i = -1
+
+    while pos < len(f):
+        block = GFDBlockHeader()
+        block.data(f, pos)
+
+        if block.magic != b'BLK{':
+            raise InvalidHeaderError("Invalid block header!")
+
+        blockData = f[pos + block.size:pos + block.size + block.dataSize]
+        pos += block.size + block.dataSize
+
+        if block.type_ == surfBlkType:
+            i += 1
+
+            surface = gfd.surfaces[i]
+            newTileMode = tileMode or surface.tileMode
+
+            print("")
+            print("Retiling image " + str(i) + ": tileMode " + str(surface.tileMode) + " -> " + str(newTileMode))
+
+            layout, s, mipOffsets, imageData, mipData = retileImage(surface, newTileMode, swizzle_)
+
+            pitch = layout[0].pitch * 4 if surface.format_ in BCn_formats else layout[0].pitch
+
+            blockData = bytearray(blockData)
+            GX2Surface().pack_into(blockData, 0, surface.dim, surface.width, surface.height, surface.depth,
+                                   surface.numMips, surface.format_, surface.aa, surface.use, len(imageData),
+                                   surface.imagePtr, len(mipData), surface.mipPtr, newTileMode, s,
+                                   layout[0].baseAlign, layout[0].pitch)
+
+            struct.pack_into('>13I', blockData, 64, *(mipOffsets + [0] * (13 - len(mipOffsets))))
+
+            # Only the pitch and tileMode of the texture registers change
+            register0 = struct.unpack_from('>I', blockData, 136)[0] & ~(0x7FF << 8 | 0xF << 3)
+            register0 |= ((max(pitch, 8) // 8 - 1) & 0x7FF) << 8 | (newTileMode & 0xF) << 3
+            struct.pack_into('>I', blockData, 136, register0)
+
+        elif block.type_ == dataBlkType:
+            blockData = imageData
+
+        elif block.type_ == mipBlkType:
+            blockData = mipData
+
+        elif block.type_ == 2 and pos < len(f):
+            # Realign the data that follows
+            nextBlock = GFDBlockHeader()
+            nextBlock.data(f, pos)
+
+            if nextBlock.type_ in [dataBlkType, mipBlkType]:
+                blockData = bytes(getAlignBlockSize(len(output) + block.size, layout[0].baseAlign))
+
+        output += block.pack(block.magic, block.size_, block.majorVersion, block.minorVersion, block.type_,
+                             len(blockData), block.id, block.typeIdx)
+        output += blockData
+
+    return output
+
+
 def printInfo():
     print("")
     print("Usage:")
     print("  gtx_extract [option...] input")
+    print("  (input can be - to read a GTX file from the standard input)")
     print("")
     print("Options:")
     print(
         " -o <output>           Output file, if not specified, the output file will have the same name as the intput file")
     print("                       Will be ignored if the GTX has multiple images")
+    print("                       - writes to the standard output (all the images, one after the other)")
+    print(" -strict               stop at the first image that can't be converted (by default, it's skipped)")
     print("")
     print("DDS to GTX options:")
     print(" -tileMode <tileMode>  tileMode (by default, the optimal tileMode will be selected)")
@@ -826,6 +1243,26 @@ def printInfo():
     print(
         " -multi <numImages>    number of images to pack into the GTX file (input file must be the first image, 1 is the default)")
     print("")
+    print("GTX info options:")
+    print(" -info                 only print the GX2 Surface info of the input file(s), without extracting them")
+    print(" -json                 same as -info, but written to the standard output as JSON")
+    print("")
+    print("GTX retiling options:")
+    print(" -retile               move all the images of the GTX to another tileMode/swizzle without deswizzling them")
+    print("                       (the input file is overwritten unless -o is given)")
+    print(" -tileMode <tileMode>  the new tileMode (0, the default, keeps the current one)")
+    print(" -swizzle <swizzle>    the new swizzle pattern, from 0 to 7 (by default, the current one is kept)")
+    print("")
+    print("GTX to DDS options:")
+    print(" -mips <a>[,<b>]       only extract mip levels a to b (all of them by default)")
+    print(" -thumbnail <w>[,<h>]  only extract the smallest mip level that is at least w x h")
+    print(" -region <x,y,w,h>     only extract the w x h pixels starting at (x, y)")
+    print("                       (extended to whole 4x4 blocks for compressed formats)")
+    print(" -image <n>            image the region is taken from (0 is the default)")
+    print(" -mip <n>              mip level the region is taken from (0 is the default)")
+    print(" -slice <n>            slice the region is taken from (0 is the default)")
+    print(" -j <n>                number of images extracted in parallel (1 is the default)")
+    print("")
     print("Supported tileModes:")
     print(" - GX2_TILE_MODE_DEFAULT (0)")
     print(" - GX2_TILE_MODE_LINEAR_ALIGNED (1)")
@@ -865,20 +1302,45 @@ def printInfo():
     print(" - GX2_SURFACE_FORMAT_T_BC4_SNORM")
     print(" - GX2_SURFACE_FORMAT_T_BC5_UNORM")
     print(" - GX2_SURFACE_FORMAT_T_BC5_SNORM")
+
+    exitWithError()
+
+
+def exitWithError():
+    # Only wait for the message to be read when running in a console window
     print("")
-    print("Exiting in 5 seconds...")
-    time.sleep(5)
+
+    if sys.stdin.isatty() and sys.stdout.isatty():
+        print("Exiting in 5 seconds...")
+        time.sleep(5)
+
     sys.exit(1)
 
 
-def main():
-    print("GTX Extractor v5.4")
-    print("(C) 2015-2019 AboodXD")
+def printError(e, name):
+    print("")
+    print(name + ": " + str(e))
 
-    input_ = sys.argv[-1]
 
-    if not (input_.endswith('.gtx') or input_.endswith('.dds')):
-        printInfo()
+def writeOutput(name, buffers):
+    """
+    Writes the buffers to the file name, or to the standard output if name is "-".
+    """
+    if name == "-":
+        output = sys.__stdout__.buffer
+        for data in buffers:
+            output.write(data)
+
+        output.flush()
+
+    else:
+        with open(name, "wb+") as output:
+            for data in buffers:
+                output.write(data)
+
+
+def main():
+    input_ = sys.argv[-1]
 
     toGTX = False
 
@@ -887,9 +1349,72 @@ def main():
 
     if "-o" in sys.argv:
         output_ = sys.argv[sys.argv.index("-o") + 1]
+    elif input_ == "-":
+        output_ = "-"
     else:
         output_ = os.path.splitext(input_)[0] + (".gtx" if toGTX else ".dds")
 
+    # The messages go to the standard error when the output is written to the standard output
+    if output_ == "-" or "-json" in sys.argv:
+        sys.stdout = sys.stderr
+
+    print("GTX Extractor v5.4")
+    print("(C) 2015-2019 AboodXD")
+
+    # "-" reads a GTX file from the standard input
+    if not (input_.endswith('.gtx') or input_.endswith('.dds') or input_ == "-"):
+        printInfo()
+
+    # Images that can't be converted are skipped, unless -strict is given
+    strict = "-strict" in sys.argv
+    failed = 0
+
+    if "-info" in sys.argv or "-json" in sys.argv:
+        # Only the block headers and GX2 Surfaces are read, the images are never deswizzled
+        report = []
+
+        for name in [arg for arg in sys.argv[1:] if arg.endswith('.gtx') or arg == "-"]:
+            surfaces = []
+            infos = []
+
+            try:
+                if name == "-":
+                    for surface, last in iterGFD(sys.stdin.buffer):
+                        # Only the header of the surface is kept, its data is released before the next block is read
+                        surface.data = surface.mipData = None
+                        surfaces.append(surface)
+                        infos.append(surfaceInfoDict(surface))
+
+                else:
+                    with GTXFile(name) as gtx:
+                        surfaces = gtx.surfaces
+                        infos = [surfaceInfoDict(surface) for surface in surfaces]
+
+            # Files that can't be read get an error entry, like invalid ones
+            except (GTXError, OSError) as e:
+                printError(e, name)
+                report.append({'file': name, 'error': str(e)})
+
+                failed += 1
+                continue
+
+            report.append({'file': name, 'surfaces': infos})
+
+            if "-json" not in sys.argv:
+                print("")
+                print("File: " + name)
+
+                for surface in surfaces:
+                    printSurfaceInfo(surface)
+
+        if "-json" in sys.argv:
+            writeOutput("-", [json.dumps(report, indent=2).encode() + b"\n"])
+
+        if failed:
+            sys.exit(1)
+
+        return
+
     if toGTX:
         if "-tileMode" in sys.argv:
             tileMode = int(sys.argv[sys.argv.index("-tileMode") + 1], 0)
@@ -931,7 +1456,18 @@ def main():
                 print("")
                 print('Converting: ' + input_ + str(i) + ".dds")
 
-                data = writeGFD(input_ + str(i) + ".dds", tileMode, swizzle, SRGB, i, pos, numImages)
+                try:
+                    data = writeGFD(input_ + str(i) + ".dds", tileMode, swizzle, SRGB, i, pos, numImages)
+
+                except GTXError as e:
+                    printError(e, input_ + str(i) + ".dds")
+
+                    if strict:
+                        exitWithError()
+
+                    failed += 1
+                    continue
+
                 pos += len(data)
 
                 outBuffer += data
@@ -939,7 +1475,13 @@ def main():
             print("")
             print('Converting: ' + input_)
 
-            data = writeGFD(input_, tileMode, swizzle, SRGB, 0, pos, 1)
+            try:
+                data = writeGFD(input_, tileMode, swizzle, SRGB, 0, pos, 1)
+
+            except GTXError as e:
+                printError(e, input_)
+                exitWithError()
+
             outBuffer += data
 
         block_head_struct = GFDBlockHeader()
@@ -947,72 +1489,187 @@ def main():
 
         outBuffer += eof_blk_head
 
-        with open(output_, "wb+") as output:
-            output.write(outBuffer)
+        writeOutput(output_, [outBuffer])
+
+    elif "-retile" in sys.argv:
+        if "-tileMode" in sys.argv:
+            tileMode = int(sys.argv[sys.argv.index("-tileMode") + 1], 0)
+        else:
+            tileMode = 0
+
+        if "-swizzle" in sys.argv:
+            swizzle = int(sys.argv[sys.argv.index("-swizzle") + 1], 0)
+        else:
+            swizzle = None
+
+        if not 0 <= tileMode <= 16 or not (swizzle is None or 0 <= swizzle <= 7):
+            printInfo()
+
+        if "-o" not in sys.argv:
+            output_ = input_
+
+        print("")
+        print('Retiling: ' + input_)
+
+        if input_ == "-":
+            inb = sys.stdin.buffer.read()
+
+        else:
+            with open(input_, "rb") as inf:
+                inb = inf.read()
+
+        try:
+            outBuffer = retileGFD(inb, tileMode, swizzle)
+
+        except GTXError as e:
+            printError(e, input_)
+            exitWithError()
+
+        writeOutput(output_, [outBuffer])
+
+    elif "-region" in sys.argv:
+        print("")
+        print('Converting: ' + input_)
+
+        try:
+            gfd = readGFD(sys.stdin.buffer.read()) if input_ == "-" else GTXFile(input_)
+
+        except GTXError as e:
+            printError(e, input_)
+            exitWithError()
+
+        x, y, w, h = [int(n, 0) for n in sys.argv[sys.argv.index("-region") + 1].split(",")]
+
+        i = int(sys.argv[sys.argv.index("-image") + 1], 0) if "-image" in sys.argv else 0
+        mipLevel = int(sys.argv[sys.argv.index("-mip") + 1], 0) if "-mip" in sys.argv else 0
+        slice_ = int(sys.argv[sys.argv.index("-slice") + 1], 0) if "-slice" in sys.argv else 0
+
+        if not 0 <= i < gfd.numImages:
+            printInfo()
+
+        print("")
+        print("Extracting region " + str(w) + "x" + str(h) + " at (" + str(x) + ", " + str(y) + ") of image "
+              + str(i) + ", level " + str(mipLevel) + ", slice " + str(slice_))
+
+        try:
+            hdr, result = get_deswizzled_region(gfd.surfaces[i], mipLevel, x, y, w, h, slice_)
+
+        except ValueError as e:
+            printError(e, input_)
+            exitWithError()
+
+        writeOutput(output_, [hdr] + result)
+
+        if input_ != "-":
+            gfd.close()
 
     else:
         print("")
         print('Converting: ' + input_)
 
-        with open(input_, "rb") as inf:
-            inb = inf.read()
+        firstMip, lastMip = 0, None
+        if "-mips" in sys.argv:
+            mips = [int(n, 0) for n in sys.argv[sys.argv.index("-mips") + 1].split(",")]
+            firstMip, lastMip = mips[0], mips[-1]
 
-        compSel = ["R", "G", "B", "A", "0", "1"]
+            if not 0 <= firstMip <= lastMip:
+                printInfo()
 
-        gfd = readGFD(inb)
+        thumbnail = None
+        if "-thumbnail" in sys.argv:
+            size = [int(n, 0) for n in sys.argv[sys.argv.index("-thumbnail") + 1].split(",")]
+            thumbnail = size[0], size[-1]
 
-        for i in range(gfd.numImages):
+        numJobs = 1
+        if "-j" in sys.argv:
+            numJobs = int(sys.argv[sys.argv.index("-j") + 1], 0)
 
-            print("")
-            print("// ----- GX2Surface Info ----- ")
-            print("  dim             = " + str(gfd.dim[i]))
-            print("  width           = " + str(gfd.width[i]))
-            print("  height          = " + str(gfd.height[i]))
-            print("  depth           = " + str(gfd.depth[i]))
-            print("  numMips         = " + str(gfd.numMips[i]))
+            if numJobs < 1:
+                printInfo()
 
-            if gfd.format[i] in formats:
-                print("  format          = " + formats[gfd.format[i]])
+        # Images read from the standard input are converted as soon as they have been read
+        if input_ == "-":
+            images = iterGFD(sys.stdin.buffer)
+            base = os.path.splitext(output_)[0]
 
-            else:
-                print("  format          = " + hex(gfd.format[i]))
-
-            print("  aa              = " + str(gfd.aa[i]))
-            print("  use             = " + str(gfd.use[i]))
-            print("  imageSize       = " + str(gfd.imageSize[i]))
-            print("  mipSize         = " + str(gfd.mipSize[i]))
-            print("  tileMode        = " + str(gfd.tileMode[i]))
-            print("  swizzle         = " + str(gfd.swizzle[i]) + ", " + hex(gfd.swizzle[i]))
-            print("  alignment       = " + str(gfd.alignment[i]))
-            print("  pitch           = " + str(gfd.pitch[i]))
-            print("")
-            print("  GX2 Component Selector:")
-            print("    Red Channel:    " + str(compSel[gfd.compSel[i][0]]))
-            print("    Green Channel:  " + str(compSel[gfd.compSel[i][1]]))
-            print("    Blue Channel:   " + str(compSel[gfd.compSel[i][2]]))
-            print("    Alpha Channel:  " + str(compSel[gfd.compSel[i][3]]))
-            print("")
-            print("  bits per pixel  = " + str(gfd.bpp[i]))
-            print("  bytes per pixel = " + str(gfd.bpp[i] // 8))
-            print("  realSize        = " + str(gfd.realSize[i]))
+        else:
+            try:
+                gtx = GTXFile(input_)
 
-            if gfd.numImages > 1:
-                output_ = os.path.splitext(input_)[0] + str(i) + ".dds"
+            except GTXError as e:
+                printError(e, input_)
+                exitWithError()
 
-            hdr, result = get_deswizzled_data(i, gfd)
+            images = iterImages(gtx)
+            base = os.path.splitext(input_)[0]
 
-            if hdr == b'' or result == []:
-                pass
+        # With -j, the images are extracted by a pool of processes, but their messages are printed in order
+        executor = ProcessPoolExecutor(numJobs) if numJobs > 1 else None
+        jobs = deque()
 
-            else:
-                with open(output_, "wb+") as output:
-                    output.write(hdr)
-                    for data in result:
-                        output.write(data)
+        def finishJob(n, job):
+            messages, buffers, error = job.result()
+            print(messages, end="")
+
+            if error is not None:
+                printError(error, "Image " + str(n))
+
+                if strict:
+                    for _, pending in jobs:
+                        pending.cancel()
+
+                    exitWithError()
+
+                return 1
+
+            if buffers:
+                writeOutput("-", buffers)
+
+            return 0
+
+        try:
+            for n, (surface, last) in enumerate(images):
+                # Multiple images are numbered, unless they're all written to the standard output
+                name = output_
+                if output_ != "-" and not (n == 0 and last):
+                    name = base + str(n) + ".dds"
+
+                if executor is None:
+                    job = Future()
+                    job.set_result(extractImage(surface, firstMip, lastMip, thumbnail, name, False))
+
+                else:
+                    job = executor.submit(extractImage, surface, firstMip, lastMip, thumbnail, name)
+
+                jobs.append((n, job))
+
+                # A few more images than there are processes are in flight,
+                # so that they're kept busy without reading a streamed input too far ahead
+                while len(jobs) > (numJobs - 1) * 2:
+                    failed += finishJob(*jobs.popleft())
+
+            while jobs:
+                failed += finishJob(*jobs.popleft())
+
+        except GTXError as e:
+            printError(e, input_)
+            exitWithError()
+
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        if input_ != "-":
+            gtx.close()
 
     print('')
     print('Finished converting: ' + input_)
 
+    if failed:
+        print(str(failed) + " image(s) couldn't be converted")
+        sys.exit(1)
+
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support()
     main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules are run from the root of the repository, they aren't installed
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
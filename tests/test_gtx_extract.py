@@ -0,0 +1,116 @@
+import io
+import json
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import addrlib
+import gtx_extract
+
+
+def buildGTX(dim, width, height, depth, format_, tileMode, data):
+    """
+    Returns a GTX file with a single image, whose linear data is swizzled with the given tile mode.
+    """
+    surfOut = addrlib.getSurfaceInfo(format_, width, height, depth, dim, tileMode, 0, 0)
+    image = bytes(addrlib.swizzleInto(width, height, depth, format_, 0, 1, surfOut.tileMode, 0,
+                                      surfOut.pitch, surfOut.bpp, 0, 0, data, size=surfOut.surfSize))
+
+    surface = struct.pack('>16I', dim, width, height, depth, 1, format_, 0, 1, surfOut.surfSize, 0, 0, 0,
+                          surfOut.tileMode, 0, surfOut.baseAlign, surfOut.pitch)
+    surface += bytes(13 * 4) + bytes([0, 1, 2, 3]) + bytes(0x9c - len(surface) - 13 * 4 - 4)
+
+    def block(type_, blockData):
+        return struct.pack('>4s7I', b'BLK{', 32, 1, 0, type_, len(blockData), 0, 0) + blockData
+
+    return (struct.pack('>4s7I', b'Gfx2', 32, 7, 1, 2, 1, 0, 0)
+            + block(0x0B, surface) + block(0x0C, image) + block(0x01, b''))
+
+
+class DimTest(unittest.TestCase):
+    def test1DSurface(self):
+        width = 64
+        data = bytes(i & 0xff for i in range(width * 4))
+
+        gtx = buildGTX(0, width, 1, 1, 0x1a, 4, data)
+        surfaces = [surface for surface, last in gtx_extract.iterGFD(io.BytesIO(gtx))]
+
+        hdr, result = gtx_extract.get_deswizzled_data(surfaces[0])
+
+        self.assertEqual(hdr[:4], b'DDS ')
+        self.assertEqual(struct.unpack_from('<2I', hdr, 12), (1, width))
+        self.assertEqual(bytes(b''.join(result)), data)
+
+    def testMSAASurface(self):
+        gtx = buildGTX(6, 64, 64, 1, 0x1a, 4, bytes(64 * 64 * 4))
+        surfaces = [surface for surface, last in gtx_extract.iterGFD(io.BytesIO(gtx))]
+
+        with self.assertRaises(gtx_extract.UnsupportedDimError):
+            gtx_extract.get_deswizzled_data(surfaces[0])
+
+
+class FileTestCase(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        self.directory = directory.name
+
+    def writeFile(self, name, data):
+        path = os.path.join(self.directory, name)
+        with open(path, "wb") as out:
+            out.write(data)
+
+        return path
+
+
+class GTXFileTest(FileTestCase):
+    def testOpen(self):
+        gtx = buildGTX(1, 64, 64, 1, 0x1a, 4, bytes(64 * 64 * 4))
+
+        with gtx_extract.GTXFile(self.writeFile("img.gtx", gtx)) as gtx:
+            self.assertEqual(gtx.numImages, 1)
+
+    def testEmptyFile(self):
+        with self.assertRaises(gtx_extract.InvalidHeaderError):
+            gtx_extract.GTXFile(self.writeFile("empty.gtx", b''))
+
+    def testInvalidFile(self):
+        with self.assertRaises(gtx_extract.InvalidHeaderError):
+            gtx_extract.GTXFile(self.writeFile("garbage.gtx", b'garbage' * 16))
+
+    def testTruncatedFile(self):
+        gtx = buildGTX(1, 64, 64, 1, 0x1a, 4, bytes(64 * 64 * 4))
+
+        # A second GX2 Surface without its image data, after the image data of the first one
+        with self.assertRaises(gtx_extract.TruncatedBlockError):
+            gtx_extract.GTXFile(self.writeFile("truncated.gtx", gtx + gtx[32:32 + 32 + 0x9c]))
+
+
+class InfoTest(FileTestCase):
+    def runJSON(self, *names):
+        script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "gtx_extract.py")
+        process = subprocess.run([sys.executable, script, "-json"] + list(names),
+                                 stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        return process.returncode, json.loads(process.stdout.decode())
+
+    def testBadFiles(self):
+        valid = self.writeFile("img.gtx", buildGTX(1, 64, 64, 1, 0x1a, 4, bytes(64 * 64 * 4)))
+        empty = self.writeFile("empty.gtx", b'')
+        missing = os.path.join(self.directory, "missing.gtx")
+
+        returncode, report = self.runJSON(valid, empty, missing)
+
+        self.assertEqual(returncode, 1)
+        self.assertEqual([entry['file'] for entry in report], [valid, empty, missing])
+        self.assertEqual(len(report[0]['surfaces']), 1)
+        self.assertIn('error', report[1])
+        self.assertIn('error', report[2])
+
+
+if __name__ == '__main__':
+    unittest.main()
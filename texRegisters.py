@@ -62,13 +62,17 @@ def _register4(type_, advisClampLOD, advisFaultLOD, interlaced, perfModulation,
     )
 
 
-def makeRegsBytearray(width, height, numMips, format_, tileMode, pitch, compSel):
+def makeRegsBytearray(width, height, numMips, format_, tileMode, pitch, compSel, dim=1, depth=1):
     # register0
     pitch = max(pitch, 8)
-    register0 = _register0(width - 1, (pitch // 8) - 1, 0, tileMode, 1)
+    register0 = _register0(width - 1, (pitch // 8) - 1, 0, tileMode, dim)
 
     # register1
-    register1 = _register1(format_, 0, height - 1)
+    if dim == 3:  # Number of cube maps
+        register1 = _register1(format_, depth // 6 - 1, height - 1)
+
+    else:
+        register1 = _register1(format_, depth - 1, height - 1)
 
     # register2
     formatComp = 0
@@ -90,7 +94,7 @@ def makeRegsBytearray(width, height, numMips, format_, tileMode, pitch, compSel)
     register2 = _register2(0, compSel[3], compSel[2], compSel[1], compSel[0], 2, 0, forceDegamma, 0, numFormat, formatComp)
 
     # register3
-    register3 = _register3(0, 0, 0, numMips - 1)
+    register3 = _register3(0, depth - 1 if dim != 2 else 0, 0, numMips - 1)
 
     # register4
     register4 = _register4(2, 0, 0, 0, 7, 4, 0)  # (2, 0, 0, 0, 0, 4, 0) in NSMBU